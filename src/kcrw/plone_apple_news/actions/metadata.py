@@ -63,10 +63,9 @@ class MetadataActionExecutor(object):
         adapter = IAppleNewsActions(obj, alternate=None)
         if adapter is not None:
             if adapter.data.get('id'):
-                if self.element.force_updates:
-                    adapter.refresh_revision()
                 json_data = json.loads(self.element.metadata)
-                adapter.update_metdata(json_data)
+                adapter.update_metadata(json_data,
+                                        force=self.element.force_updates)
                 return True
         return False
 
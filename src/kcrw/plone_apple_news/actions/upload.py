@@ -48,9 +48,7 @@ class UploadActionExecutor(object):
         adapter = IAppleNewsActions(obj, alternate=None)
         if adapter is not None:
             if adapter.data.get('id'):
-                if self.element.force_updates:
-                    adapter.refresh_revision()
-                adapter.update_article()
+                adapter.update_article(force=self.element.force_updates)
             else:
                 adapter.create_article()
             return True
@@ -4,11 +4,12 @@ from copy import deepcopy
 from Acquisition import aq_base
 from DateTime import DateTime
 from zope.annotation.interfaces import IAnnotations
+from zope.cachedescriptors.property import Lazy as lazy_property
 from zope.component import adapter, queryUtility
 from zope.interface import implementer
+from plone.api import portal
 from plone.api import user
 from plone.indexer import indexer
-from plone.scale.scale import scaleImage
 from plone.i18n.normalizer.interfaces import IFileNameNormalizer
 try:
     from Products.Archetypes.interfaces import IBaseContent
@@ -16,15 +17,27 @@ except ImportError:
     IBaseContent = None
 from OFS.Image import Pdata
 from Products.CMFCore.interfaces import IDublinCore
+from Products.CMFPlone.log import log
 from Products.CMFPlone.utils import safe_unicode
-from kcrw.apple_news import API, AppleNewsError
+from kcrw.apple_news import AppleNewsError
 from .interfaces import IAppleNewsActions
 from .interfaces import IAppleNewsSupport
 from .interfaces import IAppleNewsGenerator
 from .templates import METADATA_BASE
+from .client import api_available
+from .client import get_client
 from .html import obj_url
 from .html import process_html
+from . import metrics
+from .images import close_data
+from .images import scale_image
+from .images import scale_images
+from .outbox import queue_action
+from .outbox import queued_actions
+from .timing import timed
+from .timing import timer
 from .utils import article_base
+from .utils import article_digest
 from .utils import get_settings
 from .utils import mergedicts
 from .utils import pretty_text_list
@@ -48,48 +61,99 @@ META_FIELDS = set((
 ))
 
 
+def remove_components(components, urls):
+    """Removes components, including nested ones, which refer to any of the
+    given ``urls``"""
+    result = []
+    for component in components:
+        if component.get('URL') in urls:
+            continue
+        if 'components' in component:
+            component['components'] = remove_components(
+                component['components'], urls
+            )
+        result.append(component)
+    return result
+
+
 @adapter(IAppleNewsSupport)
 @implementer(IAppleNewsActions)
 class AppleNewsActions(object):
     """Provides actions for apple news integration"""
     annotations_key = 'kcrw.apple_news_info'
-    api = settings = article_adapter = None
 
     def __init__(self, context):
         self.context = context
-        self.article = IAppleNewsGenerator(context, alternate=None)
-        settings = self.settings = get_settings()
-        if settings and getattr(settings, 'api_key_id', None):
-            self.api = API(settings.api_key_id, settings.api_key_secret,
-                           settings.channel_id)
-        else:
-            raise AppleNewsError('API settings not set.')
+        self.settings = get_settings()
+
+    @lazy_property
+    def article(self):
+        return IAppleNewsGenerator(self.context, alternate=None)
+
+    @lazy_property
+    def api(self):
+        """The shared API client, only looked up when a request is made so
+        that the article data can be read without API credentials"""
+        return get_client(self.settings)
 
     @property
     def data(self):
         return IAnnotations(self.context).get(self.annotations_key, {})
 
-    def update_from_apple(self, article_data):
+    def update_from_apple(self, article_data, digest=None):
+        """Stores article info returned by the API along with the digest of
+        the uploaded content, keeping the current digest if none is given"""
+        if digest is None:
+            digest = self.data.get('digest')
         IAnnotations(self.context)[self.annotations_key] = {
             'id': article_data['data'].get('id'),
             'revision': article_data['data'].get('revision'),
             'metadata': self.extract_metadata(article_data),
+            'digest': digest,
         }
 
-    def make_api_request(self, method, *args):
+    def make_api_request(self, method, *args, **kw):
         """We commit a transaction before making the _slow_ API request,
         start a new transaction after, and commit after updating internal data.
-        Ideally this would be done via some async processing, which could be handled
-        via a custom adapter."""
+        When the ``queue_requests`` setting is enabled, requests are instead
+        queued in the outbox and this is only called when processing it."""
+        digest = kw.pop('digest', None)
         transaction.commit()
-        article_data = method(*args)
+        with timer('api', getattr(method, '__name__', None)):
+            article_data = method(*args)
         transaction.abort()
         transaction.begin()
-        self.update_from_apple(article_data)
+        self.update_from_apple(article_data, digest)
         transaction.commit()
         transaction.begin()
         return article_data
 
+    def defer(self, action, defer=None, **kw):
+        """Queues the action in the outbox instead of sending it now, if
+        requested or enabled in the settings. Returns True if queued.
+        Raises an error if the action should be sent now, but requests to
+        Apple News are suspended because it is failing."""
+        if defer is None:
+            defer = getattr(self.settings, 'queue_requests', False)
+        if defer:
+            queue_action(self.context, action, **kw)
+            return True
+        if not api_available(self.settings):
+            raise AppleNewsError(
+                'Apple News requests are suspended after repeated failures',
+                code=503
+            )
+        return False
+
+    def queue_after_create(self, action, defer=None, **kw):
+        """Queues an action for an article which isn't published yet, to be
+        sent after its create request waiting in the outbox. Raises an
+        error if there is none."""
+        if defer is not False and 'create' in queued_actions(self.context):
+            queue_action(self.context, action, **kw)
+            return
+        raise AppleNewsError('Article not yet published', code=418)
+
     def extract_metadata(self, article_data):
         data = article_data.get('data', {})
         meta = {k: data[k] for k in META_FIELDS if k in data}
@@ -97,72 +161,116 @@ class AppleNewsActions(object):
             del meta['links']['self']
         return meta
 
-    def create_article(self):
+    def create_article(self, defer=None):
         if self.data:
             self.context.reindexObject(idxs=['has_apple_news'])
             raise AppleNewsError('Article already published', code=418)
+        if self.defer('create', defer):
+            return
         adapter = self.article
         article = adapter.article_data()
         metadata = adapter.article_metadata()
         assets = adapter.article_assets()
         article_data = self.make_api_request(
             self.api.create_article,
-            article, metadata, assets
+            article, metadata, assets,
+            digest=article_digest(article, metadata, assets)
         )
         self.context.reindexObject(idxs=['has_apple_news'])
         return article_data
 
-    def update_article(self):
+    def update_article(self, defer=None, force=False):
         if not self.data:
-            raise AppleNewsError('Article not yet published', code=418)
+            return self.queue_after_create('update', defer, force=force)
+        if self.defer('update', defer, force=force):
+            return
+        metadata, article, assets = self.article_update_data()
+        digest = article_digest(article, metadata, assets)
+        if not force and digest == self.data.get('digest'):
+            # Nothing has changed since the last upload
+            return False
+
+        # Publish updates, forced updates always use the latest revision
+        return self.send_update(metadata, article, assets, digest=digest,
+                                refresh=force)
+
+    def article_update_data(self):
+        """Generates the metadata, article and assets for an update request,
+        without making any API requests"""
         adapter = self.article
         article = adapter.article_data()
         metadata = adapter.article_metadata()
         assets = adapter.article_assets()
         if not metadata:
             metadata = {'data': {}}
+        return metadata, article, assets
+
+    def send_update(self, metadata, article=None, assets=None,
+                    additional_data=None, digest=None, refresh=False):
+        """Sends an article update using the stored revision and metadata.
+        With ``optimistic_updates`` enabled the revision is only refreshed
+        from Apple News, and the update retried once, if Apple News reports
+        a conflict; otherwise, or if ``refresh`` is set, it is always
+        refreshed first."""
+        if not getattr(self.settings, 'optimistic_updates', True):
+            refresh = True
+        if refresh:
+            self.refresh_revision()
+        while True:
+            data = deepcopy(metadata)
+            self.apply_stored_metadata(data, self.data)
+            if additional_data:
+                data = dict(mergedicts(data, additional_data))
+            try:
+                return self.make_api_request(
+                    self.api.update_article,
+                    self.data['id'], data, article, assets,
+                    digest=digest
+                )
+            except AppleNewsError as e:
+                if refresh or e.code != 409:
+                    raise
+            # The stored revision is out of date
+            self.refresh_revision()
+            refresh = True
 
-        # Update metadata with stored data from Apple News
-        self.refresh_revision()
-        metadata['data'].update(self.data.get('metadata', {}))
-
-        metadata['data']['revision'] = self.data['revision']
-        # Publish updates
-        article_data = self.make_api_request(
-            self.api.update_article,
-            self.data['id'], metadata, article, assets
-        )
-        return article_data
-
-    def update_metadata(self, additional_data=None):
+    @staticmethod
+    def apply_stored_metadata(metadata, stored):
+        """Updates request metadata with the stored Apple News metadata
+        and revision"""
+        metadata['data'].update(stored.get('metadata', {}))
+        metadata['data']['revision'] = stored['revision']
+        return metadata
+
+    def update_metadata(self, additional_data=None, defer=None, force=False):
         if not self.data:
-            raise AppleNewsError('Article not yet published', code=418)
+            return self.queue_after_create(
+                'metadata', defer, additional_data=additional_data,
+                force=force
+            )
+        if self.defer('metadata', defer, additional_data=additional_data,
+                      force=force):
+            return
         adapter = self.article
-        article = adapter.article_data()
-        article_meta = {'metadata': article.get('metadata', {})}
+        # Only the metadata is sent, there's no need to generate the article
+        article_meta = {'metadata': adapter.article_meta()}
         metadata = adapter.article_metadata()
         if not metadata:
             metadata = {'data': {}}
+        # Forced updates always use the latest revision
+        return self.send_update(metadata, article_meta,
+                                additional_data=additional_data,
+                                refresh=force)
 
-        # Update metadata with stored data from Apple News
-        self.refresh_revision()
-        metadata['data'].update(self.data.get('metadata', {}))
-
-        metadata['data']['revision'] = self.data['revision']
-        if additional_data:
-            metadata = dict(mergedicts(metadata, additional_data))
-        article_data = self.make_api_request(
-            self.api.update_article,
-            self.data['id'], metadata, article_meta
-        )
-        return article_data
-
-    def delete_article(self):
+    def delete_article(self, defer=None):
         """Publishes a new Apple News Article"""
         if not self.data:
-            raise AppleNewsError('Article not yet published', code=418)
+            # Cancels a queued create
+            return self.queue_after_create('delete', defer, article_id=None)
+        if self.defer('delete', defer, article_id=self.data['id']):
+            return
         try:
-            self.api.delete_article(self.data['id'])
+            result = self.api.delete_article(self.data['id'])
         except AppleNewsError as e:
             # In case of 404 delete annotation key
             if e.code == 404:
@@ -171,6 +279,7 @@ class AppleNewsActions(object):
             raise
         del IAnnotations(self.context)[self.annotations_key]
         self.context.reindexObject(idxs=['has_apple_news'])
+        return result
 
     def refresh_revision(self):
         """Retrieves info about existing Apple News Article"""
@@ -191,11 +300,19 @@ class BaseAppleNewsGenerator(object):
     thumb_scale = 'medium'
     body_scale = 'large'
     footer = None
+    settings = None
+    image_scaling = u'threads'
+    image_scaling_workers = 4
+    # While generating an article, images which need scaling are collected
+    # here and scaled together, as many at a time as there are workers
+    scaling_jobs = None
+    # The filenames of the images which couldn't be scaled
+    scaling_failed = None
 
     def __init__(self, context):
         self.context = context
         self.assets = {}
-        settings = get_settings()
+        settings = self.settings = get_settings()
         if settings:
             self.primary_scale = getattr(settings, 'primary_scale', u'large')
             self.body_scale = getattr(settings, 'body_scale', u'large')
@@ -203,16 +320,62 @@ class BaseAppleNewsGenerator(object):
                 self.thumb_scale = settings.thumb_scale
             if getattr(settings, 'footer_html', None):
                 self.footer = settings.footer_html.strip()
+            if getattr(settings, 'image_scaling', None):
+                self.image_scaling = settings.image_scaling
+            if getattr(settings, 'image_scaling_workers', None):
+                self.image_scaling_workers = settings.image_scaling_workers
 
+    @metrics.render_duration.time(stage='article_data')
+    @timed('article_data')
     def article_data(self):
         """Gets JSON formatted article data"""
         context = self.context
-        article = article_base()
+        self.scaling_jobs = []
+        self.scaling_failed = set()
+        # Produce the lead image scales together, they'll be used from the
+        # assets when generating the lead photo and thumbnail
+        self.populate_images(context, self.image_name,
+                             [self.primary_scale, self.thumb_scale])
+        article = article_base(self.settings)
         article['identifier'] = self.get_identifier()
         article['title'] = self.get_title()
         article["language"] = self.context.Language() or u'en-US'
         article['components'].extend(self.article_components())
         meta = article["metadata"]
+        meta.update(self.get_meta())
+        thumb_name = self.populate_image(context, self.image_name,
+                                         self.thumb_scale)
+        if thumb_name:
+            meta['thumbnailURL'] = u'bundle://{}'.format(thumb_name)
+
+        failed = self.run_scaling_jobs()
+        if failed:
+            log(u'Unable to scale images {} for Apple News article {}'.format(
+                u', '.join(sorted(failed)), context.absolute_url()
+            ))
+            urls = set(u'bundle://{}'.format(f) for f in failed)
+            article['components'] = remove_components(article['components'],
+                                                      urls)
+            if meta.get('thumbnailURL') in urls:
+                del meta['thumbnailURL']
+        return article
+
+    def article_meta(self):
+        """Gets the ``metadata`` of the article JSON without generating the
+        article components or scaling any images"""
+        meta = article_base(self.settings).get('metadata', {})
+        meta.update(self.get_meta())
+        thumb_name = self.get_scale_filename(self.context, self.image_name,
+                                             self.thumb_scale)
+        if thumb_name:
+            meta['thumbnailURL'] = u'bundle://{}'.format(thumb_name)
+        return meta
+
+    def get_meta(self):
+        """Article metadata derived from the content: authors, dates,
+        excerpt and canonical URL"""
+        context = self.context
+        meta = {}
         authors = self.get_authors()
         if authors:
             meta["authors"] = authors
@@ -220,13 +383,8 @@ class BaseAppleNewsGenerator(object):
         meta["datePublished"] = self.date().ISO8601()
         meta["dateCreated"] = context.CreationDate()
         meta["dateModified"] = context.ModificationDate()
-        meta["canonicalURL"] = obj_url(context)
-        thumb_name = self.populate_image(context, self.image_name,
-                                         self.thumb_scale)
-        if thumb_name:
-            meta['thumbnailURL'] = u'bundle://{}'.format(thumb_name)
-
-        return article
+        meta["canonicalURL"] = obj_url(context, self.settings)
+        return meta
 
     def article_metadata(self):
         """Gets JSON formatted article metadata"""
@@ -246,31 +404,38 @@ class BaseAppleNewsGenerator(object):
         return safe_unicode(self.context.getId())
 
     @staticmethod
-    def get_image_filename(context, name):
+    def get_image(context, name):
+        """Returns the image stored in the named field"""
         # Archetypes Support
         if IBaseContent is not None and IBaseContent.providedBy(context):
             field = context.getField(name)
             if field is not None:
-                image = field.get(context)
-                if image is not None:
-                    fname = image.getFilename()
-                    if not fname:
-                        fname = context.getId()
-                    ctype = image.getContentType()
-                    ext = CONTENT_TYPE_MAP.get(ctype, '')
-                    if not fname.lower().endswith(ext) and not fname.lower().endswith('.jpeg'):
-                        fname += ext
-                    normalizer = queryUtility(IFileNameNormalizer)
-                    if normalizer is not None:
-                        fname = normalizer.normalize(safe_unicode(fname))
-                    return fname
+                return field.get(context)
             return None
         # Otherwise attribute lookup
         has_image = getattr(
             aq_base(context), name, None
         ) is not None
         if has_image:
-            image = getattr(context, name)
+            return getattr(context, name)
+
+    @classmethod
+    def get_image_filename(cls, context, name, image=None):
+        if image is None:
+            image = cls.get_image(context, name)
+        if image is None:
+            return None
+        # Archetypes Support
+        if IBaseContent is not None and IBaseContent.providedBy(context):
+            fname = image.getFilename()
+            if not fname:
+                fname = context.getId()
+            ctype = image.getContentType()
+            ext = CONTENT_TYPE_MAP.get(ctype, '')
+            lower = fname.lower()
+            if not lower.endswith(ext) and not lower.endswith('.jpeg'):
+                fname += ext
+        else:
             fname = getattr(image, 'filename', None)
             if not fname:
                 fname = context.getId()
@@ -278,63 +443,191 @@ class BaseAppleNewsGenerator(object):
             ext = CONTENT_TYPE_MAP.get(ctype, '')
             if ext not in fname.lower():
                 fname += ext
-            normalizer = queryUtility(IFileNameNormalizer)
-            if normalizer is not None:
-                fname = normalizer.normalize(safe_unicode(fname))
-            return fname
-
-    @staticmethod
-    def get_image_data(context, name):
+        normalizer = queryUtility(IFileNameNormalizer)
+        if normalizer is not None:
+            fname = normalizer.normalize(safe_unicode(fname))
+        return fname
+
+    @classmethod
+    def get_image_data(cls, context, name, image=None):
+        if image is None:
+            image = cls.get_image(context, name)
+        if image is None:
+            return None
         # Archetypes Support
         if IBaseContent is not None and IBaseContent.providedBy(context):
-            field = context.getField(name)
-            if field is not None:
-                image = field.get(context)
-                if image is not None:
-                    data = getattr(aq_base(image), 'data', None)
-                if isinstance(data, Pdata):
-                    return str(data)
-                return data
+            data = getattr(aq_base(image), 'data', None)
+            if isinstance(data, Pdata):
+                return str(data)
+            return data
         # Otherwise attribute lookup
-        has_image = getattr(
-            aq_base(context), name, None
-        ) is not None
-        if has_image:
-            image = getattr(context, name)
-            try:
-                return image.open()
-            except AttributeError:
-                return getattr(aq_base(image), 'data', image)
+        try:
+            return image.open()
+        except AttributeError:
+            return getattr(aq_base(image), 'data', image)
 
-    def populate_image(self, context, name, scale_name):
+    def get_scale_filename(self, context, name, scale_name):
+        """Returns the asset filename ``populate_images`` uses for a scale of
+        the named image, without scaling it"""
         filename = self.get_image_filename(context, name)
-        if filename is not None:
+        if filename is None:
+            return None
+        if not scale_name:
+            return filename
+        scales = context.unrestrictedTraverse('@@images').getAvailableSizes()
+        if scale_name not in scales or not all(scales[scale_name]):
+            return None
+        return u'{}-{}'.format(scale_name, safe_unicode(filename))
+
+    @staticmethod
+    def get_stored_scale(scale_view, name, scale_name):
+        """Returns the data for an image scale from the persistent scale
+        storage used by ``@@images``, which only scales the original image
+        if it hasn't already been scaled since it was last modified"""
+        try:
+            scale = scale_view.scale(name, scale=scale_name,
+                                     direction='thumbnail')
+        except TypeError:
+            return None
+        if scale is None:
+            return None
+        data = getattr(scale, 'data', None)
+        data = getattr(aq_base(data), 'data', data)
+        if isinstance(data, Pdata):
+            data = str(data)
+        if not isinstance(data, six.binary_type):
+            return None
+        return data
+
+    def populate_images(self, context, name, scale_names):
+        """Adds several scales of an image to the article assets. Scales
+        which aren't already stored are all produced from a single decoded
+        copy of the original image. Returns a mapping of scale names to
+        asset filenames."""
+        filenames = {}
+        image = self.get_image(context, name)
+        filename = None
+        if image is not None:
+            filename = self.get_image_filename(context, name, image)
+        if filename is None:
+            return filenames
+        scales = None
+        missing = {}
+        for scale_name in scale_names:
+            scale_filename = filename
             if scale_name:
-                filename = u'{}-{}'.format(scale_name, safe_unicode(filename))
-            if filename not in self.assets:
+                scale_filename = u'{}-{}'.format(scale_name,
+                                                 safe_unicode(filename))
+            if (scale_filename in self.assets or
+                    self.is_pending(scale_filename)):
+                filenames[scale_name] = scale_filename
+                continue
+            if scales is None:
                 scale_view = context.unrestrictedTraverse('@@images')
                 scales = scale_view.getAvailableSizes()
-                if scale_name not in scales:
-                    return
-                width, height = scales.get(scale_name)
-                data = self.get_image_data(context, name)
-                if not data or not width or not height:
-                    return
-                try:
-                    result = scaleImage(data, direction="thumbnail",
-                                        width=width, height=height,
-                                        allow_webp=False)
-                except TypeError:
-                    result = scaleImage(data, direction="thumbnail",
-                                        width=width, height=height)
-                if result is not None:
-                    data, format_, dimensions = result
-                    if not isinstance(data, six.string_types):
-                        data = data.data
-                    self.assets[filename] = data
+            if scale_name not in scales:
+                continue
+            width, height = scales.get(scale_name)
+            if not width or not height:
+                continue
+            with timer('image_scale', scale_name):
+                data = self.get_stored_scale(scale_view, name, scale_name)
+            if data:
+                metrics.image_scales.inc(result='hit')
+                self.assets[scale_filename] = data
+                filenames[scale_name] = scale_filename
+            else:
+                metrics.image_scales.inc(result='miss')
+                missing[scale_name] = (width, height)
+
+        if missing:
+            data = self.get_image_data(context, name, image)
+            if data:
+                missing_filenames = {
+                    scale_name: u'{}-{}'.format(scale_name,
+                                                safe_unicode(filename))
+                    for scale_name in missing
+                }
+                if self.scaling_jobs is not None:
+                    # Scale later, along with other article images
+                    self.add_scaling_job(data, missing, missing_filenames)
+                    filenames.update(missing_filenames)
                 else:
-                    filename = None
-        return filename
+                    filenames.update(
+                        self.scale_original(data, missing, missing_filenames)
+                    )
+        return filenames
+
+    def scale_original(self, data, sizes, filenames):
+        """Scales an image right away and adds the scales to the assets.
+        Returns a mapping of the scale names produced to their filenames."""
+        try:
+            with timer('image_scaling'):
+                scaled = scale_image(data, sizes)
+        finally:
+            close_data(data)
+        result = {}
+        for scale_name, data in scaled.items():
+            if data is not None:
+                self.assets[filenames[scale_name]] = data
+                result[scale_name] = filenames[scale_name]
+        return result
+
+    def is_pending(self, filename):
+        """Whether the asset ``filename`` is waiting to be scaled, or
+        couldn't be scaled"""
+        if filename in (self.scaling_failed or ()):
+            return True
+        for data, sizes, filenames in self.scaling_jobs or ():
+            if filename in filenames.values():
+                return True
+        return False
+
+    def add_scaling_job(self, data, sizes, filenames):
+        """Collects an image to scale. The original image data (a string or
+        file) is kept until it is scaled, so the collected images are
+        scaled as soon as there is one for each worker."""
+        self.scaling_jobs.append((data, sizes, filenames))
+        workers = 1
+        if self.image_scaling == u'threads':
+            workers = self.image_scaling_workers
+        if len(self.scaling_jobs) >= workers:
+            self.flush_scaling_jobs()
+
+    def flush_scaling_jobs(self):
+        """Scales the collected images in parallel and adds them to the
+        assets"""
+        jobs, self.scaling_jobs = self.scaling_jobs, []
+        try:
+            with timer('image_scaling', images=len(jobs)):
+                results = scale_images(
+                    [(data, sizes) for data, sizes, filenames in jobs],
+                    self.image_scaling, self.image_scaling_workers
+                )
+        finally:
+            for data, sizes, filenames in jobs:
+                close_data(data)
+        for (data, sizes, filenames), scaled in zip(jobs, results):
+            for scale_name, filename in filenames.items():
+                if scaled.get(scale_name) is not None:
+                    self.assets[filename] = scaled[scale_name]
+                else:
+                    self.scaling_failed.add(filename)
+
+    def run_scaling_jobs(self):
+        """Scales any remaining collected images, and stops collecting
+        them. Returns the filenames of any images which couldn't be
+        scaled."""
+        if self.scaling_jobs:
+            self.flush_scaling_jobs()
+        failed = self.scaling_failed or set()
+        self.scaling_jobs = self.scaling_failed = None
+        return failed
+
+    def populate_image(self, context, name, scale_name):
+        return self.populate_images(context, name, [scale_name]).get(
+            scale_name
+        )
 
     def get_primary_caption(self):
         context = self.context
@@ -546,9 +839,11 @@ class BaseAppleNewsGenerator(object):
 
         return components
 
-    def html_to_components(self, html, part_name='body'):
+    def html_to_components(self, html, part_name='body', context=None):
         components = []
-        parts = process_html(html, self.context, part_name)
+        if context is None:
+            context = self.context
+        parts = process_html(html, context, part_name)
         total = len(parts)
         for i, part in enumerate(parts):
             if isinstance(part, six.string_types):
@@ -586,7 +881,11 @@ class BaseAppleNewsGenerator(object):
     def footer_component(self):
         component = {}
         if self.footer:
-            components = self.html_to_components(self.footer, 'footer')
+            # The footer is the same for all articles, so it's processed for
+            # the site and cached until the footer or canonical URL changes
+            components = self.html_to_components(
+                self.footer, 'footer', context=portal.get()
+            )
             if len(components):
                 component = {
                     "role": "aside",
@@ -599,5 +898,9 @@ class BaseAppleNewsGenerator(object):
 
 @indexer(IAppleNewsSupport)
 def has_apple_news(obj):
-    adapter = IAppleNewsActions(obj)
-    return bool(adapter.data.get('id'))
+    # Read the annotation directly, indexing shouldn't need the adapter
+    annotations = IAnnotations(obj, None)
+    if annotations is None:
+        return False
+    info = annotations.get(AppleNewsActions.annotations_key)
+    return bool(info and info.get('id'))
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""Performance benchmarks, run individual modules with ``python -m``."""
+import timeit
+
+
+def best_of(func, number, repeat=5):
+    """Returns the best time in seconds for a single call of ``func``"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(name, seconds, baseline=None):
+    line = u'{:<40} {:>12.2f} us'.format(name, seconds * 1e6)
+    if baseline:
+        line += u' ({:.1f}x)'.format(baseline / seconds)
+    print(line)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""A corpus of synthetic article bodies for the HTML pipeline benchmarks.
+
+The bodies are generated from a fixed seed, so they are identical between
+runs and commits. Internal links and images use ``resolveuid`` URLs for the
+UIDs of ``CONTENT_UIDS``.
+"""
+import random
+from collections import OrderedDict
+
+SEED = 20201018
+CONTENT_UIDS = ['{:032x}'.format(i) for i in range(1, 201)]
+WORDS = (
+    u'the city council voted on tuesday to approve a new plan for housing '
+    u'transit and water after months of public hearings residents said '
+    u'they were worried about rents while officials promised that the '
+    u'program would bring jobs to neighborhoods across los angeles music '
+    u'radio station listeners festival budget café naïve résumé'
+).split()
+
+
+class Writer(object):
+
+    def __init__(self, seed=SEED):
+        self.random = random.Random(seed)
+
+    def words(self, count):
+        return u' '.join(self.random.choice(WORDS) for i in range(count))
+
+    def sentence(self, min_words=8, max_words=24):
+        text = self.words(self.random.randint(min_words, max_words))
+        return text[0].upper() + text[1:] + u'.'
+
+    def uid(self):
+        return self.random.choice(CONTENT_UIDS)
+
+    def link(self):
+        kind = self.random.random()
+        text = self.words(self.random.randint(1, 4))
+        if kind < 0.5:
+            href = u'resolveuid/{}'.format(self.uid())
+        elif kind < 0.8:
+            href = u'http://cms.example.com/site/news/story-{}'.format(
+                self.random.randint(1, 1000)
+            )
+        else:
+            href = u'https://www.example.org/{}?ref=kcrw#top'.format(
+                self.random.randint(1, 1000)
+            )
+        return u'<a href="{}">{}</a>'.format(href, text)
+
+    def paragraph(self, sentences=4, link_chance=0.0, markup=True):
+        parts = []
+        for i in range(sentences):
+            sentence = self.sentence()
+            if self.random.random() < link_chance:
+                sentence += u' ' + self.link()
+            if markup and self.random.random() < 0.15:
+                sentence = u'<strong>{}</strong>'.format(sentence)
+            elif markup and self.random.random() < 0.1:
+                sentence = u'<em class="discreet">{}</em>'.format(sentence)
+            parts.append(sentence)
+        return u'<p>{}</p>'.format(u' '.join(parts))
+
+    def image(self, internal=True):
+        classes = self.random.choice((
+            u'image-inline', u'image-left', u'image-right',
+            u'image-inline captioned', u'image-right captioned',
+        ))
+        if internal:
+            src = u'resolveuid/{}/@@images/image/large'.format(self.uid())
+        else:
+            src = u'https://images.example.org/{}.jpg'.format(
+                self.random.randint(1, 1000)
+            )
+        return u'<img src="{}" class="{}" alt="{}" />'.format(
+            src, classes, self.words(3)
+        )
+
+
+def short_news(writer):
+    """A typical short news story with a couple of links and one image"""
+    parts = [writer.paragraph(3, link_chance=0.2)]
+    parts.append(u'<p>{}</p>'.format(writer.image()))
+    parts.extend(writer.paragraph(4, link_chance=0.2) for i in range(4))
+    return u'\n'.join(parts)
+
+
+def long_form(writer, words=20000):
+    """A 20,000 word long-form feature with headings, lists and quotes"""
+    parts = []
+    count = 0
+    section = 0
+    while count < words:
+        if count // 1500 > section:
+            section += 1
+            parts.append(u'<h2>{}</h2>'.format(writer.words(5)))
+        kind = writer.random.random()
+        if kind < 0.08:
+            items = u''.join(u'<li>{}</li>'.format(writer.sentence())
+                             for i in range(writer.random.randint(3, 6)))
+            parts.append(u'<ul>{}</ul>'.format(items))
+        elif kind < 0.12:
+            parts.append(u'<blockquote><p>{}</p></blockquote>'.format(
+                writer.sentence(20, 40)
+            ))
+        elif kind < 0.14:
+            parts.append(u'<p>{} {}</p>'.format(writer.sentence(),
+                                                writer.image()))
+        else:
+            parts.append(writer.paragraph(writer.random.randint(3, 7),
+                                          link_chance=0.05))
+        count = sum(len(p.split()) for p in parts)
+    return u'\n'.join(parts)
+
+
+def image_heavy(writer, images=60):
+    """A photo essay, with images alone, inline with text and external"""
+    parts = []
+    for i in range(images):
+        kind = i % 4
+        if kind == 0:
+            parts.append(u'<p>{}</p>'.format(writer.image()))
+        elif kind == 1:
+            parts.append(u'<p>{} {} {}</p>'.format(
+                writer.sentence(), writer.image(), writer.sentence()
+            ))
+        elif kind == 2:
+            parts.append(u'<div><p>{}</p>{}</div>'.format(
+                writer.sentence(), writer.image(internal=False)
+            ))
+        else:
+            parts.append(writer.image())
+        parts.append(writer.paragraph(2))
+    return u'\n'.join(parts)
+
+
+def link_dense(writer, paragraphs=150):
+    """A round-up with several links in nearly every sentence"""
+    parts = []
+    for i in range(paragraphs):
+        sentences = [u'{} {} {}'.format(writer.sentence(), writer.link(),
+                                        writer.link())
+                     for j in range(4)]
+        parts.append(u'<p>{}</p>'.format(u' '.join(sentences)))
+    return u'\n'.join(parts)
+
+
+def nested_malformed(writer, depth=60, blocks=40):
+    """Pasted markup: deep nesting, unclosed and stray tags, tables,
+    comments, scripts, styles and embeds"""
+    parts = []
+    for i in range(blocks):
+        kind = i % 5
+        if kind == 0:
+            opening = u''.join(
+                u'<div class="wrapper-{}" style="margin: 0">'.format(d)
+                if d % 2 else u'<span style="text-decoration: underline">'
+                for d in range(depth)
+            )
+            parts.append(opening + writer.sentence())
+            # Unclosed, the parser has to close them all
+        elif kind == 1:
+            parts.append(u'<p>{}<p>{}</b></i> <font color="red">{}</p>'
+                         u'</div></span>'.format(writer.sentence(),
+                                                 writer.sentence(),
+                                                 writer.link()))
+        elif kind == 2:
+            rows = u''.join(
+                u'<tr><td>{}</td><td>{}</td></tr>'.format(writer.words(3),
+                                                          writer.link())
+                for r in range(5)
+            )
+            parts.append(u'<table>{}</table>'.format(rows))
+        elif kind == 3:
+            parts.append(
+                u'<!-- pasted from word --><script>var x = 1;</script>'
+                u'<style>p {{ color: red }}</style><p>{}</p>'
+                u'<iframe src="https://www.youtube.com/embed/{}"></iframe>'
+                u'<form><input name="q"><button>Go</button></form>'.format(
+                    writer.sentence(), writer.random.randint(1, 1000)
+                )
+            )
+        else:
+            parts.append(u'<h3>{}<p>{}</h3>{}'.format(
+                writer.words(4), writer.sentence(), writer.image()
+            ))
+    return u'\n'.join(parts)
+
+
+def corpus():
+    """Returns an ordered mapping of names to article bodies"""
+    bodies = OrderedDict()
+    for name, generate in (('short_news', short_news),
+                           ('long_form', long_form),
+                           ('image_heavy', image_heavy),
+                           ('link_dense', link_dense),
+                           ('nested_malformed', nested_malformed)):
+        bodies[name] = generate(Writer())
+    return bodies
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks the HTML to components pipeline on the article bodies in
+``corpus``, reporting the time and peak memory allocated by each stage::
+
+    python -m kcrw.plone_apple_news.benchmarks.pipeline
+
+Stages are parsing, UID resolution, each registered filter, all filters
+together (sharing walks of the tree between visitor filters), splitting into
+sections (including sanitising, also reported on its own as ``sanitise``),
+and the complete ``process_html``, ``apple_html`` and
+``BaseAppleNewsGenerator.html_to_components`` calls. Content is resolved
+from an in memory stand-in for the site, so only the pipeline is measured.
+
+Save the results of a run with ``--save`` and compare a later run (e.g. on
+another commit) against them with ``--compare``.
+"""
+import argparse
+import copy
+import json
+import time
+from lxml import html as lxml_html
+from kcrw.plone_apple_news import html
+from kcrw.plone_apple_news.adapter import BaseAppleNewsGenerator
+from kcrw.plone_apple_news.benchmarks.corpus import corpus
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, no allocation tracking
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+SITE_URL = u'http://cms.example.com/site'
+
+
+class FakeScale(object):
+    width = 768
+    height = 512
+
+    def __init__(self, url):
+        self.url = url
+
+    def absolute_url(self):
+        return self.url
+
+
+class FakeImages(object):
+    """Stands in for the ``@@images`` view"""
+
+    def __init__(self, content):
+        self.content = content
+
+    def scale(self, name, scale=None, pre=False):
+        return FakeScale(u'{}/@@images/{}/{}'.format(
+            self.content.absolute_url(), name, scale or u'image'
+        ))
+
+
+class FakeContent(object):
+    """Content which can be linked to and traversed to an image scale,
+    without any image data"""
+
+    def __init__(self, uid):
+        self.uid = uid
+
+    def absolute_url(self, relative=0):
+        path = u'section/{}'.format(self.uid)
+        if relative:
+            return path
+        return u'{}/{}'.format(SITE_URL, path)
+
+    def unrestrictedTraverse(self, name):
+        if name == '@@images':
+            return FakeImages(self)
+        raise KeyError(name)
+
+    def Description(self):
+        return u'Description of {}'.format(self.uid)
+
+    def getId(self):
+        return self.uid
+
+
+def resolve_uids(uids, context):
+    """The catalog lookup of ``html.resolve_uids``, in memory"""
+    return dict((uid, FakeContent(uid)) for uid in uids)
+
+
+class Stage(object):
+    """Accumulates the time taken by calls to a function"""
+
+    def __init__(self, func):
+        self.func = func
+        self.elapsed = 0.0
+
+    def __call__(self, *args, **kw):
+        start = timer()
+        try:
+            return self.func(*args, **kw)
+        finally:
+            self.elapsed += timer() - start
+
+
+def measure(func, repeat, timed=False):
+    """Returns the best time in seconds of ``repeat`` calls of ``func``, and
+    the peak memory allocated by a call, in bytes (None if it can't be
+    measured). If ``timed`` is set, ``func`` returns the time to report,
+    excluding any preparation."""
+    best = None
+    for i in range(repeat):
+        start = timer()
+        elapsed = func()
+        if not timed:
+            elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def parse(text):
+    parser = lxml_html.HTMLParser(remove_blank_text=True)
+    return lxml_html.fragment_fromstring(text, create_parent=True,
+                                         parser=parser)
+
+
+def benchmark(text, repeat):
+    """Returns an ordered list of ``(stage, seconds, peak bytes)``"""
+    results = []
+    context = FakeContent(u'context')
+    registry = html.processor_registry
+    tree = parse(text)
+
+    results.append(('parse',) + measure(lambda: parse(text), repeat))
+    results.append(('resolve_uids',) + measure(
+        lambda: html.resolve_uids(html.find_uids(tree), context), repeat
+    ))
+
+    def run_filter(func):
+        def run():
+            # Filters modify the tree, so work on a fresh copy
+            fresh = copy.deepcopy(tree)
+            start = timer()
+            func(fresh, context)
+            return timer() - start
+        return run
+
+    for name, func in registry.filter_registry:
+        results.append(('filter:' + name,) + measure(run_filter(func),
+                                                     repeat, timed=True))
+
+    results.append(('filters',) + measure(
+        run_filter(lambda fresh, c: html.apply_filters(fresh, c, registry)),
+        repeat, timed=True
+    ))
+
+    filtered = copy.deepcopy(tree)
+    html.apply_filters(filtered, context, registry)
+    splitters_only = html.HTMLProcessorRegistry()
+    splitters_only.splitter_registry = list(registry.splitter_registry)
+    splitters_only.splitter_tags = dict(registry.splitter_tags)
+    sanitise = Stage(html.el_list_to_html)
+    sanitise_times = []
+
+    def split():
+        fresh = copy.deepcopy(filtered)
+        html.processor_registry = splitters_only
+        html.el_list_to_html = sanitise
+        sanitise.elapsed = 0.0
+        try:
+            start = timer()
+            html.process_tree(fresh, context)
+            return timer() - start
+        finally:
+            html.processor_registry = registry
+            html.el_list_to_html = sanitise.func
+            sanitise_times.append(sanitise.elapsed)
+
+    split_time, split_peak = measure(split, repeat, timed=True)
+    results.append(('split', split_time, split_peak))
+    # Leave out the last run, slowed down by allocation tracking
+    results.append(('sanitise', min(sanitise_times[:repeat]), None))
+
+    results.append(('process_html',) + measure(
+        lambda: html.process_html(text, context), repeat
+    ))
+    results.append(('apple_html',) + measure(
+        lambda: html.apple_html(text), repeat
+    ))
+    generator = BaseAppleNewsGenerator(context)
+    results.append(('html_to_components',) + measure(
+        lambda: generator.html_to_components(text), repeat
+    ))
+    return results
+
+
+def format_row(name, seconds, peak, baseline=None):
+    line = u'  {:<22} {:>12.3f} ms'.format(name, seconds * 1e3)
+    line += u' {:>10} KiB'.format(
+        u'{:.0f}'.format(peak / 1024.0) if peak is not None else u'-'
+    )
+    if baseline:
+        line += u' {:>8.2f}x'.format(baseline / seconds if seconds else 0)
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u'Benchmark the HTML to components pipeline'
+    )
+    parser.add_argument('--repeat', type=int, default=5,
+                        help=u'Number of timed runs of each stage, the best '
+                             u'is reported')
+    parser.add_argument('--only', action='append', default=[],
+                        help=u'Only run the named corpus entries')
+    parser.add_argument('--save', help=u'Save the results to a JSON file')
+    parser.add_argument('--compare',
+                        help=u'Compare against results saved with --save')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    html.resolve_uids, original = resolve_uids, html.resolve_uids
+    saved = {}
+    try:
+        for name, text in corpus().items():
+            if args.only and name not in args.only:
+                continue
+            print(u'{} ({} characters)'.format(name, len(text)))
+            saved[name] = {}
+            for stage, seconds, peak in benchmark(text, args.repeat):
+                saved[name][stage] = {'seconds': seconds, 'peak': peak}
+                previous = baseline.get(name, {}).get(stage, {})
+                print(format_row(stage, seconds, peak,
+                                 previous.get('seconds')))
+    finally:
+        html.resolve_uids = original
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""Measures end to end publishing throughput against the local Apple News
+API stand-in, in a test Plone site with synthetic content::
+
+    python -m kcrw.plone_apple_news.benchmarks.publish --items 50 \\
+        --paragraphs 40 --images 4 --concurrency 1 --concurrency 4
+
+Reports the time and peak memory of generating each article
+(``article_data`` and ``article_assets``), then the number of articles per
+minute created through ``AppleNewsActions`` and updated through the
+``BulkUpdater`` at each concurrency level. Use ``--latency`` to simulate the
+round trip time to Apple News. Client side rate limiting is off unless
+``--rate-limit`` is given, so that it doesn't cap the throughput measured.
+"""
+import argparse
+import io
+import threading
+import time
+import transaction
+import PIL.Image
+from plone import api
+from plone.app.testing import login
+from plone.app.testing import PLONE_SITE_ID
+from plone.app.testing import SITE_OWNER_NAME
+from plone.app.textfield.value import RichTextValue
+from plone.namedfile.file import NamedBlobImage
+from plone.uuid.interfaces import IUUID
+from zope.annotation.interfaces import IAnnotations
+from zope.component.hooks import setSite
+from ZODB.POSException import ConflictError
+from kcrw.plone_apple_news.benchmarks.corpus import Writer
+from kcrw.plone_apple_news.bulk import BulkUpdater
+from kcrw.plone_apple_news.interfaces import IAppleNewsActions
+from kcrw.plone_apple_news.interfaces import IAppleNewsGenerator
+from kcrw.plone_apple_news.testing import KCRW_PLONE_APPLE_NEWS_API_FUNCTIONAL_TESTING  # noqa: E501
+try:
+    from plone.testing.zope import zopeApp
+except ImportError:
+    from plone.testing.z2 import zopeApp
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, no allocation tracking
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+BEHAVIOR = 'kcrw.plone_apple_news.interfaces.IAppleNewsSupport'
+ANNOTATIONS_KEY = 'kcrw.apple_news_info'
+MAX_CONFLICT_RETRIES = 5
+
+
+def layers(layer):
+    """Returns the layer and its bases, bases first, like a test runner"""
+    result = []
+
+    def add(layer):
+        for base in layer.__bases__:
+            add(base)
+        if layer not in result:
+            result.append(layer)
+    add(layer)
+    return result
+
+
+def image_data(size, seed):
+    """Returns JPEG data for a noisy image, which doesn't compress too well"""
+    image = PIL.Image.effect_noise(size, 40 + seed % 60).convert('RGB')
+    data = io.BytesIO()
+    image.save(data, 'JPEG', quality=90)
+    return data.getvalue()
+
+
+def create_content(portal, items, paragraphs, images, portal_type):
+    """Creates ``items`` articles with a lead image and a body of
+    ``paragraphs`` paragraphs with ``images`` images"""
+    fti = portal.portal_types[portal_type]
+    if BEHAVIOR not in fti.behaviors:
+        fti.behaviors = tuple(fti.behaviors) + (BEHAVIOR,)
+    folder = api.content.create(container=portal, type='Folder',
+                                id='benchmark', title=u'Benchmark')
+    writer = Writer()
+    objects = []
+    for i in range(items):
+        parts = [writer.paragraph(5, link_chance=0.1)
+                 for j in range(paragraphs)]
+        for j in range(images):
+            image = api.content.create(
+                container=folder, type='Image', id='image-{}-{}'.format(i, j),
+                image=NamedBlobImage(image_data((1600, 1200), i + j),
+                                     filename=u'image.jpg')
+            )
+            # Spread the images evenly through the body
+            parts.insert(
+                (j + 1) * paragraphs // (images + 1) + j,
+                u'<p><img class="image-inline captioned" '
+                u'src="resolveuid/{}/@@images/image/large" /></p>'.format(
+                    IUUID(image)
+                )
+            )
+        obj = api.content.create(
+            container=folder, type=portal_type, id='article-{}'.format(i),
+            title=writer.sentence(4, 10), description=writer.sentence(),
+            text=RichTextValue(u'\n'.join(parts), 'text/html', 'text/html')
+        )
+        if portal_type == 'News Item':
+            obj.image = NamedBlobImage(image_data((2000, 1500), i),
+                                       filename=u'lead.jpg')
+        objects.append(obj)
+    transaction.commit()
+    return objects
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def generate(obj):
+    generator = IAppleNewsGenerator(obj)
+    generator.article_data()
+    generator.article_assets()
+
+
+def measure_generation(objects):
+    # Tracing allocations slows generation down, so memory is measured in
+    # a separate pass
+    times = []
+    for obj in objects:
+        start = timer()
+        generate(obj)
+        times.append(timer() - start)
+    peaks = []
+    if tracemalloc is not None:
+        for obj in objects:
+            tracemalloc.start()
+            try:
+                generate(obj)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+    print(u'Article generation ({} articles)'.format(len(objects)))
+    print(u'  mean {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms'.format(
+        sum(times) / len(times) * 1e3, percentile(times, 0.95) * 1e3,
+        max(times) * 1e3
+    ))
+    if peaks:
+        print(u'  peak memory {:.1f} MiB'.format(max(peaks) / 1048576.0))
+
+
+def create_worker(db, paths, errors):
+    """Publishes the content at ``paths`` from its own connection, as a
+    Zope worker thread would"""
+    with zopeApp(db) as app:
+        portal = app[PLONE_SITE_ID]
+        setSite(portal)
+        login(app['acl_users'], SITE_OWNER_NAME)
+        for path in paths:
+            for attempt in range(MAX_CONFLICT_RETRIES):
+                try:
+                    IAppleNewsActions(
+                        portal.unrestrictedTraverse(path)
+                    ).create_article(defer=False)
+                    break
+                except ConflictError:
+                    # Concurrent catalog updates
+                    transaction.abort()
+                except Exception as e:
+                    transaction.abort()
+                    errors.append(e)
+                    break
+        setSite(None)
+
+
+def measure_create(layer, objects, concurrency):
+    paths = ['/'.join(obj.getPhysicalPath()[2:]) for obj in objects]
+    errors = []
+    threads = [
+        threading.Thread(target=create_worker, args=(
+            layer['zodbDB'], paths[i::concurrency], errors
+        )) for i in range(concurrency)
+    ]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timer() - start, len(errors)
+
+
+def measure_update(objects, concurrency):
+    for obj in objects:
+        # Change every article so none are skipped as unchanged
+        obj.setTitle(obj.Title() + u' (updated)')
+    transaction.commit()
+    start = timer()
+    results = BulkUpdater(concurrency=concurrency)(objects)
+    return timer() - start, len([r for r in results if r[2] is not None])
+
+
+def unpublish(objects, server):
+    for obj in objects:
+        obj._p_jar.sync()
+        IAnnotations(obj).pop(ANNOTATIONS_KEY, None)
+    transaction.commit()
+    server.reset()
+
+
+def report(action, concurrency, count, elapsed, errors):
+    print(u'  {:<8} concurrency {:>3}: {:>8.1f} articles/minute '
+          u'({:.2f} s, {} errors)'.format(
+              action, concurrency, count / elapsed * 60, elapsed, errors
+          ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u'Benchmark publishing throughput'
+    )
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--paragraphs', type=int, default=20,
+                        help=u'Body paragraphs per article')
+    parser.add_argument('--images', type=int, default=2,
+                        help=u'Body images per article')
+    parser.add_argument('--type', default='News Item',
+                        help=u'Content type to publish')
+    parser.add_argument('--concurrency', type=int, action='append',
+                        help=u'Concurrency levels (default 1, 2, 4 and 8)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help=u'Seconds the fake API takes to respond')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help=u'API requests per second allowed by the '
+                             u'client (default 0, unlimited)')
+    args = parser.parse_args(argv)
+    levels = args.concurrency or [1, 2, 4, 8]
+
+    layer = KCRW_PLONE_APPLE_NEWS_API_FUNCTIONAL_TESTING
+    stack = layers(layer)
+    for item in stack:
+        item.setUp()
+    for item in stack:
+        item.testSetUp()
+    try:
+        portal = layer['portal']
+        server = layer['apple_news_api']
+        server.latency = args.latency
+        setSite(portal)
+        login(layer['app']['acl_users'], SITE_OWNER_NAME)
+        api.portal.set_registry_record('kcrw.apple_news.rate_limit',
+                                       args.rate_limit)
+        print(u'Creating {} {} items...'.format(args.items, args.type))
+        objects = create_content(portal, args.items, args.paragraphs,
+                                 args.images, args.type)
+        measure_generation(objects)
+
+        print(u'Publishing (API latency {:.0f} ms, rate limit {})'.format(
+            args.latency * 1e3, args.rate_limit or u'none'
+        ))
+        for concurrency in levels:
+            unpublish(objects, server)
+            elapsed, errors = measure_create(layer, objects, concurrency)
+            report(u'create', concurrency, len(objects), elapsed, errors)
+            for obj in objects:
+                obj._p_jar.sync()
+            elapsed, errors = measure_update(objects, concurrency)
+            report(u'update', concurrency, len(objects), elapsed, errors)
+    finally:
+        for item in reversed(stack):
+            item.testTearDown()
+        for item in reversed(stack):
+            item.tearDown()
+
+
+if __name__ == '__main__':
+    main()
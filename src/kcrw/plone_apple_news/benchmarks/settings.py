@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Compares the per-link cost of reading settings from the registry with
+reading them from a settings snapshot, when transforming the links of a
+link-dense article::
+
+    python -m kcrw.plone_apple_news.benchmarks.settings
+"""
+import plone.registry
+import zope.component
+from plone.registry import Registry
+from plone.registry.interfaces import IRegistry
+from zope.component import provideUtility
+from zope.configuration import xmlconfig
+from kcrw.plone_apple_news.benchmarks import best_of
+from kcrw.plone_apple_news.benchmarks import report
+from kcrw.plone_apple_news.html import transform_url
+from kcrw.plone_apple_news.interfaces import IAppleNewsSettings
+from kcrw.plone_apple_news.utils import SETTINGS_PREFIX
+from kcrw.plone_apple_news.utils import SettingsSnapshot
+
+LINKS = 1000
+PORTAL_URL = 'http://cms.example.com/site'
+
+
+def setup_registry():
+    context = xmlconfig.file('meta.zcml', zope.component)
+    xmlconfig.file('configure.zcml', plone.registry, context=context)
+    registry = Registry()
+    registry.registerInterface(IAppleNewsSettings, prefix=SETTINGS_PREFIX)
+    registry[SETTINGS_PREFIX + '.canonical_url'] = u'https://www.example.com'
+    provideUtility(registry, IRegistry)
+    return registry
+
+
+def main():
+    registry = setup_registry()
+    hrefs = ['{}/section-{}/page-{}'.format(PORTAL_URL, i % 10, i)
+             for i in range(LINKS)]
+
+    def registry_per_link():
+        # What every link cost when each lookup went through the registry
+        for href in hrefs:
+            settings = registry.forInterface(
+                IAppleNewsSettings, prefix=SETTINGS_PREFIX, check=False
+            )
+            transform_url(href, settings, PORTAL_URL)
+
+    def snapshot():
+        settings = SettingsSnapshot(registry.forInterface(
+            IAppleNewsSettings, prefix=SETTINGS_PREFIX, check=False
+        ))
+        for href in hrefs:
+            transform_url(href, settings, PORTAL_URL)
+
+    print(u'Transforming {} links'.format(LINKS))
+    baseline = best_of(registry_per_link, 10)
+    report(u'registry lookup per link', baseline)
+    report(u'settings snapshot', best_of(snapshot, 10), baseline)
+
+
+if __name__ == '__main__':
+    main()
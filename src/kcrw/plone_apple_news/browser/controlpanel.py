@@ -3,9 +3,12 @@ from plone.app.registry.browser import controlpanel
 from Products.CMFPlone.log import log_exc
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from Products.statusmessages.interfaces import IStatusMessage
-from kcrw.apple_news import API, AppleNewsError
+from kcrw.apple_news import AppleNewsError
 
+from ..client import CircuitBreaker
+from ..client import get_client
 from ..interfaces import IAppleNewsSettings
+from ..utils import get_settings
 from kcrw.plone_apple_news import _
 
 
@@ -21,8 +24,7 @@ class AppleNewsSettingsForm(controlpanel.RegistryEditForm):
         super(AppleNewsSettingsForm, self).update()
         settings = self.getContent()
         if settings and getattr(settings, 'api_key_id', None):
-            api = API(settings.api_key_id, settings.api_key_secret,
-                      settings.channel_id)
+            api = get_client(settings)
             try:
                 self.channel_info = api.read_channel()
             except AppleNewsError:
@@ -40,3 +42,19 @@ class AppleNewsSettingsControlPanel(controlpanel.ControlPanelFormWrapper):
 
     def pprint(self, obj):
         return pprint.pformat(obj)
+
+    def api_status(self):
+        """Circuit breaker state of the Apple News API client"""
+        try:
+            breaker = get_client().breaker
+        except AppleNewsError:
+            return None
+        if breaker is None:
+            return None
+        return {
+            'state': breaker.state,
+            'degraded': breaker.state != CircuitBreaker.CLOSED,
+            'failures': breaker.failures,
+            'last_error': breaker.last_error,
+            'queued': bool(getattr(get_settings(), 'queue_requests', False)),
+        }
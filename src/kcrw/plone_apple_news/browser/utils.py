@@ -3,9 +3,11 @@ import six
 import zipfile
 from AccessControl import ClassSecurityInfo, Unauthorized
 from zope.component import getMultiAdapter
+from zope.interface import alsoProvides
 from zope.interface import implementer
 from zope.publisher.interfaces import IPublishTraverse
 from plone.batching import Batch
+from plone.uuid.interfaces import IUUID
 from plone.protect import CheckAuthenticator
 from Products.CMFCore.utils import _checkPermission
 from Products.CMFCore.utils import getToolByName
@@ -15,10 +17,25 @@ from Products.Five.browser import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from Products.statusmessages.interfaces import IStatusMessage
 from zExceptions import NotFound
+from .. import metrics
+from ..bulk import BulkUpdater
+from ..bulk import FAILED
+from ..bulk import QUEUED
+from ..bulk import SENT
+from ..bulk import UNCHANGED
+from ..cache import render_cache
+from ..cache import url_cache
+from ..client import api_available
 from ..interfaces import IAppleNewsActions
 from ..interfaces import IAppleNewsGenerator
+from ..outbox import process_queue
+from ..outbox import queue_length
 from kcrw.apple_news import AppleNewsError
 from kcrw.plone_apple_news import _
+try:
+    from plone.protect.interfaces import IDisableCSRFProtection
+except ImportError:
+    IDisableCSRFProtection = None
 
 
 @implementer(IPublishTraverse)
@@ -71,6 +88,13 @@ class AppleNewsActions(BrowserView):
                 return
             raise
 
+        if article_data is None:
+            IStatusMessage(self.request).addStatusMessage(
+                _(u"Queued new article for upload"),
+                "info"
+            )
+            return
+
         IStatusMessage(self.request).addStatusMessage(
             _(u'article_added',
               default=u"Added new article with id: ${article_id}",
@@ -86,7 +110,7 @@ class AppleNewsActions(BrowserView):
             raise Unauthorized
         adapter = self.get_adapter()
         try:
-            adapter.update_article()
+            article_data = adapter.update_article()
         except AppleNewsError as e:
             log('Handled Apple News Error {}: {}'.format(e, e.data))
             article_id = adapter.data.get('id', u'')
@@ -111,6 +135,24 @@ class AppleNewsActions(BrowserView):
             IStatusMessage(self.request).addStatusMessage(message, "error")
         else:
             article_id = adapter.data.get('id', u'')
+            if article_data is False:
+                IStatusMessage(self.request).addStatusMessage(
+                    _(u'article_unchanged',
+                      default=u"Article with id ${article_id} is unchanged "
+                              u"since the last update",
+                      mapping={u'article_id': article_id}),
+                    "info"
+                )
+                return
+            if article_data is None:
+                IStatusMessage(self.request).addStatusMessage(
+                    _(u'queued_article_update',
+                      default=u"Queued update for article with id: "
+                              u"${article_id}",
+                      mapping={u'article_id': article_id}),
+                    "info"
+                )
+                return
             IStatusMessage(self.request).addStatusMessage(
                 _(u'updated_article_success',
                   default=u"Updated article with id: ${article_id}",
@@ -123,7 +165,7 @@ class AppleNewsActions(BrowserView):
         adapter = self.get_adapter()
         article_id = adapter.data['id']
         try:
-            adapter.delete_article()
+            result = adapter.delete_article()
         except AppleNewsError as e:
             log('Handled Apple News Error {}: {}'.format(e, e.data))
             if e.code == 404:
@@ -146,6 +188,15 @@ class AppleNewsActions(BrowserView):
                 )
                 IStatusMessage(self.request).addStatusMessage(message, "error")
         else:
+            if result is None:
+                IStatusMessage(self.request).addStatusMessage(
+                    _(u'queued_article_delete',
+                      default=u"Queued deletion of article with id: "
+                              u"${article_id}",
+                      mapping={u'article_id': article_id}),
+                    "info"
+                )
+                return
             IStatusMessage(self.request).addStatusMessage(
                 _(u'article_deleted',
                   default=u"Deleted article with id: ${article_id}",
@@ -220,6 +271,9 @@ class BulkAppleNewsForm(BrowserView):
     batch = ()
     label = u'Bulk Update Apple News Articles'
 
+    def queue_length(self):
+        return queue_length()
+
     def update(self):
         uids = []
         request = self.request
@@ -239,35 +293,39 @@ class BulkAppleNewsForm(BrowserView):
             uids = request.get('uids', [])
             if not uids:
                 return
-            count = 0
+            counts = {}
             brains = catalog(has_apple_news=True, UID=uids)
+            titles = {}
+            objects = []
             for b in brains:
                 obj = b.getObject()
-                adapter = IAppleNewsActions(obj, alternate=None)
-                if adapter is not None:
-                    try:
-                        adapter.update_article()
-                        count += 1
-                    except AppleNewsError as e:
-                        log(u'Handled Apple News Error in bulk update '
-                            u'{}: {}'.format(e, e.data))
-                        if e.code == 409:
-                            messages.append(
-                                u'Unable to update article "{}" '.format(
-                                    safe_unicode(b.Title)
-                                ) + u'because there are conflicting changes '
-                                u'in Apple News Publisher'
-                            )
-                        else:
-                            messages.append(
-                                u'Unable to update article "{}" '.format(
-                                    safe_unicode(b.Title)
-                                ) + u'check logs for details.'
-                            )
+                titles[b.UID] = safe_unicode(b.Title)
+                objects.append(obj)
+            for obj, status, error in BulkUpdater()(objects):
+                counts[status] = counts.get(status, 0) + 1
+                if status != FAILED:
+                    continue
+                title = titles.get(IUUID(obj))
+                if isinstance(error, AppleNewsError):
+                    log(u'Handled Apple News Error in bulk update '
+                        u'{}: {}'.format(error, error.data))
+                if getattr(error, 'code', None) == 409:
+                    messages.append(
+                        u'Unable to update article "{}" '.format(title) +
+                        u'because there are conflicting changes '
+                        u'in Apple News Publisher'
+                    )
+                else:
+                    messages.append(
+                        u'Unable to update article "{}" '.format(title) +
+                        u'check logs for details.'
+                    )
             msg_adapter = IStatusMessage(self.request)
             msg_adapter.add(
-                u'Updated {} Apple News article with {} errors'.format(
-                    count, len(brains) - count
+                u'Updated {} Apple News articles, queued {}, {} unchanged, '
+                u'with {} errors'.format(
+                    counts.get(SENT, 0), counts.get(QUEUED, 0),
+                    counts.get(UNCHANGED, 0), counts.get(FAILED, 0)
                 ), type=u"info"
             )
             for msg in messages:
@@ -277,3 +335,77 @@ class BulkAppleNewsForm(BrowserView):
         """Call update and render"""
         self.update()
         return self.template()
+
+
+class ProcessAppleNewsQueue(BrowserView):
+    """Sends queued Apple News API requests. Intended to be called
+    periodically, e.g. from a clock server or cron job."""
+
+    def __call__(self):
+        if IDisableCSRFProtection is not None:
+            alsoProvides(self.request, IDisableCSRFProtection)
+        results = process_queue(self.limit())
+        self.request.response.setHeader('Content-Type', 'text/plain')
+        if results is None:
+            return u'Apple News queue is already being processed'
+        lines = [u'{} {}: {}'.format(uid, action, status)
+                 for uid, action, status in results]
+        lines.append(u'Processed {} queued Apple News requests, {} '
+                     u'remaining'.format(len(results), queue_length()))
+        return u'\n'.join(lines)
+
+    def limit(self):
+        """The maximum number of requests to send from the ``limit``
+        parameter, None (all of them) if it's missing or invalid"""
+        try:
+            limit = int(self.request.form.get('limit') or 0)
+        except (TypeError, ValueError):
+            return None
+        return max(limit, 1) if limit else None
+
+
+class AppleNewsMetrics(BrowserView):
+    """Exports the Apple News publishing and rendering metrics of this Zope
+    process in the Prometheus text format"""
+
+    def gauges(self):
+        """Metrics read when scraped"""
+        queue = metrics.Gauge(
+            'kcrw_apple_news_queue_length',
+            'Content with Apple News API requests waiting in the outbox',
+            register=False
+        )
+        queue.set(queue_length())
+        available = metrics.Gauge(
+            'kcrw_apple_news_api_available',
+            'Whether Apple News API requests are allowed (0 while the '
+            'circuit breaker is open)', register=False
+        )
+        available.set(int(api_available()))
+        hit_ratio = metrics.Gauge(
+            'kcrw_apple_news_image_scale_hit_ratio',
+            'Fraction of article image scales found in the scale storage',
+            register=False
+        )
+        hits = metrics.image_scales.value(result='hit')
+        total = hits + metrics.image_scales.value(result='miss')
+        hit_ratio.set(float(hits) / total if total else 0.0)
+        urls = metrics.Counter(
+            'kcrw_apple_news_url_cache_lookups_total',
+            'Lookups of linked content URLs in the URL cache',
+            register=False
+        )
+        urls.inc(url_cache.hits, result='hit')
+        urls.inc(url_cache.misses, result='miss')
+        rendered = metrics.Counter(
+            'kcrw_apple_news_render_cache_lookups_total',
+            'Lookups of processed article HTML in the render cache',
+            register=False
+        )
+        rendered.inc(render_cache.hits, result='hit')
+        rendered.inc(render_cache.misses, result='miss')
+        return [queue, available, hit_ratio, urls, rendered]
+
+    def __call__(self):
+        self.request.response.setHeader('Content-Type', metrics.CONTENT_TYPE)
+        return metrics.render(self.gauges())
@@ -0,0 +1,142 @@
+"""Concurrent bulk updates of Apple News articles.
+
+Article data is generated in the Zope thread, the API requests for each
+article are made from a bounded pool of threads, and the resulting
+revisions are stored back on the content in a single transaction.
+"""
+import transaction
+from copy import deepcopy
+from multiprocessing.pool import ThreadPool
+from Products.CMFPlone.log import log_exc
+from kcrw.apple_news import AppleNewsError
+from .interfaces import IAppleNewsActions
+from .utils import article_digest
+from .utils import get_settings
+
+DEFAULT_CONCURRENCY = 4
+# The outcomes of updating an article
+SENT = 'sent'
+QUEUED = 'queued'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+
+
+def send_update(job):
+    """Sends an article update with the ``stored`` revision and metadata,
+    refreshing them first if ``refresh`` is set, or when Apple News reports
+    a conflict. Only uses the adapter's API client and helpers which don't
+    access the database, so it is safe to call outside of the Zope thread.
+    Returns a tuple of ``(read_data, update_data, error)``."""
+    adapter, article_id, metadata, article, assets, stored, refresh = job
+    read_data = None
+    try:
+        while True:
+            if refresh:
+                read_data = adapter.api.read_article(article_id)
+                stored = {
+                    'revision': read_data['data'].get('revision'),
+                    'metadata': adapter.extract_metadata(read_data),
+                }
+            data = adapter.apply_stored_metadata(deepcopy(metadata), stored)
+            try:
+                update_data = adapter.api.update_article(
+                    article_id, data, article, assets
+                )
+                break
+            except AppleNewsError as e:
+                if refresh or e.code != 409:
+                    raise
+            refresh = True
+    except Exception as e:
+        if not isinstance(e, AppleNewsError):
+            log_exc(u'Error in Apple News bulk update of {}'.format(
+                article_id
+            ))
+        return read_data, None, e
+    return read_data, update_data, None
+
+
+class BulkUpdater(object):
+    """Updates a sequence of content objects in Apple News using up to
+    ``concurrency`` simultaneous API requests. Articles which are unchanged
+    since their last upload are skipped unless ``force`` is set."""
+
+    def __init__(self, concurrency=None, force=False):
+        self.force = force
+        if concurrency is None:
+            concurrency = getattr(
+                get_settings(), 'bulk_concurrency', None
+            ) or DEFAULT_CONCURRENCY
+        self.concurrency = max(int(concurrency), 1)
+
+    def __call__(self, objects):
+        """Returns a list of ``(obj, status, error)`` tuples in the order of
+        ``objects``. ``status`` is one of ``SENT``, ``QUEUED``, ``UNCHANGED``
+        or ``FAILED``, and ``error`` is None unless the update failed.
+        Objects which don't support Apple News are skipped."""
+        results = []
+        pool = ThreadPool(self.concurrency)
+        try:
+            chunk = []
+            for obj in objects:
+                chunk.append(obj)
+                if len(chunk) >= self.concurrency * 2:
+                    results.extend(self.update_chunk(pool, chunk))
+                    chunk = []
+            if chunk:
+                results.extend(self.update_chunk(pool, chunk))
+        finally:
+            pool.close()
+            pool.join()
+        transaction.commit()
+        return results
+
+    def update_chunk(self, pool, objects):
+        results = []
+        jobs = []
+        refresh = self.force or not getattr(
+            get_settings(), 'optimistic_updates', True
+        )
+        for obj in objects:
+            adapter = IAppleNewsActions(obj, alternate=None)
+            if adapter is None:
+                continue
+            results.append([obj, SENT, None])
+            if not adapter.data:
+                results[-1][1:] = FAILED, AppleNewsError(
+                    'Article not yet published', code=418
+                )
+                continue
+            if getattr(adapter.settings, 'queue_requests', False):
+                # Let the outbox handle it
+                adapter.update_article(force=self.force)
+                results[-1][1] = QUEUED
+                continue
+            try:
+                metadata, article, assets = adapter.article_update_data()
+            except Exception as e:
+                log_exc(u'Error generating Apple News article for bulk '
+                        u'update of {}'.format(obj.absolute_url()))
+                results[-1][1:] = FAILED, e
+                continue
+            digest = article_digest(article, metadata, assets)
+            if not self.force and digest == adapter.data.get('digest'):
+                # Nothing has changed since the last upload
+                results[-1][1] = UNCHANGED
+                continue
+            stored = dict(adapter.data)
+            jobs.append((results[-1], (adapter, stored['id'], metadata,
+                                       article, assets, stored, refresh),
+                         digest))
+
+        sent = pool.map(send_update, [job for result, job, digest in jobs])
+        for (result, job, digest), (read_data, update_data, error) in zip(
+                jobs, sent):
+            adapter = job[0]
+            if update_data is not None:
+                adapter.update_from_apple(update_data, digest)
+            elif read_data is not None:
+                adapter.update_from_apple(read_data)
+            if error is not None:
+                result[1:] = FAILED, error
+        return [tuple(r) for r in results]
@@ -0,0 +1,104 @@
+"""Process wide caches shared between threads"""
+import threading
+from collections import OrderedDict
+
+URL_CACHE_SIZE = 10000
+RENDER_CACHE_SIZE = 1000
+
+_marker = object()
+
+
+class LRUCache(object):
+    """A thread-safe mapping holding at most ``size`` entries, discarding
+    the least recently used entries first"""
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, _marker)
+            if value is _marker:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
+class DependentLRUCache(LRUCache):
+    """An ``LRUCache`` whose entries depend on other keys (e.g. content
+    UIDs), so that all the entries depending on a key can be discarded"""
+
+    def __init__(self, size):
+        super(DependentLRUCache, self).__init__(size)
+        self._dependencies = {}
+        self._dependents = {}
+
+    def _discard(self, key):
+        self._data.pop(key, None)
+        for dependency in self._dependencies.pop(key, ()):
+            keys = self._dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[dependency]
+
+    def set(self, key, value, dependencies=()):
+        with self._lock:
+            self._discard(key)
+            self._data[key] = value
+            dependencies = self._dependencies[key] = frozenset(dependencies)
+            for dependency in dependencies:
+                self._dependents.setdefault(dependency, set()).add(key)
+            while len(self._data) > self.size:
+                self._discard(next(iter(self._data)))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def invalidate_dependency(self, dependency):
+        """Discards all the entries depending on ``dependency``"""
+        with self._lock:
+            for key in list(self._dependents.get(dependency, ())):
+                self._discard(key)
+
+    def clear(self):
+        super(DependentLRUCache, self).clear()
+        with self._lock:
+            self._dependencies.clear()
+            self._dependents.clear()
+
+
+# Maps content UIDs to the ``(base, url)`` of their last computed URL
+url_cache = LRUCache(URL_CACHE_SIZE)
+# Maps a hash of HTML and everything else its processing depends on to the
+# processed parts, with references to the content they depend on
+render_cache = DependentLRUCache(RENDER_CACHE_SIZE)
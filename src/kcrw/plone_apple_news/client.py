@@ -0,0 +1,408 @@
+"""Shared Apple News API clients.
+
+Clients are kept per process, keyed by API key id and channel id, and make
+their requests through a ``requests`` session so connections to Apple News
+are kept alive and reused between requests and threads. Requests are rate
+limited, and retried with exponential backoff when Apple News is throttling
+or temporarily unavailable. When Apple News keeps failing, a circuit breaker
+stops further requests for a while, so they fail fast instead of holding
+Zope threads.
+"""
+import json
+import random
+import requests
+import threading
+import time
+from datetime import datetime
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+from requests.adapters import HTTPAdapter
+from Products.CMFPlone.log import log_exc
+from kcrw.apple_news import API, AppleNewsError
+from kcrw.apple_news.api import ensure_binary
+from kcrw.apple_news.api import ensure_text
+from . import metrics
+from .timing import timer
+from .utils import SETTINGS_PREFIX
+from .utils import get_settings
+
+POOL_SIZE = 10
+# Don't hold a thread for longer than this retrying a request, including
+# the time taken by the retried requests
+MAX_RETRY_DELAY = 60
+# Responses which are retried, other server errors are only retried for
+# requests which don't create articles
+RETRY_CODES = frozenset((429, 503))
+# API operations counted as article changes
+ARTICLE_ACTIONS = {
+    'create_article': 'created',
+    'update_article': 'updated',
+    'delete_article': 'deleted',
+}
+CREDENTIAL_SETTINGS = frozenset(
+    SETTINGS_PREFIX + '.' + name
+    for name in ('api_key_id', 'api_key_secret', 'channel_id')
+)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class TokenBucket(object):
+    """Allows an average of ``rate`` requests per second, with bursts of up
+    to ``burst`` requests"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(burst or 1, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Takes a token, returns how long to wait before it can be used"""
+        with self._lock:
+            now = time.time()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.delay()
+        if delay:
+            time.sleep(delay)
+
+
+class CircuitBreaker(object):
+    """Stops requests after ``threshold`` consecutive failures for
+    ``cooldown`` seconds (open). After the cooldown a single probe request
+    is let through (half-open), which closes the circuit if it succeeds or
+    opens it again if it fails."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return self.CLOSED
+        if time.time() - self.opened >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Whether a request may be sent now"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+
+    def failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error and str(error) or None
+            if self.probing or self.failures >= self.threshold:
+                self.opened = time.time()
+            self.probing = False
+
+
+def is_failure(error):
+    """Whether an error means Apple News is failing, rather than rejecting
+    the request"""
+    code = getattr(error, 'code', None)
+    return code is None or code == 429 or code >= 500
+
+
+def retry_after(response):
+    """Returns the delay in seconds requested by a ``Retry-After`` header"""
+    value = response is not None and response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(mktime_tz(date) - time.time(), 0)
+
+
+class PooledAPI(API):
+    """An Apple News API client which sends its requests through a session
+    with a pool of keep-alive connections. The session isn't modified after
+    it is created, so the client can be shared between threads.
+
+    Requests are limited to ``rate_limit`` per second (unlimited if 0) and
+    are retried up to ``max_retries`` times when Apple News is throttling
+    requests or unavailable, waiting for the ``Retry-After`` delay or for an
+    exponentially increasing, randomized delay starting at ``backoff``
+    seconds, until ``MAX_RETRY_DELAY`` seconds have passed. Requests time
+    out after ``timeout`` seconds, and are refused for ``cooldown`` seconds
+    after ``threshold`` consecutive failures (no circuit breaker if 0)."""
+
+    def __init__(self, key_id, key_secret, channel_id, pool_size=POOL_SIZE,
+                 rate_limit=0, burst=1, max_retries=0, backoff=1.0,
+                 timeout=None, threshold=0, cooldown=60):
+        super(PooledAPI, self).__init__(key_id, key_secret, channel_id)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.limiter = rate_limit and TokenBucket(rate_limit, burst) or None
+        self.max_retries = max_retries or 0
+        self.backoff = backoff or 0
+        self.timeout = timeout or None
+        self.breaker = None
+        if threshold:
+            self.breaker = CircuitBreaker(threshold, cooldown)
+
+    @property
+    def available(self):
+        """False while the circuit breaker is refusing requests"""
+        return self.breaker is None or (
+            self.breaker.state != CircuitBreaker.OPEN
+        )
+
+    def should_retry(self, method, route, error, attempt):
+        """Returns the delay before retrying a failed request, or None if
+        it shouldn't be retried"""
+        code = error.code
+        if attempt >= self.max_retries or code is None:
+            return None
+        creates = method == 'POST' and route.endswith('/articles')
+        if code not in RETRY_CODES and (code < 500 or creates):
+            return None
+        delay = getattr(error, 'retry_after', None)
+        if delay is None:
+            delay = self.backoff * 2 ** attempt
+            delay = random.uniform(delay / 2, delay)
+        if delay > MAX_RETRY_DELAY:
+            return None
+        return delay
+
+    def send_request(self, method, route, body=None, content_type=None):
+        """Sends a signed request to the Apple News Publisher API, unless
+        the circuit breaker is open"""
+        breaker = self.breaker
+        if breaker is not None and not breaker.allow():
+            metrics.api_rejected.inc()
+            raise AppleNewsError(
+                'Apple News requests suspended after {} consecutive '
+                'failures'.format(breaker.failures), code=503
+            )
+        name = metrics.operation(method, route)
+        start = metrics.clock()
+        try:
+            result = self.send_with_retries(method, route, body,
+                                            content_type)
+        except Exception as e:
+            if breaker is not None:
+                if is_failure(e):
+                    breaker.failure(e)
+                else:
+                    breaker.success()
+            raise
+        finally:
+            metrics.api_duration.observe(metrics.clock() - start,
+                                         method=name)
+        if breaker is not None:
+            breaker.success()
+        if name in ARTICLE_ACTIONS:
+            metrics.articles.inc(action=ARTICLE_ACTIONS[name])
+        return result
+
+    def send_with_retries(self, method, route, body=None, content_type=None):
+        """Sends a signed request, waiting for the rate limit and retrying
+        if Apple News is throttling requests or unavailable"""
+        attempt = 0
+        deadline = time.time() + MAX_RETRY_DELAY
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                with timer('request', method):
+                    return self.send_single_request(method, route, body,
+                                                    content_type)
+            except AppleNewsError as e:
+                delay = self.should_retry(method, route, e, attempt)
+                if delay is None or time.time() + delay > deadline:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    def send_single_request(self, method, route, body=None,
+                            content_type=None):
+        """Sends a signed request to the Apple News Publisher API, the same
+        as ``API.send_request`` but reusing the session's connections"""
+        date = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        url = self.url_base
+        route = route.rstrip('/')
+        if route:
+            url = url + '/' + route
+        canonical_request = (
+            ensure_binary(method, 'utf8') +
+            ensure_binary(url, 'utf8') +
+            ensure_binary(date, 'utf8')
+        )
+        if body:
+            canonical_request += (
+                ensure_binary(content_type, 'utf8') +
+                ensure_binary(body, 'utf8')
+            )
+
+        signature = self._create_signature(canonical_request)
+        authorization = "HHMAC; key={}; signature={}; date={}".format(
+            self.key_id, signature, date
+        )
+        headers = {"Authorization": authorization}
+        if body:
+            headers["Content-Type"] = content_type
+
+        resp = data = code = reason = None
+        try:
+            resp = self.session.request(method, url, headers=headers,
+                                        data=body, timeout=self.timeout)
+            resp.raise_for_status()
+        except requests.exceptions.RequestException:
+            log_exc(u'Error in Apple News request to {}'.format(url))
+            if resp is not None:
+                try:
+                    data = resp.json()
+                except ValueError:
+                    data = None
+                code = resp.status_code
+                reason = resp.reason
+            error = AppleNewsError(
+                'Error during Apple News request to {} ({}: {})'.format(
+                    url, code, reason
+                ), code=code, data=data
+            )
+            error.retry_after = retry_after(resp)
+            metrics.api_errors.inc(code=metrics.error_label(code))
+            raise error
+        if method != 'DELETE':
+            return resp.json()
+        else:
+            return {'result': 'Deleted item at url: {}'.format(url)}
+
+    def create_article(self, article, metadata=None, assets=None):
+        """Creates and uploads a multi-part article, the same as
+        ``API.create_article`` but timing the serialization of the
+        request body"""
+        if not article:
+            raise AppleNewsError('No article body found for article')
+        body, content_type = self.serialize_article(article, metadata,
+                                                    assets)
+        route = 'channels/{}/articles'.format(self.channel_id)
+        return self.send_request('POST', route, body, content_type)
+
+    def update_article(self, identifier, metadata, article=None, assets=None):
+        """Updates an existing article, the same as ``API.update_article``
+        but timing the serialization of the request body"""
+        if not metadata or 'revision' not in metadata.get('data', {}):
+            raise AppleNewsError(
+                'No valid metadata data found for article update'
+            )
+        body, content_type = self.serialize_article(article, metadata,
+                                                    assets)
+        route = 'articles/{}'.format(identifier)
+        return self.send_request('POST', route, body, content_type)
+
+    def serialize_article(self, article, metadata, assets):
+        """Returns the multi-part body and its content type for uploading
+        the JSON encoded article and metadata with the assets"""
+        with timer('serialize'):
+            files = []
+            if assets:
+                files = sorted(assets.items(),
+                               key=lambda e: ensure_text(e[0], 'utf8'))
+            if article:
+                files.insert(0, ('article.json', json.dumps(article)))
+            if metadata:
+                files.insert(0, ('metadata', json.dumps(metadata)))
+            return self._build_article_body(files)
+
+    def close(self):
+        self.session.close()
+
+
+def get_client(settings=None):
+    """Returns the shared API client for the configured credentials, a new
+    client is created when the credentials change. The previous client isn't
+    closed, as other threads may still be using it, its connections are
+    closed once it is no longer referenced."""
+    if settings is None:
+        settings = get_settings()
+    if not settings or not getattr(settings, 'api_key_id', None):
+        raise AppleNewsError('API settings not set.')
+    key = (settings.api_key_id, settings.channel_id)
+    options = {
+        'rate_limit': getattr(settings, 'rate_limit', None) or 0,
+        'burst': getattr(settings, 'rate_limit_burst', None) or 1,
+        'max_retries': getattr(settings, 'max_retries', None) or 0,
+        'backoff': getattr(settings, 'retry_backoff', None) or 0,
+        'timeout': getattr(settings, 'request_timeout', None) or None,
+        'threshold': getattr(settings, 'breaker_threshold', None) or 0,
+        'cooldown': getattr(settings, 'breaker_cooldown', None) or 0,
+    }
+    config = (settings.api_key_secret, sorted(options.items()))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None or client.config != config:
+            client = _clients[key] = PooledAPI(
+                settings.api_key_id, settings.api_key_secret,
+                settings.channel_id, **options
+            )
+            client.config = config
+    return client
+
+
+def api_available(settings=None):
+    """Whether requests can currently be sent to Apple News, i.e. the
+    circuit breaker of the configured client isn't open"""
+    try:
+        return get_client(settings).available
+    except AppleNewsError:
+        # Missing credentials are reported when making a request
+        return True
+
+
+def clear_clients(close=True):
+    """Discards the shared clients, closing their connections unless
+    ``close`` is false because they may still be in use"""
+    with _clients_lock:
+        if close:
+            for client in _clients.values():
+                client.close()
+        _clients.clear()
+
+
+def credentials_modified(event):
+    """Discard the shared clients when the API credentials are changed"""
+    name = getattr(event.record, '__name__', None)
+    if name in CREDENTIAL_SETTINGS:
+        clear_clients(close=False)
@@ -0,0 +1,287 @@
+"""A local stand-in for the Apple News API, for tests and benchmarks.
+
+``FakeAppleNewsServer`` implements the channel and article endpoints used by
+``kcrw.apple_news.API``, keeping articles in memory. It tracks revisions and
+rejects updates with an out of date revision (409), and can add latency,
+throttle requests (429) and inject failures::
+
+    server = FakeAppleNewsServer()
+    server.start()
+    client = API(key_id, key_secret, channel_id)
+    client.url_base = server.url
+    ...
+    server.stop()
+
+See ``testing.APPLE_NEWS_API_FIXTURE`` for a layer running the server.
+"""
+import collections
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.BaseHTTPServer import HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+ARTICLE_RE = re.compile(r'^/articles/([^/]+)/?$')
+CHANNEL_RE = re.compile(r'^/channels/([^/]+)/?$')
+CHANNEL_ARTICLES_RE = re.compile(r'^/channels/([^/]+)/articles/?$')
+BOUNDARY_RE = re.compile(r'boundary=([^;\s]+)')
+FILENAME_RE = re.compile(br'filename=([^;\r\n]+)')
+
+METADATA_FIELDS = (
+    'isCandidateToBeFeatured', 'isHidden', 'isPreview', 'isSponsored',
+    'maturityRating', 'targetTerritoryCountryCodes',
+)
+
+
+def now():
+    return datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def new_revision():
+    return uuid.uuid4().hex
+
+
+def parse_multipart(body, content_type):
+    """Returns a mapping of filenames to data for the parts of a multipart
+    request body built by ``kcrw.apple_news.API``"""
+    match = BOUNDARY_RE.search(content_type or '')
+    if match is None:
+        return {}
+    boundary = b'--' + match.group(1).encode('utf8')
+    files = {}
+    for part in body.split(boundary):
+        if part in (b'', b'--') or b'\r\n\r\n' not in part:
+            continue
+        headers, data = part.split(b'\r\n\r\n', 1)
+        if data.endswith(b'\r\n'):
+            data = data[:-2]
+        match = FILENAME_RE.search(headers)
+        if match is not None:
+            files[match.group(1).decode('utf8')] = data
+    return files
+
+
+class FakeAppleNewsServer(ThreadingMixIn, HTTPServer):
+    """An in memory Apple News API server running in a thread.
+
+    :param latency: seconds to wait before responding to each request
+    :param rate_limit: maximum requests per second, further requests get a
+        429 response with a ``Retry-After`` header
+    :param failure_rate: fraction of requests which randomly fail with 503
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, rate_limit=None,
+                 failure_rate=0):
+        HTTPServer.__init__(self, (host, port), FakeAppleNewsHandler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.failure_rate = failure_rate
+        self.lock = threading.Lock()
+        self.thread = None
+        self.reset()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def reset(self):
+        """Discards all articles, logged requests and injected failures"""
+        with self.lock:
+            self.articles = {}
+            self.requests = []
+            self.injected = collections.deque()
+            self.recent = collections.deque()
+
+    def inject(self, code, count=1, retry_after=None):
+        """Makes the next ``count`` requests fail with status ``code``"""
+        with self.lock:
+            for i in range(count):
+                self.injected.append((code, retry_after))
+
+    def throttle(self, count=1, retry_after=1):
+        """Makes the next ``count`` requests fail with 429"""
+        self.inject(429, count, retry_after)
+
+    def touch(self, article_id):
+        """Changes the revision of an article, as editing it in News
+        Publisher would, so updates with the stored revision conflict"""
+        with self.lock:
+            self.articles[article_id]['revision'] = new_revision()
+
+    def check_failure(self):
+        """Returns the status and ``Retry-After`` delay of an injected or
+        simulated failure for the current request, or None"""
+        with self.lock:
+            if self.injected:
+                return self.injected.popleft()
+            if self.rate_limit:
+                current = time.time()
+                while self.recent and self.recent[0] <= current - 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.rate_limit:
+                    wait = self.recent[0] + 1 - current
+                    return 429, int(math.ceil(wait))
+                self.recent.append(current)
+        if self.failure_rate and random.random() < self.failure_rate:
+            return 503, None
+        return None
+
+    def article_response(self, article_id):
+        article = self.articles[article_id]
+        data = dict(
+            (k, article['metadata'][k]) for k in METADATA_FIELDS
+            if k in article['metadata']
+        )
+        data.update({
+            'id': article_id,
+            'type': 'article',
+            'revision': article['revision'],
+            'createdAt': article['createdAt'],
+            'modifiedAt': article['modifiedAt'],
+            'shareUrl': 'https://apple.news/{}'.format(article_id),
+            'state': 'LIVE',
+            'title': article['document'].get('title'),
+            'document': article['document'],
+            'links': {
+                'channel': '{}/channels/{}'.format(self.url,
+                                                   article['channel']),
+                'self': '{}/articles/{}'.format(self.url, article_id),
+            },
+        })
+        return {'data': data}
+
+    def create_article(self, channel_id, files):
+        document = json.loads(files.get('article.json', b'{}').decode('utf8'))
+        metadata = json.loads(files.get('metadata', b'{}').decode('utf8'))
+        article_id = str(uuid.uuid4())
+        with self.lock:
+            self.articles[article_id] = {
+                'channel': channel_id,
+                'revision': new_revision(),
+                'createdAt': now(),
+                'modifiedAt': now(),
+                'document': document,
+                'metadata': dict(
+                    {'isPreview': True}, **metadata.get('data', {})
+                ),
+                'assets': dict((k, v) for k, v in files.items()
+                               if k not in ('article.json', 'metadata')),
+            }
+            return 201, self.article_response(article_id)
+
+    def update_article(self, article_id, files):
+        metadata = json.loads(
+            files.get('metadata', b'{}').decode('utf8')
+        ).get('data', {})
+        with self.lock:
+            article = self.articles.get(article_id)
+            if article is None:
+                return 404, {'errors': [{'code': 'NOT_FOUND'}]}
+            if metadata.get('revision') != article['revision']:
+                return 409, {'errors': [{'code': 'WRONG_REVISION',
+                                         'keyPath': ['revision']}]}
+            if 'article.json' in files:
+                article['document'] = json.loads(
+                    files['article.json'].decode('utf8')
+                )
+            article['metadata'].update(
+                (k, v) for k, v in metadata.items() if k != 'revision'
+            )
+            article['assets'].update(
+                (k, v) for k, v in files.items()
+                if k not in ('article.json', 'metadata')
+            )
+            article['revision'] = new_revision()
+            article['modifiedAt'] = now()
+            return 200, self.article_response(article_id)
+
+
+class FakeAppleNewsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, data=None, headers=None):
+        body = json.dumps(data).encode('utf8') if data is not None else b''
+        self.send_response(code)
+        if data is not None:
+            self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.requests.append((self.command, self.path, code))
+
+    def handle_request(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if server.latency:
+            time.sleep(server.latency)
+        if not self.headers.get('Authorization', '').startswith('HHMAC'):
+            return self.send_json(401, {'errors': [{'code': 'UNAUTHORIZED'}]})
+        failure = server.check_failure()
+        if failure is not None:
+            code, retry_after = failure
+            headers = {}
+            if retry_after is not None:
+                headers['Retry-After'] = retry_after
+            return self.send_json(code, {'errors': [{'code': 'FAILURE'}]},
+                                  headers)
+
+        path = self.path.split('?', 1)[0]
+        files = parse_multipart(body, self.headers.get('Content-Type'))
+        article_match = ARTICLE_RE.match(path)
+        if self.command == 'POST':
+            match = CHANNEL_ARTICLES_RE.match(path)
+            if match is not None:
+                return self.send_json(
+                    *server.create_article(match.group(1), files)
+                )
+            if article_match is not None:
+                return self.send_json(
+                    *server.update_article(article_match.group(1), files)
+                )
+        elif self.command == 'GET':
+            match = CHANNEL_RE.match(path)
+            if match is not None:
+                return self.send_json(200, {'data': {
+                    'id': match.group(1), 'type': 'channel',
+                    'name': 'Fake Channel',
+                }})
+            if article_match is not None:
+                with server.lock:
+                    if article_match.group(1) in server.articles:
+                        return self.send_json(200, server.article_response(
+                            article_match.group(1)
+                        ))
+        elif self.command == 'DELETE' and article_match is not None:
+            with server.lock:
+                if server.articles.pop(article_match.group(1), None):
+                    return self.send_json(204)
+        self.send_json(404, {'errors': [{'code': 'NOT_FOUND'}]})
+
+    do_GET = do_POST = do_DELETE = handle_request
@@ -1,35 +1,170 @@
+import hashlib
+import json
 import re
+import six
+import threading
 from lxml import etree
 from lxml import html
 from lxml.html.clean import Cleaner
+from zope.annotation.interfaces import IAnnotations
 from plone import api
+from plone.api.exc import CannotGetPortalError
 from plone.outputfilters.filters.resolveuid_and_caption import ResolveUIDAndCaptionFilter  # noqa: E501
+from plone.uuid.interfaces import IUUID
+from Products.CMFCore.utils import getToolByName
+from . import metrics
+from . import timing
+from .cache import render_cache
+from .cache import url_cache
 from .templates import ALLOWED_HTML_TAGS
 from .templates import ALLOWED_HTML_ATTRS
+from .timing import timed
+from .timing import timer
 from .utils import get_settings
 
 
 VIDEO_RE = re.compile(
     r'^https?://([^\.]+\.)?((youtube\.com)|(youtu\.be)|(vimeo\.com))'
 )
+# Same as used by plone.outputfilters
+RESOLVEUID_RE = re.compile('^[./]*resolve[Uu]id/([^/]*)/?(.*)$')
+APPENDIX_RE = re.compile('^(.*)([?#].*)$')
+# Increase when a change to the processing changes its output, so that
+# stored processed HTML isn't used
+RENDER_VERSION = 1
+RENDERED_KEY = 'kcrw.apple_news.rendered'
+# Keys of the parts from split_images which are resolved from the source
+IMAGE_KEYS = frozenset(('image', 'fullimage', 'src', 'description'))
+HEADINGS_XPATH = etree.XPath(
+    './/*[self::h1 or self::h2 or self::h3 or self::h4 or self::h5 or '
+    'self::h6]'
+)
 
-
-def obj_url(obj):
-    settings = get_settings()
-    if getattr(settings, 'canonical_url', None):
+_local = threading.local()
+_xpath_cache = {}
+
+
+def split_appendix(href):
+    """Splits a url into its path and any query string or fragment"""
+    match = APPENDIX_RE.match(href)
+    if match is not None:
+        return match.groups()
+    return href, ''
+
+
+class UIDResolver(ResolveUIDAndCaptionFilter):
+    """Resolves links and images using a mapping of pre-resolved UIDs to
+    objects, falling back to resolving each link individually"""
+
+    def __init__(self, context, objects=None):
+        super(UIDResolver, self).__init__(context)
+        self.objects = objects or {}
+        # Maps the UIDs of all the content resolved to the content
+        self.resolved = {}
+        # The UIDs of links to content which doesn't exist (yet)
+        self.unresolved = set()
+        # Maps the ids of the image data from split_images to the data and
+        # the image source it was resolved from
+        self.images = {}
+
+    def resolve_link(self, href):
+        subpath, appendix = split_appendix(href)
+        match = RESOLVEUID_RE.match(subpath)
+        if match is not None and match.group(1) in self.objects:
+            uid, subpath = match.groups()
+            obj = self.objects[uid]
+            self.resolved[uid] = obj
+            return obj, subpath, appendix
+        obj, subpath, appendix = super(UIDResolver, self).resolve_link(href)
+        uid = obj is not None and IUUID(obj, None)
+        if uid:
+            self.resolved[uid] = obj
+        elif obj is None and match is not None:
+            self.unresolved.add(match.group(1))
+        return obj, subpath, appendix
+
+    def add_image(self, data, source):
+        """Records the source of image data from split_images, so it can be
+        resolved again when the processed HTML is reused"""
+        self.images[id(data)] = data, source
+
+
+def find_uids(tree):
+    """Returns the UIDs referenced by resolveuid links and images"""
+    uids = set()
+    for el in tree.iter('a', 'img'):
+        url = el.get('href') if el.tag == 'a' else el.get('src')
+        if url:
+            match = RESOLVEUID_RE.match(split_appendix(url)[0])
+            if match is not None:
+                uids.add(match.group(1))
+    return uids
+
+
+def resolve_uids(uids, context):
+    """Resolves UIDs to objects with a single catalog query"""
+    objects = {}
+    if not uids or context is None:
+        return objects
+    catalog = getToolByName(context, 'portal_catalog')
+    for brain in catalog.unrestrictedSearchResults(UID=list(uids)):
+        obj = brain._unrestrictedGetObject()
+        if obj is not None:
+            objects[brain.UID] = obj
+    return objects
+
+
+def get_resolver(context):
+    """Returns the resolver for the HTML currently being processed, or a
+    new one resolving each link individually"""
+    resolver = getattr(_local, 'resolver', None)
+    if resolver is None or resolver.context is not context:
+        resolver = UIDResolver(context)
+    return resolver
+
+
+def obj_url(obj, settings=None, portal_url=None):
+    if settings is None:
+        settings = get_settings()
+    canonical_url = getattr(settings, 'canonical_url', None)
+    uid = IUUID(obj, None)
+    if uid is not None:
+        # The cached URL is only valid for the same canonical and portal
+        # URLs (which differ between virtual hosts)
+        if portal_url is None:
+            portal_url = api.portal.get().absolute_url()
+        base = (canonical_url, portal_url)
+        cached = url_cache.get(uid)
+        if cached is not None and cached[0] == base:
+            return cached[1]
+    if canonical_url:
         url = (
-            settings.canonical_url.rstrip('/') +
+            canonical_url.rstrip('/') +
             '/' + obj.absolute_url(1).lstrip('/')
         )
     else:
         url = obj.absolute_url()
+    if uid is not None:
+        url_cache.set(uid, (base, url))
     return url
 
 
-def transform_url(url):
-    settings = get_settings()
+def invalidate_url(obj, event):
+    """Discard the cached URL, and processed HTML linking to it, of content
+    which is added, moved or removed, this is also called for all the content
+    within a moved container"""
+    uid = IUUID(obj, None)
+    if uid is not None:
+        url_cache.invalidate(uid)
+        render_cache.invalidate_dependency(uid)
+
+
+def transform_url(url, settings=None, portal_url=None):
+    if settings is None:
+        settings = get_settings()
     if getattr(settings, 'canonical_url', None):
-        portal_url = api.portal.get().absolute_url()
+        if portal_url is None:
+            portal_url = api.portal.get().absolute_url()
         url = url.replace(portal_url.rstrip('/'),
                           settings.canonical_url.rstrip('/'))
     return url
@@ -40,98 +175,159 @@ def strip_outer(s):
 
 
 def is_empty(el):
-    if el.text and el.text.strip():
-        return False
-    for sub in el:
-        if el.text and el.text.strip():
+    """Whether an element has no text, ignoring the tails of elements
+    without children"""
+    for sub in el.iter():
+        if sub.text and sub.text.strip():
             return False
-        if el.tail and el.tail.strip():
-            return False
-        sub_status = is_empty(sub)
-        if sub_status is False:
+        if sub.tail and len(sub) and sub.tail.strip():
             return False
     return True
 
 
+# Sanitises article HTML. It isn't modified by cleaning, so it is shared.
+CLEANER = Cleaner(kill_tags=['button'],
+                  remove_tags=[],
+                  allow_tags=ALLOWED_HTML_TAGS,
+                  page_structure=True,
+                  safe_attrs_only=True,
+                  safe_attrs=ALLOWED_HTML_ATTRS,
+                  remove_unknown_tags=False,
+                  comments=True,
+                  forms=True,
+                  frames=True,
+                  embedded=True,
+                  meta=True,
+                  links=True,
+                  javascript=True,
+                  scripts=True,
+                  style=True)
+
+
+def clean_tree(tree):
+    """Sanitises a parsed tree in place, returns False if it couldn't be
+    cleaned"""
+    try:
+        CLEANER(tree)
+    except AssertionError:
+        # some VERY invalid HTML
+        return False
+    return True
+
+
 def apple_html(text):
     html_parser = html.HTMLParser(remove_blank_text=True)
     tree = html.fragment_fromstring(
         text, create_parent=True, parser=html_parser
     )
-
-    cleaner = Cleaner(kill_tags=['button'],
-                      remove_tags=[],
-                      allow_tags=ALLOWED_HTML_TAGS,
-                      page_structure=True,
-                      safe_attrs_only=True,
-                      safe_attrs=ALLOWED_HTML_ATTRS,
-                      remove_unknown_tags=False,
-                      comments=True,
-                      forms=True,
-                      frames=True,
-                      embedded=True,
-                      meta=True,
-                      links=True,
-                      javascript=True,
-                      scripts=True,
-                      style=True)
-    try:
-        cleaner(tree)
-    except AssertionError:
-        # some VERY invalid HTML
+    if not clean_tree(tree):
         return ''
     return strip_outer(etree.tostring(tree, encoding="unicode").strip())
 
 
 def el_list_to_html(els, wrapper_id=None, inline=False):
+    """Sanitises and serialises elements, which are moved into a ``div``
+    (or ``span`` if ``inline``) wrapper"""
     if inline:
-        section = etree.Element('span')
+        section = html.Element('span')
     else:
-        section = etree.Element('div')
+        section = html.Element('div')
     if wrapper_id is not None:
         section.set('id', wrapper_id)
+    parsed = True
     for sub_el in els:
+        parsed = parsed and isinstance(sub_el, html.HtmlMixin)
         section.append(sub_el)
-    # Filter tags and remove carriage returns
-    return apple_html(
-        etree.tostring(section, encoding="unicode")
+    if not parsed:
+        # The cleaner only works on elements from the HTML parser
+        return apple_html(
+            etree.tostring(section, encoding="unicode")
+        ).replace(u'&#13;', u'').strip()
+    # Filter tags in place, rather than serialising and parsing again
+    if not clean_tree(section):
+        return ''
+    # Remove carriage returns
+    return etree.tostring(
+        section, encoding="unicode"
     ).replace(u'&#13;', u'').strip()
 
 
+def has_class(el):
+    return el.get('class') is not None
+
+
+def set_class_style(el):
+    classes = [c for c in el.get('class', '').split() if c]
+    if classes:
+        style = 'class-style-{}'.format('|'.join(classes))
+        el.set('data-anf-textstyle', style)
+
+
+def has_underline(el):
+    return 'underline' in (el.get('style') or '')
+
+
+def set_underline_style(el):
+    if not el.get('data-anf-textstyle'):
+        el.set('data-anf-textstyle', 'style-underline')
+
+
+def element_visitor(func):
+    """Returns a visitor calling ``func`` with each element"""
+    def visitor(tree, context=None):
+        return func
+    return visitor
+
+
+class HrefFixer(object):
+    """Visitor resolving resolveuid links, and fixing up internal links"""
+
+    def __init__(self, tree, context):
+        self.resolver = get_resolver(context)
+        self.settings = get_settings()
+        self.portal_url = None
+
+    def __call__(self, el):
+        href = el.get('href')
+        if not href:
+            return
+        settings = self.settings
+        obj, subpath, appendix = self.resolver.resolve_link(href)
+        if obj:
+            if self.portal_url is None and IUUID(obj, None) is not None:
+                self.portal_url = api.portal.get().absolute_url()
+            href = obj_url(obj, settings, self.portal_url)
+            if subpath:
+                href += subpath
+            if appendix:
+                href += appendix
+            el.set('href', href)
+        else:
+            if self.portal_url is None and getattr(settings, 'canonical_url',
+                                                   None):
+                self.portal_url = api.portal.get().absolute_url()
+            new_url = transform_url(href, settings, self.portal_url)
+            if new_url and new_url != href:
+                el.set('href', new_url)
+
+
 def class_to_style(tree, context=None):
-    """Resolve any resolveuid links"""
+    """Set text styles for classes"""
     for el in tree.findall('.//*[@class]'):
-        classes = [c for c in el.get('class', '').split() if c]
-        if classes:
-            style = 'class-style-{}'.format('|'.join(classes))
-            el.set('data-anf-textstyle', style)
+        set_class_style(el)
 
 
 def add_underlines(tree, context=None):
-    """Resolve any resolveuid links"""
+    """Set a text style for underlined text"""
     for el in tree.xpath('.//*[contains(@style, "underline")]'):
-        if not el.get('data-anf-textstyle'):
-            el.set('data-anf-textstyle', 'style-underline')
+        set_underline_style(el)
 
 
 def fix_hrefs(tree, context):
     """Resolve any resolveuid links, and fixup internal links."""
-    resolver = ResolveUIDAndCaptionFilter(context)
+    fixer = HrefFixer(tree, context)
     for el in tree.findall('.//a'):
-        href = el.get('href')
-        if href:
-            obj, subpath, appendix = resolver.resolve_link(href)
-            if obj:
-                href = obj_url(obj)
-                if subpath:
-                    href += subpath
-                if appendix:
-                    href += appendix
-                el.set('href', href)
-            else:
-                new_url = transform_url(href)
-                if new_url and new_url != href:
-                    el.set('href', new_url)
+        fixer(el)
 
 
 def find_images(el):
@@ -145,14 +341,14 @@ def find_images(el):
 
 def split_images(imgs, before_anchor=None, after_anchor=None, context=None):
     """Convert img elements into data to be used in photo components"""
-    resolver = ResolveUIDAndCaptionFilter(context)
+    resolver = get_resolver(context)
     before_parts = []
     after_parts = []
     before_images = []
     after_images = []
     for img in imgs:
         insert_before = True
-        src = img.get('src')
+        source = src = img.get('src')
         if not src:
             continue
         image, fullimage, src, description = resolver.resolve_image(src)
@@ -193,6 +389,7 @@ def split_images(imgs, before_anchor=None, after_anchor=None, context=None):
             'description': description,
             'classes': img.get('class', '').split(' ')
         }
+        resolver.add_image(data, source)
 
         if insert_before:
             if before_anchor:
@@ -211,6 +408,10 @@ def split_images(imgs, before_anchor=None, after_anchor=None, context=None):
     return before_parts, after_parts
 
 
+def is_video(el):
+    return VIDEO_RE.match(el.get('src') or '') is not None
+
+
 def find_videos(el):
     matches = []
     frames = el.findall(".//iframe")
@@ -219,7 +420,7 @@ def find_videos(el):
     if el.tag == 'iframe':
         frames = [el]
     for f in frames:
-        if VIDEO_RE.match(f.get('src')):
+        if is_video(f):
             matches.append(f)
     return matches
 
@@ -255,7 +456,7 @@ TAG_MAP = {
 
 def find_headings(el):
     matches = []
-    headings = el.xpath(".//*[self::h1 or self::h2 or self::h3 or self::h4 or self::h5 or self::h6]")
+    headings = HEADINGS_XPATH(el)
     if el.tag not in TAG_MAP and not len(headings):
         return matches
     if el.tag in TAG_MAP:
@@ -283,7 +484,11 @@ def split_headings(headings, before_anchor=None, after_anchor=None, context=None
                 'style': 'bodyHeading' + style_suffix,
             }
             components.append(component)
-            h.getparent().remove(h)
+            # The heading was moved into a wrapper by el_list_to_html, and
+            # is dropped from it when cleaned
+            parent = h.getparent()
+            if parent is not None:
+                parent.remove(h)
         else:
             # If we're in the middle of things just modify to a paragraph tag
             # with a heading style
@@ -292,10 +497,152 @@ def split_headings(headings, before_anchor=None, after_anchor=None, context=None
     return [], components
 
 
+def compiled_xpath(expression):
+    """Returns a compiled XPath expression, compiled only once"""
+    xpath = _xpath_cache.get(expression)
+    if xpath is None:
+        xpath = _xpath_cache[expression] = etree.XPath(expression)
+    return xpath
+
+
+def in_tree(el, root):
+    """Whether ``el`` is ``root`` or one of its descendants"""
+    while el is not None:
+        if el is root:
+            return True
+        el = el.getparent()
+    return False
+
+
+class SplitterDispatch(object):
+    """Registered splitters compiled for splitting the top level elements
+    of a tree. The elements for all the splitters which declare their tags
+    are found in a single walk of each top level element."""
+
+    def __init__(self, splitter_registry, splitter_tags=None):
+        self.splitters = []
+        self.by_tag = {}
+        splitter_tags = splitter_tags or {}
+        for name, matcher, splitter in splitter_registry:
+            tags = splitter_tags.get(name)
+            if isinstance(matcher, six.string_types):
+                matcher = compiled_xpath(matcher)
+            for tag in tags or ():
+                self.by_tag.setdefault(tag, []).append(
+                    (len(self.splitters), matcher)
+                )
+            self.splitters.append((name, matcher, splitter, tags))
+        self.tags = tuple(self.by_tag)
+
+    def find(self, el):
+        """Returns a mapping of splitter positions to the elements with
+        their declared tags in ``el``, in document order"""
+        found = {}
+        if not self.tags:
+            return found
+        for sub in el.iter(*self.tags):
+            for index, matcher in self.by_tag[sub.tag]:
+                if matcher is None or matcher(sub):
+                    found.setdefault(index, []).append(sub)
+        return found
+
+    def match(self, el):
+        """Yields ``(name, splitter, elements)`` for each splitter with
+        elements to split out of the top level element ``el``, in order.
+        Each splitter should be applied before the next is matched."""
+        found = self.find(el)
+        split = False
+        for index, (name, matcher, splitter, tags) in enumerate(
+                self.splitters):
+            if tags is None:
+                found_els = matcher(el)
+            else:
+                found_els = found.get(index, ())
+                if split:
+                    # Leave out elements removed by previous splitters
+                    found_els = [sub for sub in found_els
+                                 if in_tree(sub, el)]
+            if len(found_els) == 0:
+                continue
+            split = True
+            yield name, splitter, found_els
+
+
+class VisitorFilter(object):
+    """A filter applied to each element of the tree (excluding the root)
+    with one of ``tags`` (any tag if None) for which ``predicate`` (if
+    given) returns true. Adjacent visitor filters are applied together in a
+    single walk of the tree.
+
+    ``visitor`` is called with the tree and context before the walk, and
+    returns the function to call with each element. It may only modify the
+    element it is called with and its attributes, not the rest of the
+    tree."""
+
+    def __init__(self, visitor, predicate=None, tags=None):
+        self.visitor = visitor
+        self.predicate = predicate
+        self.tags = frozenset(tags) if tags else None
+
+    def __call__(self, tree, context=None):
+        run_visitors(tree, context, [(None, self)])
+
+
+def run_visitors(tree, context, filters):
+    """Applies ``(name, VisitorFilter)`` pairs in a single walk of the
+    tree"""
+    accumulators = []
+    visits = []
+    for name, filter in filters:
+        visit = filter.visitor(tree, context)
+        if timing.enabled and name is not None:
+            accumulator = timing.Accumulator('filter', name)
+            accumulators.append(accumulator)
+            visit = accumulator.wrap(visit)
+        visits.append((filter.tags, filter.predicate, visit))
+    # The visits for each tag, in order
+    any_tag = [(p, v) for tags, p, v in visits if tags is None]
+    by_tag = {}
+    for tags, predicate, visit in visits:
+        for tag in tags or ():
+            by_tag[tag] = None
+    for tag in by_tag:
+        by_tag[tag] = [(p, v) for tags, p, v in visits
+                       if tags is None or tag in tags]
+    if any_tag:
+        elements = tree.iterdescendants(etree.Element)
+    elif by_tag:
+        elements = tree.iterdescendants(*by_tag)
+    else:
+        elements = ()
+    for el in elements:
+        for predicate, visit in by_tag.get(el.tag, any_tag):
+            if predicate is None or predicate(el):
+                visit(el)
+    for accumulator in accumulators:
+        accumulator.record()
+
+
+def apply_filters(tree, context, registry=None):
+    """Applies the registered filters to a tree, with adjacent visitor
+    filters applied in a single walk"""
+    if registry is None:
+        registry = processor_registry
+    for group in registry.filter_groups():
+        name, filter = group[0]
+        if isinstance(filter, VisitorFilter):
+            run_visitors(tree, context, group)
+        else:
+            with timer('filter', name):
+                filter(tree, context)
+
+
 class HTMLProcessorRegistry(object):
     def __init__(self):
         self.filter_registry = []
         self.splitter_registry = []
+        # Maps the names of splitters registered with tags to their tags
+        self.splitter_tags = {}
 
     def register_filter(self, name, filter, before=None):
         self.unregister_filter(name)
@@ -307,12 +654,29 @@ class HTMLProcessorRegistry(object):
             position = 0
         self.filter_registry.insert(position, (name, filter))
 
+    def register_visitor(self, name, visitor, predicate=None, tags=None,
+                         before=None):
+        """Registers a filter applied to each element in a walk of the tree
+        shared with adjacent visitor filters, see ``VisitorFilter``"""
+        self.register_filter(name, VisitorFilter(visitor, predicate, tags),
+                             before)
+
     def unregister_filter(self, name):
         names = {s[0]: i for i, s in enumerate(self.filter_registry)}
         if name in names:
             self.filter_registry.pop(names[name])
 
-    def register_splitter(self, name, matcher, splitter, before=None):
+    def register_splitter(self, name, matcher, splitter, before=None,
+                          tags=None):
+        """Registers a ``splitter`` for the elements found by ``matcher``
+        in each top level element.
+
+        ``matcher`` is called with the top level element and returns the
+        elements to split out, or is an XPath expression evaluated on it.
+        With ``tags``, the elements with those tags (including the top
+        level element) are found in a single walk shared with the other
+        splitters declaring tags, and ``matcher`` is None or a function
+        selecting which of them to split out."""
         self.unregister_splitter(name)
         names = {s[0]: i for i, s in enumerate(self.splitter_registry)}
         position = len(self.splitter_registry)
@@ -320,43 +684,264 @@ class HTMLProcessorRegistry(object):
             position = names[before]
         elif before == '*':
             position = 0
-        self.splitter_registry.insert(
-            position, (name, matcher, splitter)
-        )
+        self.splitter_registry.insert(position, (name, matcher, splitter))
+        if tags:
+            self.splitter_tags[name] = frozenset(tags)
 
     def unregister_splitter(self, name):
         names = {s[0]: i for i, s in enumerate(self.splitter_registry)}
         if name in names:
             self.splitter_registry.pop(names[name])
+        self.splitter_tags.pop(name, None)
 
     def filters(self):
         for f in self.filter_registry:
             yield f[1]
 
+    def signature(self):
+        """Returns a string identifying the registered filters and
+        splitters"""
+        def name(value):
+            if isinstance(value, VisitorFilter):
+                return [name(value.visitor), name(value.predicate),
+                        sorted(value.tags or ())]
+            if value is None or isinstance(value, six.string_types):
+                return value
+            return '{}.{}'.format(getattr(value, '__module__', ''),
+                                  getattr(value, '__name__', repr(value)))
+        return json.dumps([
+            [(f[0], name(f[1])) for f in self.filter_registry],
+            [(s[0], name(s[1]), name(s[2]),
+              sorted(self.splitter_tags.get(s[0], ())))
+             for s in self.splitter_registry],
+        ])
+
+    def filter_groups(self):
+        """Yields lists of ``(name, filter)``, either a single whole tree
+        filter or adjacent visitor filters"""
+        group = []
+        for entry in self.filter_registry:
+            if group and not (isinstance(entry[1], VisitorFilter) and
+                              isinstance(group[-1][1], VisitorFilter)):
+                yield group
+                group = []
+            group.append(entry)
+        if group:
+            yield group
+
     def splitters(self):
         for s in self.splitter_registry:
             yield (s[1], s[2])
 
-
-processor_registry = HTMLProcessorRegistry()
-processor_registry.register_filter('class_styles', class_to_style)
-processor_registry.register_filter('underlines', add_underlines)
-processor_registry.register_filter('resolve_hrefs', fix_hrefs)
-processor_registry.register_splitter('images', find_images, split_images)
-processor_registry.register_splitter('webvideo', find_videos, split_videos)
-processor_registry.register_splitter('headings', find_headings, split_headings)
+    def compile_splitters(self):
+        return SplitterDispatch(self.splitter_registry, self.splitter_tags)
 
 
+processor_registry = HTMLProcessorRegistry()
+processor_registry.register_visitor('class_styles',
+                                    element_visitor(set_class_style),
+                                    predicate=has_class)
+processor_registry.register_visitor('underlines',
+                                    element_visitor(set_underline_style),
+                                    predicate=has_underline)
+processor_registry.register_visitor('resolve_hrefs', HrefFixer, tags=('a',))
+processor_registry.register_splitter('images', None, split_images,
+                                     tags=('img',))
+processor_registry.register_splitter('webvideo', is_video, split_videos,
+                                     tags=('iframe',))
+processor_registry.register_splitter('headings', None, split_headings,
+                                     tags=TAG_MAP.keys())
+
+
+class Uncacheable(Exception):
+    """Processed HTML parts which can't be cached"""
+
+
+def freeze(value, dependencies, images=None):
+    """Returns a copy of processed HTML parts made of builtin types, with
+    content replaced by its UID and the images from ``split_images`` by
+    their source from ``images``, adding the content it depends on to
+    ``dependencies``"""
+    if images is None:
+        images = {}
+    if value is None or isinstance(value, six.string_types + (
+            bool, float) + six.integer_types):
+        return value
+    if isinstance(value, (list, tuple)):
+        return type(value)(freeze(v, dependencies, images) for v in value)
+    if isinstance(value, dict):
+        image = images.get(id(value))
+        if image is not None and image[0] is value:
+            fullimage = value['fullimage']
+            if fullimage is not None:
+                freeze(fullimage, dependencies, images)
+            frozen = dict((k, freeze(v, dependencies, images))
+                          for k, v in value.items() if k not in IMAGE_KEYS)
+            frozen['__image__'] = image[1]
+            return frozen
+        return dict((k, freeze(v, dependencies, images))
+                    for k, v in value.items())
+    uid = IUUID(value, None)
+    if uid is None:
+        raise Uncacheable(value)
+    dependencies[uid] = value
+    return {'__uid__': uid}
+
+
+def thaw(value, resolver):
+    """Returns processed HTML parts from a copy made by ``freeze``, with
+    content and images resolved again"""
+    if isinstance(value, (list, tuple)):
+        return type(value)(thaw(v, resolver) for v in value)
+    if not isinstance(value, dict):
+        return value
+    if '__uid__' in value:
+        obj = resolver.objects.get(value['__uid__'])
+        if obj is None:
+            raise Uncacheable(value['__uid__'])
+        return obj
+    thawed = dict((k, thaw(v, resolver)) for k, v in value.items()
+                  if k != '__image__')
+    if '__image__' in value:
+        source = value['__image__']
+        image, fullimage, src, description = resolver.resolve_image(source)
+        thawed.update(image=image, fullimage=fullimage, src=src,
+                      description=description)
+    return thawed
+
+
+def render_key(text, context, part_name, settings):
+    """Returns a hash of the HTML and everything its processing depends
+    on, or None if it can't be cached"""
+    if context is None or not hasattr(context, 'getPhysicalPath'):
+        return None
+    try:
+        portal_url = api.portal.get().absolute_url()
+    except CannotGetPortalError:
+        return None
+    data = json.dumps([
+        RENDER_VERSION, text, part_name, processor_registry.signature(),
+        getattr(settings, 'canonical_url', None), portal_url,
+        '/'.join(context.getPhysicalPath()),
+    ])
+    return hashlib.sha256(data.encode('utf8')).hexdigest()
+
+
+def stored_parts(context, part_name):
+    annotations = IAnnotations(context, None)
+    if annotations is not None:
+        return annotations.get(RENDERED_KEY, {}).get(part_name)
+
+
+def cached_parts(key, context, part_name, settings):
+    """Returns the cached processed HTML for ``key``, or None"""
+    entry = render_cache.get(key)
+    stored = None
+    if entry is None and getattr(settings, 'persist_rendered_html', False):
+        stored = stored_parts(context, part_name)
+        if stored is None or stored['key'] != key:
+            return None
+        entry = (stored['parts'], sorted(stored['urls']),
+                 sorted(stored.get('unresolved', ())))
+    if entry is None:
+        return None
+    frozen, dependencies, unresolved = entry
+    previous = getattr(_local, 'resolver', None)
+    objects = resolve_uids(dependencies + unresolved, context)
+    resolver = _local.resolver = UIDResolver(context, objects)
+    try:
+        if any(uid in objects for uid in unresolved):
+            # Content linked to has been added since
+            raise Uncacheable(unresolved)
+        if stored is not None:
+            # Content linked to could have moved since it was stored
+            portal_url = api.portal.get().absolute_url()
+            for uid, url in stored['urls'].items():
+                obj = objects.get(uid)
+                if obj is None or obj_url(obj, settings, portal_url) != url:
+                    return None
+            render_cache.set(key, entry, dependencies + unresolved)
+        return thaw(frozen, resolver)
+    except Uncacheable:
+        render_cache.invalidate(key)
+        return None
+    finally:
+        _local.resolver = previous
+
+
+def cache_parts(key, parts, context, part_name, settings, resolver):
+    """Caches processed HTML parts, if possible"""
+    dependencies = dict(resolver.resolved)
+    try:
+        frozen = freeze(parts, dependencies, resolver.images)
+    except Uncacheable:
+        return
+    # Links to missing content depend on it, so that the processed HTML is
+    # discarded when it is added
+    unresolved = sorted(resolver.unresolved.difference(dependencies))
+    render_cache.set(key, (frozen, sorted(dependencies), unresolved),
+                     list(dependencies) + unresolved)
+    if not getattr(settings, 'persist_rendered_html', False):
+        return
+    annotations = IAnnotations(context, None)
+    if annotations is None:
+        return
+    portal_url = api.portal.get().absolute_url()
+    entry = {
+        'key': key,
+        'parts': frozen,
+        'urls': dict((uid, obj_url(obj, settings, portal_url))
+                     for uid, obj in dependencies.items()),
+        'unresolved': unresolved,
+    }
+    # Avoid writing to the content when nothing has changed
+    if stored_parts(context, part_name) != entry:
+        rendered = dict(annotations.get(RENDERED_KEY, {}))
+        rendered[part_name] = entry
+        annotations[RENDERED_KEY] = rendered
+
+
+@metrics.render_duration.time(stage='process_html')
+@timed('process_html')
 def process_html(text, context, part_name='body'):
-    parts = []
+    settings = get_settings()
+    key = render_key(text, context, part_name, settings)
+    if key is not None:
+        parts = cached_parts(key, context, part_name, settings)
+        if parts is not None:
+            return parts
+
     html_parser = html.HTMLParser(remove_blank_text=True)
     tree = html.fragment_fromstring(
         text, create_parent=True, parser=html_parser
     )
 
-    # Apply filters
-    for filter in processor_registry.filters():
-        filter(tree, context)
+    # Resolve all the UIDs referenced in the HTML at once, for use by
+    # filters and splitters
+    previous = getattr(_local, 'resolver', None)
+    with timer('resolve_uids'):
+        objects = resolve_uids(find_uids(tree), context)
+    resolver = _local.resolver = UIDResolver(context, objects)
+    try:
+        parts = process_tree(tree, context, part_name)
+    finally:
+        _local.resolver = previous
+    if key is not None:
+        cache_parts(key, parts, context, part_name, settings, resolver)
+    return parts
+
+
+def process_tree(tree, context, part_name='body'):
+    parts = []
+
+    apply_filters(tree, context)
+
+    dispatch = processor_registry.compile_splitters()
+    accumulators = {}
+    if timing.enabled:
+        # Splitters are applied to each element, time them all together
+        accumulators = dict((s[0], timing.Accumulator('splitter', s[0]))
+                            for s in dispatch.splitters)
 
     # Split HTML into text/body sections divided by other components
     section_count = 0
@@ -365,11 +950,9 @@ def process_html(text, context, part_name='body'):
     for i, el in enumerate(tree):
         before_parts = []
         after_parts = []
-        for matcher, splitter in processor_registry.splitters():
-            found_els = matcher(el)
-            if len(found_els) == 0:
-                continue
-
+        for name, splitter, found_els in dispatch.match(el):
+            if accumulators:
+                splitter = accumulators[name].wrap(splitter)
             before_anchor = '{}-section-{}'.format(part_name, section_count + 1)
             after_anchor = None
             if child_count > (i + 1):
@@ -414,4 +997,6 @@ def process_html(text, context, part_name='body'):
             cur_els, '{}-section-{}'.format(part_name, section_count)
         ))
 
+    for accumulator in accumulators.values():
+        accumulator.record()
     return parts
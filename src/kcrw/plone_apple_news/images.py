@@ -0,0 +1,147 @@
+"""Scaling of an image to several sizes from a single decoded original"""
+import PIL.Image
+import six
+import threading
+from multiprocessing.pool import ThreadPool
+from plone.scale.scale import scaleImage
+
+QUALITY = 88
+LANCZOS = getattr(PIL.Image, 'LANCZOS', None) or PIL.Image.ANTIALIAS
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def thumbnail_size(size, box):
+    """Returns the size of an image of ``size`` scaled to fit within
+    ``box``, without upscaling"""
+    width, height = size
+    factor = min(float(box[0]) / width, float(box[1]) / height, 1.0)
+    return (max(int(round(width * factor)), 1),
+            max(int(round(height * factor)), 1))
+
+
+def plone_scale(data, width, height):
+    """Scales image data using ``plone.scale``"""
+    try:
+        result = scaleImage(data, direction="thumbnail",
+                            width=width, height=height,
+                            allow_webp=False)
+    except TypeError:
+        result = scaleImage(data, direction="thumbnail",
+                            width=width, height=height)
+    if result is not None:
+        data = result[0]
+        if not isinstance(data, six.binary_type):
+            data = data.data
+        return data
+
+
+def close_data(data):
+    """Closes original image data opened as a file, e.g. a blob"""
+    if not isinstance(data, six.binary_type):
+        close = getattr(data, 'close', None)
+        if close is not None:
+            close()
+
+
+def scale_image(data, sizes):
+    """Scales image ``data`` (a string or file) to fit each of the
+    ``(width, height)`` boxes in the ``sizes`` mapping and returns a mapping
+    of the same keys to the scaled image data.
+
+    The original is only decoded once. Sizes are produced largest first,
+    and smaller sizes are scaled down from a previous result when it is
+    large enough, rather than from the original.
+    """
+    if isinstance(data, six.binary_type):
+        data = six.BytesIO(data)
+    results = {}
+    image = PIL.Image.open(data)
+    format_ = image.format
+    if getattr(image, 'is_animated', False):
+        # Leave animations to plone.scale
+        for key, (width, height) in sizes.items():
+            data.seek(0)
+            results[key] = plone_scale(data, width, height)
+        return results
+    if format_ not in ('PNG', 'GIF'):
+        format_ = 'JPEG'
+
+    targets = sorted(
+        ((thumbnail_size(image.size, box), key) for key, box in sizes.items()),
+        reverse=True
+    )
+    if not targets:
+        return results
+    if image.format == 'JPEG':
+        # Let the decoder skip detail we won't need for the largest scale
+        image.draft(image.mode, (max(t[0][0] for t in targets),
+                                 max(t[0][1] for t in targets)))
+    if image.mode == 'P':
+        image = image.convert('RGBA')
+    elif image.mode == '1':
+        image = image.convert('L')
+
+    scaled_images = [image]
+    for target, key in targets:
+        source = image
+        for scaled in scaled_images:
+            if scaled.size[0] >= target[0] and scaled.size[1] >= target[1]:
+                source = scaled
+        if source.size != target:
+            source = source.resize(target, LANCZOS)
+            scaled_images.append(source)
+        if format_ == 'JPEG' and source.mode not in ('RGB', 'L', 'CMYK'):
+            source = source.convert('RGB')
+        result = six.BytesIO()
+        source.save(result, format_, quality=QUALITY, optimize=True,
+                    progressive=format_ == 'JPEG')
+        results[key] = result.getvalue()
+    return results
+
+
+def _scale_job(job):
+    return scale_image(*job)
+
+
+def get_pool(workers):
+    """Returns the shared pool of ``workers`` threads. When the number of
+    workers is changed, the previous pool is closed and its threads exit
+    once they have finished their current jobs."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.close()
+            _pool = ThreadPool(workers)
+            _pool_workers = workers
+        return _pool
+
+
+def close_pool():
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool.join()
+        _pool = _pool_workers = None
+
+
+def scale_images(jobs, mode=u'threads', workers=4):
+    """Runs ``scale_image`` for each ``(data, sizes)`` pair in ``jobs``, in
+    a shared pool of threads if ``mode`` is ``threads``, or one at a time.
+    Pillow releases the GIL while decoding and resizing, so the threads
+    scale images in parallel. Returns the results in the order of
+    ``jobs``."""
+    jobs = list(jobs)
+    if mode != u'threads' or len(jobs) < 2:
+        return [_scale_job(job) for job in jobs]
+    try:
+        result = get_pool(max(int(workers or 1), 1)).map_async(_scale_job,
+                                                               jobs)
+    except (AssertionError, ValueError):
+        # The pool was closed for a change of settings since it was returned
+        return [_scale_job(job) for job in jobs]
+    return result.get()
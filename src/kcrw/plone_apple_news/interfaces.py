@@ -77,6 +77,118 @@ class IAppleNewsSettings(Interface):
         constraint=json_constraint,
         required=False
     )
+    queue_requests = schema.Bool(
+        title=_(u'Queue API Requests'),
+        description=_(u'Queue Apple News API requests to be sent by the '
+                      u'@@apple-news-process-queue view (e.g. from a clock '
+                      u'server or cron job) instead of during the '
+                      u'editor\'s request.'),
+        default=False,
+        required=False
+    )
+    optimistic_updates = schema.Bool(
+        title=_(u'Optimistic Updates'),
+        description=_(u'Send article updates with the last known revision, '
+                      u'only fetching the current revision from Apple News '
+                      u'when it reports a conflict. When disabled, the '
+                      u'revision is fetched before every update.'),
+        default=True,
+        required=False
+    )
+    rate_limit = schema.Float(
+        title=_(u'API Rate Limit'),
+        description=_(u'Maximum average number of Apple News API requests '
+                      u'per second made by each Zope process, 0 for no '
+                      u'limit.'),
+        default=5.0,
+        min=0.0,
+        required=False
+    )
+    rate_limit_burst = schema.Int(
+        title=_(u'API Rate Limit Burst'),
+        description=_(u'Number of requests which may be made at once before '
+                      u'the rate limit applies.'),
+        default=10,
+        min=1,
+        required=False
+    )
+    max_retries = schema.Int(
+        title=_(u'API Retries'),
+        description=_(u'Number of times to retry a request when Apple News '
+                      u'is throttling requests or unavailable.'),
+        default=3,
+        min=0,
+        required=False
+    )
+    retry_backoff = schema.Float(
+        title=_(u'API Retry Delay'),
+        description=_(u'Seconds to wait before the first retry, doubled for '
+                      u'each further retry, unless Apple News specifies a '
+                      u'delay.'),
+        default=1.0,
+        min=0.0,
+        required=False
+    )
+    request_timeout = schema.Float(
+        title=_(u'API Request Timeout'),
+        description=_(u'Seconds to wait for a response from Apple News, 0 '
+                      u'to wait indefinitely.'),
+        default=30.0,
+        min=0.0,
+        required=False
+    )
+    breaker_threshold = schema.Int(
+        title=_(u'API Failure Threshold'),
+        description=_(u'After this many consecutive failed requests, stop '
+                      u'sending requests to Apple News for a while, '
+                      u'reporting an error for content changes (unless '
+                      u'requests are queued). 0 to always send requests.'),
+        default=5,
+        min=0,
+        required=False
+    )
+    breaker_cooldown = schema.Int(
+        title=_(u'API Failure Cooldown'),
+        description=_(u'Seconds to wait after repeated failures before '
+                      u'trying Apple News again.'),
+        default=60,
+        min=1,
+        required=False
+    )
+    image_scaling = schema.Choice(
+        title=_(u'Image Scaling'),
+        description=_(u'Whether to scale the images in an article one at a '
+                      u'time, or in parallel in a pool of threads.'),
+        values=(u'serial', u'threads'),
+        default=u'threads',
+        required=False
+    )
+    image_scaling_workers = schema.Int(
+        title=_(u'Image Scaling Workers'),
+        description=_(u'Number of threads used to scale images in parallel. '
+                      u'At most this many original images are held in '
+                      u'memory at once.'),
+        default=4,
+        min=1,
+        required=False
+    )
+    bulk_concurrency = schema.Int(
+        title=_(u'Bulk Update Concurrency'),
+        description=_(u'Maximum number of simultaneous Apple News API '
+                      u'requests made when updating articles in bulk.'),
+        default=4,
+        min=1,
+        required=False
+    )
+    persist_rendered_html = schema.Bool(
+        title=_(u'Store Processed HTML'),
+        description=_(u'Store the processed HTML of each article with the '
+                      u'content, so that unchanged article text isn\'t '
+                      u'processed again after a restart. Processed HTML is '
+                      u'always cached in memory.'),
+        default=False,
+        required=False
+    )
 
 
 class IAppleNewsActions(Interface):
@@ -84,17 +196,25 @@ class IAppleNewsActions(Interface):
 
     data = Attribute("Stored article data")
 
-    def create_article():
-        """Publishes a new Apple News Article"""
+    def create_article(defer=None):
+        """Publishes a new Apple News Article. Returns None if the request
+        was queued."""
 
-    def update_article():
-        """Publishes a new Apple News Article"""
+    def update_article(defer=None, force=False):
+        """Publishes a new Apple News Article. Returns None if the request
+        was queued (also if the article's create request is still queued),
+        or False if the article content is unchanged since the
+        last upload and ``force`` is not set. Forced updates always refresh
+        the revision first."""
 
-    def update_metadata(additional_data=None):
-        """Publishes a new Apple News Article"""
+    def update_metadata(additional_data=None, defer=None, force=False):
+        """Publishes a new Apple News Article. Returns None if the request
+        was queued. Forced updates always refresh the revision first, even
+        if the article has changed in Apple News."""
 
-    def delete_article():
-        """Publishes a new Apple News Article"""
+    def delete_article(defer=None):
+        """Publishes a new Apple News Article. Returns None if the request
+        was queued."""
 
     def refresh_revision():
         """Sync revision metadata"""
@@ -106,6 +226,10 @@ class IAppleNewsGenerator(Interface):
     def article_data():
         """Gets JSON formatted article data"""
 
+    def article_meta():
+        """Gets the ``metadata`` of the article JSON, without generating the
+        rest of the article"""
+
     def article_metadata():
         """Gets JSON formatted article metadata"""
 
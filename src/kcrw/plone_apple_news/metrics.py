@@ -0,0 +1,204 @@
+"""Process wide publishing and rendering metrics, exported in the Prometheus
+text format by the ``@@apple-news-metrics`` view.
+
+Metrics are kept in memory by each Zope process, so each instance should
+be scraped separately.
+"""
+import threading
+import time
+from functools import wraps
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RENDER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+clock = getattr(time, 'perf_counter', time.time)
+
+_metrics = []
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ) + '}'
+
+
+class Metric(object):
+    """Base for metrics with values for each combination of labels"""
+    type = None
+
+    def __init__(self, name, help, register=True):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._lock = threading.Lock()
+        if register:
+            _metrics.append(self)
+
+    def samples(self):
+        """Returns a list of ``(name, labels, value)`` tuples"""
+        with self._lock:
+            return [(self.name, labels, value)
+                    for labels, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [u'# HELP {} {}'.format(self.name, self.help),
+                 u'# TYPE {} {}'.format(self.name, self.type)]
+        for name, labels, value in self.samples():
+            lines.append(u'{}{} {}'.format(name, format_labels(labels),
+                                           format_value(value)))
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets, register=True):
+        super(Histogram, self).__init__(name, help, register)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+
+    def time(self, **labels):
+        """Decorates a function to observe the duration of its calls"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kw):
+                start = clock()
+                try:
+                    return func(*args, **kw)
+                finally:
+                    self.observe(clock() - start, **labels)
+            return wrapper
+        return decorator
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = sorted(
+                (labels, (list(counts), total))
+                for labels, (counts, total) in self.values.items()
+            )
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((self.name + '_bucket',
+                                labels + (('le', format_value(bound)),),
+                                cumulative))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+articles = Counter(
+    'kcrw_apple_news_articles_total',
+    'Articles created, updated and deleted in Apple News'
+)
+api_duration = Histogram(
+    'kcrw_apple_news_api_request_duration_seconds',
+    'Duration of Apple News API requests, including retries',
+    API_BUCKETS
+)
+api_errors = Counter(
+    'kcrw_apple_news_api_errors_total',
+    'Failed Apple News API responses by HTTP status'
+)
+api_rejected = Counter(
+    'kcrw_apple_news_api_rejected_total',
+    'API requests refused while the circuit breaker is open'
+)
+image_scales = Counter(
+    'kcrw_apple_news_image_scales_total',
+    'Article image scales found in the scale storage (hit) or scaled (miss)'
+)
+render_duration = Histogram(
+    'kcrw_apple_news_render_duration_seconds',
+    'Duration of article generation and HTML processing',
+    RENDER_BUCKETS
+)
+
+
+def error_label(code):
+    """The ``code`` label of an API error"""
+    if code is None:
+        return 'connection'
+    if code >= 500:
+        return '5xx'
+    if code in (404, 409, 429):
+        return str(code)
+    return 'other'
+
+
+def operation(method, route):
+    """The API operation of a request, e.g. ``create_article``"""
+    parts = route.strip('/').split('/')
+    if parts[0] == 'channels':
+        if len(parts) > 2:
+            return 'create_article'
+        return 'read_channel'
+    if method == 'DELETE':
+        return 'delete_article'
+    if method == 'POST':
+        return 'update_article'
+    return 'read_article'
+
+
+def render(extra=()):
+    """Returns the registered metrics and any ``extra`` metrics in the
+    Prometheus text format"""
+    lines = []
+    for metric in list(_metrics) + list(extra):
+        lines.extend(metric.render())
+    return u'\n'.join(lines) + u'\n'
+
+
+def reset():
+    for metric in _metrics:
+        metric.reset()
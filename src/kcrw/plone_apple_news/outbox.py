@@ -0,0 +1,198 @@
+"""Persistent outbox for deferring Apple News API requests.
+
+Actions are queued on the site root, keyed by content UID, and sent by
+``process_queue``, which is meant to be called periodically outside of
+editor requests (see the ``@@apple-news-process-queue`` view).
+"""
+import threading
+import time
+import transaction
+from BTrees.OOBTree import OOBTree
+from zope.annotation.interfaces import IAnnotations
+from plone import api
+from plone.app.uuid.utils import uuidToObject
+from plone.uuid.interfaces import IUUID
+from Products.CMFPlone.log import log
+from Products.CMFPlone.log import log_exc
+from kcrw.apple_news import AppleNewsError
+from .client import api_available
+from .client import get_client
+from .interfaces import IAppleNewsActions
+from .utils import mergedicts
+
+QUEUE_KEY = 'kcrw.apple_news_queue'
+MAX_ATTEMPTS = 5
+
+_worker_lock = threading.Lock()
+
+
+def get_queue(create=False):
+    portal = api.portal.get()
+    annotations = IAnnotations(portal)
+    queue = annotations.get(QUEUE_KEY)
+    if queue is None and create:
+        queue = annotations[QUEUE_KEY] = OOBTree()
+    return queue
+
+
+def queue_length():
+    queue = get_queue()
+    if queue is None:
+        return 0
+    return len(queue)
+
+
+def queued_actions(context):
+    """Returns the names of the actions queued for ``context``"""
+    queue = get_queue()
+    uid = IUUID(context, None)
+    entry = queue is not None and uid is not None and queue.get(uid)
+    if not entry:
+        return []
+    return [action for action, kw in entry['actions']]
+
+
+def merge_actions(pending, action, kw):
+    """Combine a newly requested action with the actions already pending
+    for an article, dropping requests made redundant by earlier ones."""
+    pending = list(pending)
+    if action == 'delete':
+        if pending and pending[0][0] == 'create':
+            # Never sent to Apple News, nothing to delete
+            return []
+        return [(action, kw)]
+    for i, (name, args) in enumerate(pending):
+        if name == action == 'metadata':
+            additional = dict(mergedicts(
+                args.get('additional_data') or {},
+                kw.get('additional_data') or {}
+            ))
+            merged = dict(args, additional_data=additional)
+            if kw.get('force'):
+                merged['force'] = True
+            pending[i] = (name, merged)
+            return pending
+        if name == action == 'update' and kw.get('force'):
+            pending[i] = (name, dict(args, force=True))
+            return pending
+        if name == action or (name == 'create' and action == 'update'):
+            return pending
+    pending.append((action, kw))
+    return pending
+
+
+def queue_action(context, action, **kw):
+    """Adds an action for ``context`` to the outbox"""
+    queue = get_queue(create=True)
+    uid = IUUID(context)
+    entry = queue.get(uid)
+    if entry is None:
+        entry = {'actions': [], 'queued': time.time(), 'attempts': 0}
+    actions = merge_actions(entry['actions'], action, kw)
+    if actions:
+        queue[uid] = dict(entry, actions=actions)
+    elif uid in queue:
+        del queue[uid]
+
+
+def requeue(uid, actions, attempts, error=None):
+    """Puts unsent actions back in the outbox ahead of any actions queued
+    while they were being processed."""
+    queue = get_queue(create=True)
+    entry = queue.get(uid)
+    if entry is not None:
+        for action, kw in entry['actions']:
+            actions = merge_actions(actions, action, kw)
+    if actions:
+        queue[uid] = {
+            'actions': actions,
+            'queued': time.time(),
+            'attempts': attempts,
+            'error': error,
+        }
+
+
+def run_action(uid, action, kw):
+    obj = uuidToObject(uid)
+    if obj is None:
+        if action == 'delete' and kw.get('article_id'):
+            # Content was removed before the queue was processed
+            return get_client().delete_article(kw['article_id'])
+        log(u'Skipping queued Apple News {} for missing '
+            u'content {}'.format(action, uid))
+        return
+    adapter = IAppleNewsActions(obj)
+    if action == 'create':
+        return adapter.create_article(defer=False)
+    elif action == 'update':
+        return adapter.update_article(defer=False,
+                                      force=kw.get('force', False))
+    elif action == 'metadata':
+        return adapter.update_metadata(kw.get('additional_data'),
+                                       defer=False,
+                                       force=kw.get('force', False))
+    elif action == 'delete':
+        return adapter.delete_article(defer=False)
+
+
+def process_queue(limit=None):
+    """Sends queued requests in the order they were queued. Returns a list
+    of ``(uid, action, status)`` tuples, or ``None`` if the queue is already
+    being processed in this process."""
+    if not _worker_lock.acquire(False):
+        return None
+    try:
+        return _process_queue(limit)
+    finally:
+        _worker_lock.release()
+
+
+def _process_queue(limit=None):
+    results = []
+    queue = get_queue()
+    if not queue:
+        return results
+    entries = sorted(queue.items(), key=lambda e: e[1]['queued'])
+    if limit:
+        entries = entries[:limit]
+    for uid, entry in entries:
+        if not api_available():
+            # Leave the rest of the queue until Apple News recovers
+            break
+        if uid not in queue:
+            continue
+        del queue[uid]
+        transaction.commit()
+        actions = list(entry['actions'])
+        while actions:
+            action, kw = actions[0]
+            try:
+                run_action(uid, action, kw)
+            except Exception as e:
+                transaction.abort()
+                code = None
+                if isinstance(e, AppleNewsError):
+                    code = e.code
+                    log(u'Handled Apple News Error processing queued {} for '
+                        u'{}: {} {}'.format(action, uid, e, e.data))
+                else:
+                    log_exc(u'Error processing queued Apple News {} '
+                            u'for {}'.format(action, uid))
+                results.append((uid, action, code or 'error'))
+                if code and 400 <= code < 500 and code != 429:
+                    # Retrying won't help, skip to the next action
+                    actions.pop(0)
+                    continue
+                attempts = entry.get('attempts', 0) + 1
+                if attempts < MAX_ATTEMPTS:
+                    requeue(uid, actions, attempts, str(e))
+                else:
+                    log(u'Giving up on queued Apple News {} for {} after '
+                        u'{} attempts'.format(action, uid, attempts))
+                transaction.commit()
+                break
+            else:
+                results.append((uid, action, 'ok'))
+                transaction.commit()
+                actions.pop(0)
+    return results
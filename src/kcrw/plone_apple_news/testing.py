@@ -4,9 +4,15 @@ from plone.app.testing import applyProfile
 from plone.app.testing import FunctionalTesting
 from plone.app.testing import IntegrationTesting
 from plone.app.testing import PloneSandboxLayer
+from plone.registry.interfaces import IRegistry
+from plone.testing import Layer
 from plone.testing import z2
+from zope.component import getUtility
 
 import kcrw.plone_apple_news
+from kcrw.plone_apple_news.client import clear_clients
+from kcrw.plone_apple_news.client import PooledAPI
+from kcrw.plone_apple_news.fakeapi import FakeAppleNewsServer
 
 
 class KcrwPloneAppleNewsLayer(PloneSandboxLayer):
@@ -36,3 +42,64 @@ KCRW_PLONE_APPLE_NEWS_FUNCTIONAL_TESTING = FunctionalTesting(
     bases=(KCRW_PLONE_APPLE_NEWS_FIXTURE,),
     name='KcrwPloneAppleNewsLayer:FunctionalTesting',
 )
+
+
+class FakeAppleNewsAPILayer(Layer):
+    """Runs a local stand-in for the Apple News API, which the shared API
+    clients send their requests to. The server is available as the
+    ``apple_news_api`` resource, and reset for each test."""
+
+    def setUp(self):
+        self['apple_news_api'] = FakeAppleNewsServer().start()
+        self._url_base = PooledAPI.__dict__.get('url_base')
+        PooledAPI.url_base = self['apple_news_api'].url
+        clear_clients()
+
+    def testSetUp(self):
+        server = self['apple_news_api']
+        server.reset()
+        server.latency = 0
+        server.rate_limit = None
+        server.failure_rate = 0
+        # Fresh clients, without any circuit breaker state
+        clear_clients()
+
+    def tearDown(self):
+        if self._url_base is None:
+            del PooledAPI.url_base
+        else:
+            PooledAPI.url_base = self._url_base
+        clear_clients()
+        self['apple_news_api'].stop()
+        del self['apple_news_api']
+
+
+APPLE_NEWS_API_FIXTURE = FakeAppleNewsAPILayer()
+
+
+class KcrwPloneAppleNewsAPILayer(PloneSandboxLayer):
+    """Configures the add-on to publish to the fake Apple News API, and
+    enables Apple News support for Documents"""
+
+    defaultBases = (KCRW_PLONE_APPLE_NEWS_FIXTURE, APPLE_NEWS_API_FIXTURE)
+
+    def setUpPloneSite(self, portal):
+        registry = getUtility(IRegistry)
+        registry['kcrw.apple_news.api_key_id'] = u'fake-key-id'
+        registry['kcrw.apple_news.api_key_secret'] = u'ZmFrZS1zZWNyZXQ='
+        registry['kcrw.apple_news.channel_id'] = u'fake-channel'
+        registry['kcrw.apple_news.retry_backoff'] = 0.01
+        fti = portal.portal_types.Document
+        fti.behaviors = tuple(fti.behaviors) + (
+            'kcrw.plone_apple_news.interfaces.IAppleNewsSupport',
+        )
+
+
+KCRW_PLONE_APPLE_NEWS_API_FIXTURE = KcrwPloneAppleNewsAPILayer()
+
+
+# Publishing commits transactions, so only use functional testing
+KCRW_PLONE_APPLE_NEWS_API_FUNCTIONAL_TESTING = FunctionalTesting(
+    bases=(KCRW_PLONE_APPLE_NEWS_API_FIXTURE,),
+    name='KcrwPloneAppleNewsAPILayer:FunctionalTesting',
+)
@@ -0,0 +1,491 @@
+import six
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.apple_news import AppleNewsError
+from kcrw.plone_apple_news.adapter import AppleNewsActions
+from kcrw.plone_apple_news.adapter import BaseAppleNewsGenerator
+from kcrw.plone_apple_news.adapter import has_apple_news
+from kcrw.plone_apple_news.adapter import remove_components
+
+
+class TestStoredScales(unittest.TestCase):
+
+    def test_stored_scale_data(self):
+        scale_view = mock.Mock()
+        scale_view.scale.return_value.data.data = b'scaled'
+        data = BaseAppleNewsGenerator.get_stored_scale(
+            scale_view, 'image', 'large'
+        )
+        self.assertEqual(data, b'scaled')
+        scale_view.scale.assert_called_once_with(
+            'image', scale='large', direction='thumbnail'
+        )
+
+    def test_missing_scale(self):
+        scale_view = mock.Mock()
+        scale_view.scale.return_value = None
+        self.assertIsNone(BaseAppleNewsGenerator.get_stored_scale(
+            scale_view, 'image', 'large'
+        ))
+
+    def test_unsupported_scale_view(self):
+        scale_view = mock.Mock()
+        scale_view.scale.side_effect = TypeError
+        self.assertIsNone(BaseAppleNewsGenerator.get_stored_scale(
+            scale_view, 'image', 'large'
+        ))
+
+
+class DummyImage(object):
+    filename = u'photo.jpg'
+    contentType = 'image/jpeg'
+
+    def open(self):
+        return b'original'
+
+
+class DummyContent(object):
+    image = DummyImage()
+
+    def __init__(self):
+        self.scale_view = mock.Mock()
+        self.scale_view.getAvailableSizes.return_value = {
+            'large': (768, 768), 'thumb': (128, 128), 'icon': (0, 0)
+        }
+        self.scale_view.scale.return_value = None
+
+    def unrestrictedTraverse(self, name):
+        return self.scale_view
+
+    def getId(self):
+        return 'content'
+
+
+@mock.patch('kcrw.plone_apple_news.adapter.get_settings', return_value={})
+class TestPopulateImages(unittest.TestCase):
+
+    @mock.patch('kcrw.plone_apple_news.adapter.scale_image',
+                side_effect=lambda data, sizes: {k: b'scaled-' + k.encode()
+                                                 for k in sizes})
+    def test_scales_original_once(self, scale_image, settings):
+        context = DummyContent()
+        generator = BaseAppleNewsGenerator(context)
+        filenames = generator.populate_images(
+            context, 'image', ['large', 'thumb', 'icon', 'missing']
+        )
+        self.assertEqual(filenames, {'large': u'large-photo.jpg',
+                                     'thumb': u'thumb-photo.jpg'})
+        scale_image.assert_called_once_with(
+            b'original', {'large': (768, 768), 'thumb': (128, 128)}
+        )
+        self.assertEqual(generator.assets[u'thumb-photo.jpg'], b'scaled-thumb')
+        # Already populated scales are reused
+        self.assertEqual(
+            generator.populate_image(context, 'image', 'thumb'),
+            u'thumb-photo.jpg'
+        )
+        self.assertEqual(scale_image.call_count, 1)
+
+    @mock.patch('kcrw.plone_apple_news.adapter.scale_image')
+    def test_stored_scales_preferred(self, scale_image, settings):
+        context = DummyContent()
+        context.scale_view.scale.return_value = mock.Mock()
+        context.scale_view.scale.return_value.data.data = b'stored'
+        generator = BaseAppleNewsGenerator(context)
+        filenames = generator.populate_images(context, 'image', ['large'])
+        self.assertEqual(filenames, {'large': u'large-photo.jpg'})
+        self.assertEqual(generator.assets[u'large-photo.jpg'], b'stored')
+        self.assertFalse(scale_image.called)
+
+    @mock.patch('kcrw.plone_apple_news.adapter.scale_images',
+                side_effect=lambda jobs, mode, workers: [
+                    {k: b'scaled' for k in sizes if k != 'thumb'}
+                    for data, sizes in jobs
+                ])
+    def test_collected_scaling(self, scale_images, settings):
+        context = DummyContent()
+        generator = BaseAppleNewsGenerator(context)
+        generator.scaling_jobs = []
+        generator.scaling_failed = set()
+        self.assertEqual(
+            generator.populate_image(context, 'image', 'large'),
+            u'large-photo.jpg'
+        )
+        # Pending scales aren't scaled again
+        generator.populate_images(context, 'image', ['large', 'thumb'])
+        self.assertEqual(len(generator.scaling_jobs), 2)
+        self.assertEqual(generator.assets, {})
+        failed = generator.run_scaling_jobs()
+        self.assertEqual(scale_images.call_count, 1)
+        self.assertEqual(failed, set([u'thumb-photo.jpg']))
+        self.assertEqual(generator.assets, {u'large-photo.jpg': b'scaled'})
+        self.assertIsNone(generator.scaling_jobs)
+
+    @mock.patch('kcrw.plone_apple_news.adapter.scale_images',
+                side_effect=lambda jobs, mode, workers: [
+                    {k: b'scaled' for k in sizes if k != 'thumb'}
+                    for data, sizes in jobs
+                ])
+    def test_scaling_jobs_bounded(self, scale_images, settings):
+        context = DummyContent()
+        generator = BaseAppleNewsGenerator(context)
+        generator.image_scaling_workers = 2
+        generator.scaling_jobs = []
+        generator.scaling_failed = set()
+        data = DummyImage()
+        for i in range(5):
+            generator.add_scaling_job(data, {'large': (768, 768)},
+                                      {'large': u'large-{}.jpg'.format(i)})
+            self.assertLess(len(generator.scaling_jobs), 2)
+        self.assertEqual(scale_images.call_count, 2)
+        # The original data is passed on without reading it
+        self.assertIs(scale_images.call_args[0][0][0][0], data)
+        generator.add_scaling_job(data, {'thumb': (128, 128)},
+                                  {'thumb': u'thumb-photo.jpg'})
+        self.assertTrue(generator.is_pending(u'thumb-photo.jpg'))
+        self.assertEqual(generator.run_scaling_jobs(),
+                         set([u'thumb-photo.jpg']))
+        self.assertEqual(scale_images.call_count, 3)
+        self.assertEqual(len(generator.assets), 5)
+        generator.image_scaling = u'serial'
+        generator.scaling_jobs = []
+        generator.scaling_failed = set()
+        generator.add_scaling_job(data, {'large': (768, 768)},
+                                  {'large': u'large-5.jpg'})
+        self.assertEqual(generator.scaling_jobs, [])
+
+    @mock.patch('kcrw.plone_apple_news.adapter.scale_images')
+    def test_scaling_jobs_close_files(self, scale_images, settings):
+        generator = BaseAppleNewsGenerator(DummyContent())
+        generator.image_scaling_workers = 2
+        generator.scaling_jobs = []
+        generator.scaling_failed = set()
+        files = [six.BytesIO(b'original') for i in range(2)]
+        scale_images.return_value = [{}, {}]
+        generator.add_scaling_job(files[0], {'large': (768, 768)},
+                                  {'large': u'large-0.jpg'})
+        self.assertFalse(files[0].closed)
+        generator.add_scaling_job(files[1], {'large': (768, 768)},
+                                  {'large': u'large-1.jpg'})
+        self.assertTrue(all(f.closed for f in files))
+        # Also when scaling fails
+        scale_images.side_effect = IOError()
+        data = six.BytesIO(b'original')
+        generator.add_scaling_job(data, {'large': (768, 768)},
+                                  {'large': u'large-2.jpg'})
+        with self.assertRaises(IOError):
+            generator.run_scaling_jobs()
+        self.assertTrue(data.closed)
+
+
+class MetaContent(DummyContent):
+
+    def Description(self):
+        return 'Description'
+
+    def CreationDate(self):
+        return '2020-01-01T00:00:00+00:00'
+
+    def ModificationDate(self):
+        return '2020-01-02T00:00:00+00:00'
+
+
+@mock.patch('kcrw.plone_apple_news.adapter.get_settings', return_value={})
+@mock.patch('kcrw.plone_apple_news.adapter.obj_url',
+            return_value='http://site/content')
+@mock.patch.object(BaseAppleNewsGenerator, 'get_authors', return_value=[])
+@mock.patch.object(BaseAppleNewsGenerator, 'date')
+@mock.patch.object(BaseAppleNewsGenerator, 'article_components')
+class TestArticleMeta(unittest.TestCase):
+
+    @mock.patch('kcrw.plone_apple_news.adapter.scale_image')
+    def test_metadata_only(self, scale_image, components, date, authors,
+                           obj_url, settings):
+        date.return_value.ISO8601.return_value = '2020-01-01T12:00:00Z'
+        context = MetaContent()
+        generator = BaseAppleNewsGenerator(context)
+        generator.thumb_scale = 'thumb'
+        meta = generator.article_meta()
+        self.assertEqual(meta['excerpt'], u'Description')
+        self.assertEqual(meta['datePublished'], '2020-01-01T12:00:00Z')
+        self.assertEqual(meta['canonicalURL'], 'http://site/content')
+        self.assertEqual(meta['thumbnailURL'], u'bundle://thumb-photo.jpg')
+        self.assertEqual(meta['generatorName'], 'Plone Apple News')
+        self.assertNotIn('authors', meta)
+        self.assertFalse(components.called)
+        self.assertFalse(scale_image.called)
+        self.assertFalse(context.scale_view.scale.called)
+        self.assertEqual(generator.assets, {})
+
+    def test_no_thumbnail(self, components, date, authors, obj_url,
+                          settings):
+        context = MetaContent()
+        context.image = None
+        meta = BaseAppleNewsGenerator(context).article_meta()
+        self.assertNotIn('thumbnailURL', meta)
+
+
+class FooterSettings(object):
+    footer_html = u' <p>Footer <a href="/about">About</a></p> '
+
+
+class DummySite(object):
+
+    def getPhysicalPath(self):
+        return ('', 'site')
+
+    def absolute_url(self):
+        return 'http://site'
+
+
+@mock.patch('kcrw.plone_apple_news.adapter.get_settings',
+            return_value=FooterSettings())
+class TestFooter(unittest.TestCase):
+
+    def setUp(self):
+        from kcrw.plone_apple_news.cache import render_cache
+        render_cache.clear()
+        self.addCleanup(render_cache.clear)
+        site = DummySite()
+        for name in ('kcrw.plone_apple_news.adapter.portal.get',
+                     'kcrw.plone_apple_news.html.api.portal.get'):
+            patcher = mock.patch(name, return_value=site)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_processed_once(self, settings):
+        from kcrw.plone_apple_news import html
+        with mock.patch.object(html, 'process_tree',
+                               wraps=html.process_tree) as process_tree:
+            footers = [BaseAppleNewsGenerator(c).footer_component()
+                       for c in (DummyContent(), MetaContent())]
+        self.assertEqual(process_tree.call_count, 1)
+        self.assertEqual(footers[0], footers[1])
+        self.assertIsNot(footers[0]['components'][0],
+                         footers[1]['components'][0])
+        self.assertEqual(footers[0]['role'], 'aside')
+        self.assertEqual(
+            footers[0]['components'][0]['text'],
+            u'<div id="footer-section-1"><p>Footer '
+            u'<a href="/about">About</a></p></div>'
+        )
+
+
+@mock.patch('kcrw.plone_apple_news.adapter.IAnnotations',
+            side_effect=lambda obj, default=None: obj.annotations)
+class TestLazyActions(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.Mock(annotations={
+            'kcrw.apple_news_info': {'id': 'article-id'}
+        })
+
+    @mock.patch('kcrw.plone_apple_news.adapter.get_settings',
+                return_value={})
+    @mock.patch('kcrw.plone_apple_news.adapter.IAppleNewsGenerator')
+    def test_read_without_credentials(self, generator, settings,
+                                      annotations):
+        adapter = AppleNewsActions(self.context)
+        self.assertEqual(adapter.data, {'id': 'article-id'})
+        self.assertEqual(generator.call_count, 0)
+        with self.assertRaises(AppleNewsError):
+            adapter.api
+
+    @mock.patch('kcrw.plone_apple_news.adapter.get_settings',
+                return_value=mock.Mock(api_key_id='id'))
+    @mock.patch('kcrw.plone_apple_news.adapter.get_client')
+    def test_api_looked_up_once(self, api, settings, annotations):
+        adapter = AppleNewsActions(self.context)
+        self.assertEqual(api.call_count, 0)
+        self.assertIs(adapter.api, adapter.api)
+        self.assertEqual(api.call_count, 1)
+
+    def test_indexer(self, annotations):
+        self.assertTrue(has_apple_news.callable(self.context))
+        self.context.annotations = {}
+        self.assertFalse(has_apple_news.callable(self.context))
+
+
+@mock.patch('kcrw.plone_apple_news.adapter.IAnnotations',
+            side_effect=lambda obj, default=None: obj.annotations)
+@mock.patch('kcrw.plone_apple_news.adapter.get_settings', return_value={})
+class TestOptimisticUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.Mock(annotations={'kcrw.apple_news_info': {
+            'id': 'article-id', 'revision': 'stored', 'metadata': {}
+        }})
+        self.adapter = AppleNewsActions(self.context)
+        self.adapter.api = mock.Mock()
+        self.adapter.api.read_article.return_value = {
+            'data': {'id': 'article-id', 'revision': 'current'}
+        }
+        self.adapter.api.update_article.return_value = {
+            'data': {'id': 'article-id', 'revision': 'updated'}
+        }
+
+    def sent_revisions(self):
+        return [c[0][1]['data']['revision']
+                for c in self.adapter.api.update_article.call_args_list]
+
+    def test_stored_revision(self, settings, annotations):
+        self.adapter.send_update({'data': {}}, additional_data={
+            'data': {'isPreview': False}
+        })
+        self.assertFalse(self.adapter.api.read_article.called)
+        self.assertEqual(self.sent_revisions(), ['stored'])
+        args = self.adapter.api.update_article.call_args[0]
+        self.assertEqual(args[1]['data']['isPreview'], False)
+        self.assertEqual(self.adapter.data['revision'], 'updated')
+
+    def test_conflict_retried_once(self, settings, annotations):
+        self.adapter.api.update_article.side_effect = [
+            AppleNewsError('Conflict', code=409),
+            {'data': {'id': 'article-id', 'revision': 'updated'}},
+        ]
+        self.adapter.send_update({'data': {}})
+        self.assertEqual(self.adapter.api.read_article.call_count, 1)
+        self.assertEqual(self.sent_revisions(), ['stored', 'current'])
+        self.adapter.api.update_article.side_effect = AppleNewsError(
+            'Conflict', code=409
+        )
+        with self.assertRaises(AppleNewsError):
+            self.adapter.send_update({'data': {}})
+        self.assertEqual(self.adapter.api.update_article.call_count, 4)
+
+    @mock.patch.object(AppleNewsActions, 'article')
+    def test_forced_metadata(self, article, settings, annotations):
+        article.article_metadata.return_value = {'data': {}}
+        self.adapter.update_metadata({'data': {'isPreview': False}})
+        self.assertFalse(self.adapter.api.read_article.called)
+        self.adapter.update_metadata({'data': {'isPreview': False}},
+                                     force=True)
+        self.assertEqual(self.adapter.api.read_article.call_count, 1)
+        self.assertEqual(self.sent_revisions(), ['stored', 'current'])
+
+    @mock.patch('kcrw.plone_apple_news.adapter.queue_action')
+    def test_forced_metadata_queued(self, queue_action, settings,
+                                    annotations):
+        self.adapter.update_metadata({'data': {}}, defer=True, force=True)
+        queue_action.assert_called_once_with(
+            self.context, 'metadata', additional_data={'data': {}},
+            force=True
+        )
+        self.assertFalse(self.adapter.api.read_article.called)
+
+    def test_refresh(self, settings, annotations):
+        self.adapter.send_update({'data': {}}, refresh=True)
+        self.assertEqual(self.sent_revisions(), ['current'])
+        self.adapter.settings = mock.Mock(optimistic_updates=False)
+        self.adapter.send_update({'data': {}})
+        self.assertEqual(self.adapter.api.read_article.call_count, 2)
+
+
+@mock.patch('kcrw.plone_apple_news.adapter.queue_action')
+@mock.patch('kcrw.plone_apple_news.adapter.api_available',
+            return_value=False)
+@mock.patch('kcrw.plone_apple_news.adapter.IAnnotations',
+            side_effect=lambda obj, default=None: obj.annotations)
+class TestDefer(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.Mock(annotations={'kcrw.apple_news_info': {
+            'id': 'article-id', 'revision': 'stored', 'metadata': {}
+        }})
+
+    def adapter(self, queue_requests):
+        with mock.patch('kcrw.plone_apple_news.adapter.get_settings',
+                        return_value=mock.Mock(
+                            queue_requests=queue_requests)):
+            adapter = AppleNewsActions(self.context)
+        adapter.api = mock.Mock()
+        return adapter
+
+    def test_open_breaker_without_queue(self, annotations, available,
+                                        queue_action):
+        adapter = self.adapter(False)
+        for method in (adapter.update_article, adapter.update_metadata,
+                       adapter.delete_article):
+            with self.assertRaises(AppleNewsError) as cm:
+                method()
+            self.assertEqual(cm.exception.code, 503)
+        self.assertFalse(queue_action.called)
+        self.assertFalse(adapter.api.method_calls)
+        self.assertIn('kcrw.apple_news_info', self.context.annotations)
+
+    def test_open_breaker_with_queue(self, annotations, available,
+                                     queue_action):
+        adapter = self.adapter(True)
+        self.assertIsNone(adapter.update_article())
+        queue_action.assert_called_once_with(self.context, 'update',
+                                             force=False)
+
+
+@mock.patch('kcrw.plone_apple_news.outbox.IUUID',
+            new=lambda obj, default=None: 'uid')
+@mock.patch('kcrw.plone_apple_news.adapter.IAnnotations',
+            side_effect=lambda obj, default=None: obj.annotations)
+class TestQueuedCreate(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = {}
+        patcher = mock.patch('kcrw.plone_apple_news.outbox.get_queue',
+                             return_value=self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.context = mock.Mock(annotations={})
+        with mock.patch('kcrw.plone_apple_news.adapter.get_settings',
+                        return_value=mock.Mock(queue_requests=True)):
+            self.adapter = AppleNewsActions(self.context)
+        self.adapter.api = mock.Mock()
+
+    def queued(self):
+        entry = self.queue.get('uid')
+        return entry and entry['actions']
+
+    def test_changes_queued_after_create(self, annotations):
+        self.assertIsNone(self.adapter.create_article())
+        self.assertIsNone(self.adapter.update_article(defer=None))
+        self.assertIsNone(self.adapter.update_metadata({'data': {}}))
+        self.assertEqual(self.queued(), [
+            ('create', {}),
+            ('metadata', {'additional_data': {'data': {}}, 'force': False}),
+        ])
+        self.assertIsNone(self.adapter.delete_article())
+        self.assertEqual(self.queue, {})
+        self.assertFalse(self.adapter.api.method_calls)
+
+    def test_not_queued(self, annotations):
+        for method in (self.adapter.update_article,
+                       self.adapter.update_metadata,
+                       self.adapter.delete_article):
+            with self.assertRaises(AppleNewsError) as cm:
+                method()
+            self.assertEqual(cm.exception.code, 418)
+        self.adapter.create_article()
+        # Sent from the queue after the create failed
+        with self.assertRaises(AppleNewsError):
+            self.adapter.update_article(defer=False)
+
+
+class TestRemoveComponents(unittest.TestCase):
+
+    def test_remove_nested(self):
+        components = [
+            {'role': 'photo', 'URL': 'bundle://a.jpg'},
+            {'role': 'container', 'components': [
+                {'role': 'photo', 'URL': 'bundle://b.jpg'},
+                {'role': 'caption', 'text': 'Caption'},
+            ]},
+            {'role': 'photo', 'URL': 'bundle://c.jpg'},
+        ]
+        self.assertEqual(
+            remove_components(components,
+                              set(['bundle://a.jpg', 'bundle://b.jpg'])),
+            [{'role': 'container', 'components': [
+                {'role': 'caption', 'text': 'Caption'},
+            ]}, {'role': 'photo', 'URL': 'bundle://c.jpg'}]
+        )
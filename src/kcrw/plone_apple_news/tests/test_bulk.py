@@ -0,0 +1,125 @@
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.apple_news import AppleNewsError
+from kcrw.plone_apple_news.adapter import AppleNewsActions
+from kcrw.plone_apple_news.bulk import BulkUpdater
+from kcrw.plone_apple_news.bulk import FAILED
+from kcrw.plone_apple_news.bulk import QUEUED
+from kcrw.plone_apple_news.bulk import SENT
+from kcrw.plone_apple_news.bulk import UNCHANGED
+
+
+class DummyAdapter(object):
+    extract_metadata = AppleNewsActions.__dict__['extract_metadata']
+    apply_stored_metadata = staticmethod(
+        AppleNewsActions.apply_stored_metadata
+    )
+    settings = None
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.data = {'id': obj, 'revision': 'old'} if obj != 'new' else {}
+        self.stored = []
+        self.api = mock.Mock()
+        self.api.read_article.return_value = {
+            'data': {'id': obj, 'revision': 'current', 'isPreview': False}
+        }
+        if obj == 'conflict':
+            self.api.update_article.side_effect = AppleNewsError(
+                'Conflict', code=409
+            )
+        else:
+            self.api.update_article.return_value = {
+                'data': {'id': obj, 'revision': 'updated'}
+            }
+
+    def article_update_data(self):
+        return {'data': {}}, {'title': self.obj}, {}
+
+    def update_from_apple(self, data, digest=None):
+        self.stored.append(data['data']['revision'])
+        self.data = dict(self.data, digest=digest or self.data.get('digest'))
+
+
+class TestBulkUpdater(unittest.TestCase):
+
+    def setUp(self):
+        self.adapters = {}
+
+        def get_adapter(obj, alternate=None):
+            if obj == 'unsupported':
+                return alternate
+            return self.adapters.setdefault(obj, DummyAdapter(obj))
+
+        patcher = mock.patch(
+            'kcrw.plone_apple_news.bulk.IAppleNewsActions',
+            side_effect=get_adapter
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_in_order(self):
+        objects = ['a', 'conflict', 'unsupported', 'new', 'b', 'c']
+        results = BulkUpdater(concurrency=2)(objects)
+        self.assertEqual([r[0] for r in results],
+                         ['a', 'conflict', 'new', 'b', 'c'])
+        statuses = dict((r[0], r[1]) for r in results)
+        self.assertEqual(statuses, {'a': SENT, 'conflict': FAILED,
+                                    'new': FAILED, 'b': SENT, 'c': SENT})
+        errors = dict((r[0], r[2]) for r in results)
+        self.assertIsNone(errors['a'])
+        self.assertEqual(errors['conflict'].code, 409)
+        self.assertEqual(errors['new'].code, 418)
+
+    def test_queued(self):
+        adapter = self.adapters['a'] = DummyAdapter('a')
+        adapter.settings = mock.Mock(queue_requests=True)
+        adapter.update_article = mock.Mock(return_value=None)
+        results = BulkUpdater()(['a'])
+        self.assertEqual(results, [('a', QUEUED, None)])
+        adapter.update_article.assert_called_once_with(force=False)
+        self.assertFalse(adapter.api.update_article.called)
+
+    def test_forced_queued(self):
+        adapter = self.adapters['a'] = DummyAdapter('a')
+        adapter.settings = mock.Mock(queue_requests=True)
+        adapter.update_article = mock.Mock(return_value=None)
+        results = BulkUpdater(force=True)(['a'])
+        self.assertEqual(results, [('a', QUEUED, None)])
+        adapter.update_article.assert_called_once_with(force=True)
+
+    def test_revisions_stored(self):
+        BulkUpdater(concurrency=3)(['a', 'conflict'])
+        self.assertEqual(self.adapters['a'].stored, ['updated'])
+        # Updates use the stored revision
+        self.assertFalse(self.adapters['a'].api.read_article.called)
+        args = self.adapters['a'].api.update_article.call_args[0]
+        self.assertEqual(args[0], 'a')
+        self.assertEqual(args[1]['data'], {'revision': 'old'})
+        # Conflicts are retried once with the refreshed revision, failed
+        # updates keep it
+        conflict_api = self.adapters['conflict'].api
+        self.assertEqual(conflict_api.read_article.call_count, 1)
+        self.assertEqual(conflict_api.update_article.call_count, 2)
+        self.assertEqual(conflict_api.update_article.call_args[0][1]['data'],
+                         {'revision': 'current', 'isPreview': False})
+        self.assertEqual(self.adapters['conflict'].stored, ['current'])
+
+    def test_forced_updates_refresh(self):
+        BulkUpdater(force=True)(['a'])
+        self.assertEqual(self.adapters['a'].api.read_article.call_count, 1)
+        args = self.adapters['a'].api.update_article.call_args[0]
+        self.assertEqual(args[1]['data'],
+                         {'revision': 'current', 'isPreview': False})
+
+    def test_unchanged_skipped(self):
+        BulkUpdater()(['a'])
+        self.assertEqual(self.adapters['a'].api.update_article.call_count, 1)
+        results = BulkUpdater()(['a'])
+        self.assertEqual(results, [('a', UNCHANGED, None)])
+        self.assertEqual(self.adapters['a'].api.update_article.call_count, 1)
+        BulkUpdater(force=True)(['a'])
+        self.assertEqual(self.adapters['a'].api.update_article.call_count, 2)
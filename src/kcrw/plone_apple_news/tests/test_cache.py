@@ -0,0 +1,62 @@
+import unittest
+from kcrw.plone_apple_news.cache import DependentLRUCache
+from kcrw.plone_apple_news.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b', 'default'), 'default')
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_discards_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+    def test_invalidate_and_clear(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.invalidate('a')
+        cache.invalidate('missing')
+        self.assertNotIn('a', cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TestDependentLRUCache(unittest.TestCase):
+
+    def test_invalidate_dependency(self):
+        cache = DependentLRUCache(3)
+        cache.set('a', 1, ['uid1', 'uid2'])
+        cache.set('b', 2, ['uid2'])
+        cache.set('c', 3)
+        cache.invalidate_dependency('uid1')
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+        cache.invalidate_dependency('uid2')
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache._dependents, {})
+
+    def test_discards_dependencies(self):
+        cache = DependentLRUCache(1)
+        cache.set('a', 1, ['uid1'])
+        cache.set('b', 2, ['uid2'])
+        self.assertNotIn('a', cache)
+        self.assertEqual(list(cache._dependents), ['uid2'])
+        cache.set('b', 3, ['uid3'])
+        self.assertEqual(list(cache._dependents), ['uid3'])
+        cache.clear()
+        self.assertEqual((cache._dependents, cache._dependencies), ({}, {}))
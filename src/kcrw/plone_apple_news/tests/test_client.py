@@ -0,0 +1,240 @@
+import requests
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.apple_news import AppleNewsError
+from kcrw.plone_apple_news.client import CircuitBreaker
+from kcrw.plone_apple_news.client import clear_clients
+from kcrw.plone_apple_news.client import credentials_modified
+from kcrw.plone_apple_news.client import get_client
+from kcrw.plone_apple_news.client import PooledAPI
+from kcrw.plone_apple_news.client import TokenBucket
+
+
+class DummySettings(object):
+    api_key_id = u'key'
+    api_key_secret = u'c2VjcmV0'
+    channel_id = u'channel'
+
+
+class TestClientRegistry(unittest.TestCase):
+
+    def setUp(self):
+        clear_clients()
+        self.addCleanup(clear_clients)
+
+    def test_shared(self):
+        settings = DummySettings()
+        client = get_client(settings)
+        self.assertIsInstance(client, PooledAPI)
+        self.assertIs(get_client(settings), client)
+        settings.channel_id = u'other'
+        self.assertIsNot(get_client(settings), client)
+
+    def test_rebuilt_on_credential_change(self):
+        settings = DummySettings()
+        client = get_client(settings)
+        client.close = mock.Mock()
+        settings.api_key_secret = u'bmV3'
+        new_client = get_client(settings)
+        self.assertIsNot(new_client, client)
+        self.assertEqual(new_client.key_secret, u'bmV3')
+        new_client.close = mock.Mock()
+        event = mock.Mock()
+        event.record.__name__ = 'kcrw.apple_news.api_key_id'
+        credentials_modified(event)
+        self.assertIsNot(get_client(settings), new_client)
+        # Replaced clients may still be in use by other threads
+        self.assertFalse(client.close.called)
+        self.assertFalse(new_client.close.called)
+
+    def test_missing_credentials(self):
+        with self.assertRaises(AppleNewsError):
+            get_client({})
+
+
+class TestPooledAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.api = PooledAPI(u'key', u'c2VjcmV0', u'channel')
+        self.api.session = mock.Mock()
+        self.response = self.api.session.request.return_value
+        self.response.json.return_value = {'data': {'id': 'article'}}
+
+    def test_request(self):
+        self.assertEqual(self.api.read_article('article'),
+                         {'data': {'id': 'article'}})
+        method, url = self.api.session.request.call_args[0]
+        self.assertEqual(method, 'GET')
+        self.assertEqual(url, 'https://news-api.apple.com/articles/article')
+        headers = self.api.session.request.call_args[1]['headers']
+        self.assertTrue(headers['Authorization'].startswith('HHMAC; key=key'))
+
+    @mock.patch('kcrw.plone_apple_news.client.log_exc')
+    def test_error(self, log_exc):
+        self.response.raise_for_status.side_effect = (
+            requests.exceptions.HTTPError()
+        )
+        self.response.status_code = 409
+        self.response.headers = {}
+        self.response.json.return_value = {'errors': []}
+        with self.assertRaises(AppleNewsError) as raised:
+            self.api.read_article('article')
+        self.assertEqual(raised.exception.code, 409)
+        self.assertEqual(raised.exception.data, {'errors': []})
+
+
+@mock.patch('kcrw.plone_apple_news.client.time.sleep')
+@mock.patch('kcrw.plone_apple_news.client.log_exc')
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.api = PooledAPI(u'key', u'c2VjcmV0', u'channel',
+                             max_retries=2, backoff=1.0)
+        self.api.session = mock.Mock()
+        self.responses = []
+        self.api.session.request.side_effect = lambda *a, **kw: (
+            self.responses.pop(0)
+        )
+
+    def add_response(self, code, headers=None):
+        response = mock.Mock(status_code=code, headers=headers or {})
+        response.json.return_value = {'data': {'id': 'article'}}
+        if code >= 400:
+            response.raise_for_status.side_effect = (
+                requests.exceptions.HTTPError()
+            )
+        self.responses.append(response)
+
+    def test_retry_after(self, log_exc, sleep):
+        self.add_response(429, {'Retry-After': '7'})
+        self.add_response(200)
+        self.assertEqual(self.api.read_article('article'),
+                         {'data': {'id': 'article'}})
+        sleep.assert_called_once_with(7.0)
+
+    def test_backoff(self, log_exc, sleep):
+        self.add_response(503)
+        self.add_response(500)
+        self.add_response(503)
+        with self.assertRaises(AppleNewsError) as raised:
+            self.api.read_article('article')
+        self.assertEqual(raised.exception.code, 503)
+        self.assertEqual(self.api.session.request.call_count, 3)
+        delays = [c[0][0] for c in sleep.call_args_list]
+        self.assertTrue(0.5 <= delays[0] <= 1.0)
+        self.assertTrue(1.0 <= delays[1] <= 2.0)
+
+    def test_no_retry(self, log_exc, sleep):
+        # Client errors, long delays and server errors on article creation
+        self.add_response(409)
+        self.add_response(429, {'Retry-After': '3600'})
+        self.add_response(500)
+        for call in (lambda: self.api.read_article('article'),
+                     lambda: self.api.read_article('article'),
+                     lambda: self.api.create_article({'title': 'a'})):
+            with self.assertRaises(AppleNewsError):
+                call()
+        self.assertFalse(sleep.called)
+
+    @mock.patch('kcrw.plone_apple_news.client.time.time')
+    def test_deadline(self, now, log_exc, sleep):
+        # Slow failing requests use up the time allowed for retries
+        now.side_effect = [100, 130, 161]
+        self.add_response(503, {'Retry-After': '5'})
+        self.add_response(503, {'Retry-After': '5'})
+        self.add_response(200)
+        with self.assertRaises(AppleNewsError):
+            self.api.read_article('article')
+        self.assertEqual(self.api.session.request.call_count, 2)
+        sleep.assert_called_once_with(5.0)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    @mock.patch('kcrw.plone_apple_news.client.time.time', return_value=100)
+    def test_rate(self, now):
+        bucket = TokenBucket(2, burst=2)
+        self.assertEqual(bucket.delay(), 0)
+        self.assertEqual(bucket.delay(), 0)
+        self.assertEqual(bucket.delay(), 0.5)
+        self.assertEqual(bucket.delay(), 1.0)
+        now.return_value = 101
+        self.assertEqual(bucket.delay(), 0.5)
+
+
+@mock.patch('kcrw.plone_apple_news.client.time.time', return_value=100)
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_threshold(self, now):
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+        breaker.failure(AppleNewsError('Failed'))
+        self.assertTrue(breaker.allow())
+        breaker.failure(AppleNewsError('Failed again'))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.last_error, 'Failed again')
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_probe(self, now):
+        breaker = CircuitBreaker(threshold=1, cooldown=60)
+        breaker.failure()
+        now.return_value = 160
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # Only a single probe request
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        now.return_value = 220
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    @mock.patch('kcrw.plone_apple_news.client.log_exc')
+    def test_client_fails_fast(self, log_exc, now):
+        api = PooledAPI(u'key', u'c2VjcmV0', u'channel', threshold=2)
+        api.session = mock.Mock()
+        api.session.request.side_effect = requests.exceptions.Timeout()
+        for i in range(2):
+            with self.assertRaises(AppleNewsError):
+                api.read_article('article')
+        self.assertFalse(api.available)
+        with self.assertRaises(AppleNewsError) as raised:
+            api.read_article('article')
+        self.assertEqual(raised.exception.code, 503)
+        self.assertEqual(api.session.request.call_count, 2)
+
+    @mock.patch('kcrw.plone_apple_news.client.log_exc')
+    def test_client_errors_not_counted(self, log_exc, now):
+        api = PooledAPI(u'key', u'c2VjcmV0', u'channel', threshold=1)
+        api.session = mock.Mock()
+        response = api.session.request.return_value
+        response.raise_for_status.side_effect = (
+            requests.exceptions.HTTPError()
+        )
+        response.status_code = 404
+        response.headers = {}
+        with self.assertRaises(AppleNewsError):
+            api.read_article('article')
+        self.assertTrue(api.available)
+
+    def test_control_panel_status(self, now):
+        from kcrw.plone_apple_news.browser.controlpanel import (
+            AppleNewsSettingsControlPanel
+        )
+        api = PooledAPI(u'key', u'c2VjcmV0', u'channel', threshold=1)
+        api.breaker.failure(AppleNewsError('Failed'))
+        view = AppleNewsSettingsControlPanel(None, None)
+        settings = mock.Mock(queue_requests=False)
+        with mock.patch('kcrw.plone_apple_news.browser.controlpanel.'
+                        'get_client', return_value=api), \
+                mock.patch('kcrw.plone_apple_news.browser.controlpanel.'
+                           'get_settings', return_value=settings):
+            status = view.api_status()
+            self.assertTrue(status['degraded'])
+            self.assertFalse(status['queued'])
+            settings.queue_requests = True
+            self.assertTrue(view.api_status()['queued'])
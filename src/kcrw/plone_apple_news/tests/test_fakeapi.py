@@ -0,0 +1,80 @@
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.apple_news import AppleNewsError
+from kcrw.plone_apple_news.client import PooledAPI
+from kcrw.plone_apple_news.fakeapi import FakeAppleNewsServer
+
+
+@mock.patch('kcrw.plone_apple_news.client.log_exc')
+class TestFakeAppleNewsServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeAppleNewsServer().start()
+        self.addCleanup(self.server.stop)
+        self.api = PooledAPI(u'key', u'c2VjcmV0', u'channel', max_retries=2,
+                             backoff=0.01)
+        self.api.url_base = self.server.url
+        self.addCleanup(self.api.close)
+
+    def create(self):
+        return self.api.create_article(
+            {'title': u'Title', 'components': []},
+            {'data': {'isPreview': False}},
+            {'image.jpg': b'image data'}
+        )['data']
+
+    def test_create_read_update_delete(self, log_exc):
+        created = self.create()
+        self.assertEqual(created['title'], u'Title')
+        self.assertFalse(created['isPreview'])
+        stored = self.server.articles[created['id']]
+        self.assertEqual(stored['assets'], {'image.jpg': b'image data'})
+
+        read = self.api.read_article(created['id'])['data']
+        self.assertEqual(read['revision'], created['revision'])
+
+        updated = self.api.update_article(
+            created['id'], {'data': {'revision': created['revision'],
+                                     'isHidden': True}},
+            {'title': u'New Title'}
+        )['data']
+        self.assertNotEqual(updated['revision'], created['revision'])
+        self.assertEqual(updated['title'], u'New Title')
+        self.assertTrue(updated['isHidden'])
+
+        self.api.delete_article(created['id'])
+        with self.assertRaises(AppleNewsError) as raised:
+            self.api.read_article(created['id'])
+        self.assertEqual(raised.exception.code, 404)
+
+    def test_conflict(self, log_exc):
+        created = self.create()
+        self.server.touch(created['id'])
+        with self.assertRaises(AppleNewsError) as raised:
+            self.api.update_article(
+                created['id'], {'data': {'revision': created['revision']}}
+            )
+        self.assertEqual(raised.exception.code, 409)
+
+    def test_throttling_and_failures(self, log_exc):
+        self.server.throttle(retry_after=0)
+        self.server.inject(503)
+        self.api.read_channel()
+        self.assertEqual([r[2] for r in self.server.requests],
+                         [429, 503, 200])
+        self.server.inject(500, count=3)
+        with self.assertRaises(AppleNewsError) as raised:
+            self.api.read_channel()
+        self.assertEqual(raised.exception.code, 500)
+
+    def test_rate_limit(self, log_exc):
+        self.server.rate_limit = 2
+        self.api.max_retries = 0
+        self.api.read_channel()
+        self.api.read_channel()
+        with self.assertRaises(AppleNewsError) as raised:
+            self.api.read_channel()
+        self.assertEqual(raised.exception.code, 429)
@@ -5,6 +5,7 @@ except ImportError:
     import mock
 from lxml import etree
 from kcrw.plone_apple_news.html import HTMLProcessorRegistry
+from kcrw.plone_apple_news.html import apply_filters
 from kcrw.plone_apple_news.html import class_to_style
 from kcrw.plone_apple_news.html import el_list_to_html
 from kcrw.plone_apple_news.html import fix_hrefs
@@ -14,6 +15,13 @@ from kcrw.plone_apple_news.html import find_videos
 from kcrw.plone_apple_news.html import split_videos
 from kcrw.plone_apple_news.html import strip_outer
 from kcrw.plone_apple_news.html import process_html
+from kcrw.plone_apple_news.html import UIDResolver
+from kcrw.plone_apple_news.html import find_uids
+from kcrw.plone_apple_news.html import invalidate_url
+from kcrw.plone_apple_news.html import obj_url
+from kcrw.plone_apple_news.html import is_empty
+from kcrw.plone_apple_news.cache import render_cache
+from kcrw.plone_apple_news.cache import url_cache
 
 
 class TestElementListToHTML(unittest.TestCase):
@@ -42,6 +50,21 @@ class TestElementListToHTML(unittest.TestCase):
             '<p data-anf-textstyle="class-style-p2">P2 text</p> Some tail\n<p/></div>'
         )
 
+    def test_cleans_parsed_elements_in_place(self):
+        from lxml import html
+        tree = html.fragment_fromstring(
+            '<p id="id1" class="class1" onclick="x()">P1 <b>bold</b></p>'
+            '<iframe src="x"></iframe> After iframe<h2>Heading</h2>'
+            '<script>x()</script><p>P2\r\n</p>', create_parent=True
+        )
+        output = el_list_to_html(list(tree), 'section-1')
+        self.assertEquals(
+            output,
+            '<div id="section-1"><p id="id1">P1 <b>bold</b></p> After iframe'
+            'Heading<p>P2\n</p></div>'
+        )
+        self.assertEqual(len(tree), 0)
+
 
 class TestHTMLRegistry(unittest.TestCase):
     """Test that kcrw.plone_apple_news is properly installed."""
@@ -125,11 +148,147 @@ class TestHTMLRegistry(unittest.TestCase):
         )
 
 
+class TestSplitterDispatch(unittest.TestCase):
+
+    def setUp(self):
+        from lxml import html
+        self.registry = HTMLProcessorRegistry()
+        self.el = html.fragment_fromstring(
+            '<div><img src="a"><p><img src="b"><b>bold</b></p>'
+            '<iframe src="c"></iframe></div>'
+        )
+
+    def test_tags(self):
+        registry = self.registry
+        registry.register_splitter('images', None, 'split_images',
+                                   tags=('img',))
+        registry.register_splitter('frames', lambda el: el.get('src') == 'c',
+                                   'split_frames', tags=['iframe', 'img'])
+        matches = list(registry.compile_splitters().match(self.el))
+        self.assertEqual([m[:2] for m in matches],
+                         [('images', 'split_images'),
+                          ('frames', 'split_frames')])
+        self.assertEqual([e.get('src') for e in matches[0][2]], ['a', 'b'])
+        self.assertEqual([e.tag for e in matches[1][2]], ['iframe'])
+
+    def test_registry_entries(self):
+        # Tags are kept apart so that registry entries stay 3-tuples
+        registry = self.registry
+        registry.register_splitter('images', None, 'split_images',
+                                   tags=('img',))
+        registry.register_splitter('bold', './/b', 'split_bold')
+        self.assertEqual(registry.splitter_registry,
+                         [('images', None, 'split_images'),
+                          ('bold', './/b', 'split_bold')])
+        self.assertEqual(registry.splitter_tags,
+                         {'images': frozenset(['img'])})
+        registry.unregister_splitter('images')
+        self.assertEqual(registry.splitter_tags, {})
+
+    def test_matchers(self):
+        registry = self.registry
+        registry.register_splitter('bold', './/b', 'split_bold')
+        registry.register_splitter('none', lambda el: [], 'split_none')
+        registry.register_splitter('iframes', find_videos, 'split_videos')
+        matches = list(registry.compile_splitters().match(self.el))
+        self.assertEqual([m[0] for m in matches], ['bold'])
+        self.assertEqual(matches[0][2][0].text, 'bold')
+
+    def test_skips_removed_elements(self):
+        registry = self.registry
+        registry.register_splitter('paragraphs', None, 'split_paragraphs',
+                                   tags=('p',))
+        registry.register_splitter('images', None, 'split_images',
+                                   tags=('img',))
+        matches = registry.compile_splitters().match(self.el)
+        name, splitter, found = next(matches)
+        found[0].getparent().remove(found[0])
+        name, splitter, found = next(matches)
+        self.assertEqual([e.get('src') for e in found], ['a'])
+
+    def test_is_empty(self):
+        from lxml import html
+        self.assertTrue(is_empty(html.fragment_fromstring(
+            '<p> <img src="a"> </p>'
+        )))
+        self.assertFalse(is_empty(html.fragment_fromstring(
+            '<p> <span> <b>text</b> </span></p>'
+        )))
+        self.assertFalse(is_empty(html.fragment_fromstring(
+            '<p><span><b></b></span> tail</p>'
+        )))
+
+
+class TestVisitorFilters(unittest.TestCase):
+
+    def setUp(self):
+        from lxml import html
+        self.registry = HTMLProcessorRegistry()
+        self.tree = html.fragment_fromstring(
+            '<div><p class="a">text <a href="x">link</a></p><a>anchor</a>'
+            '</div>'
+        )
+        self.visited = []
+
+    def visitor(self, label):
+        def visitor(tree, context):
+            self.visited.append((label, tree.tag, context))
+
+            def visit(el):
+                self.visited.append((label, el.tag))
+            return visit
+        return visitor
+
+    def test_single_walk(self):
+        registry = self.registry
+        registry.register_visitor('classes', self.visitor('classes'),
+                                  predicate=lambda el: el.get('class'))
+        registry.register_visitor('links', self.visitor('links'),
+                                  tags=('a',))
+        groups = list(registry.filter_groups())
+        self.assertEqual([[f[0] for f in g] for g in groups],
+                         [['classes', 'links']])
+        apply_filters(self.tree, 'context', registry)
+        self.assertEqual(self.visited, [
+            ('classes', 'div', 'context'), ('links', 'div', 'context'),
+            ('classes', 'p'), ('links', 'a'), ('links', 'a'),
+        ])
+
+    def test_legacy_filters_keep_order(self):
+        registry = self.registry
+        registry.register_visitor('first', self.visitor('first'),
+                                  tags=('p',))
+        registry.register_filter(
+            'legacy', lambda tree, context: self.visited.append('legacy')
+        )
+        registry.register_visitor('second', self.visitor('second'),
+                                  tags=('p',))
+        registry.register_visitor('third', self.visitor('third'),
+                                  tags=('b',), before='second')
+        groups = list(registry.filter_groups())
+        self.assertEqual([[f[0] for f in g] for g in groups],
+                         [['first'], ['legacy'], ['third', 'second']])
+        apply_filters(self.tree, None, registry)
+        self.assertEqual([v[:2] for v in self.visited if v != 'legacy'], [
+            ('first', 'div'), ('first', 'p'), ('third', 'div'),
+            ('second', 'div'), ('second', 'p'),
+        ])
+        self.assertEqual(self.visited.index('legacy'), 2)
+
+    def test_filters_apply_visitors_alone(self):
+        self.registry.register_visitor('links', self.visitor('links'),
+                                       tags=('a',))
+        for filter in self.registry.filters():
+            filter(self.tree, None)
+        self.assertEqual(self.visited[1:], [('links', 'a'), ('links', 'a')])
+
+
 @mock.patch(
     'plone.outputfilters.filters.resolveuid_and_caption.ResolveUIDAndCaptionFilter.resolve_link',  # noqa: E501
     side_effect=lambda href: ('obj-' + href, '/updated', '?nonsense')
 )
-@mock.patch('kcrw.plone_apple_news.html.obj_url', side_effect=lambda obj: obj)
+@mock.patch('kcrw.plone_apple_news.html.obj_url',
+            side_effect=lambda obj, settings=None, portal_url=None: obj)
 class TestHTMLFilters(unittest.TestCase):
     """Test that kcrw.plone_apple_news is properly installed."""
 
@@ -163,6 +322,82 @@ class TestHTMLFilters(unittest.TestCase):
         self.assertEquals(obj_url.call_count, 2)
 
 
+@mock.patch(
+    'plone.outputfilters.filters.resolveuid_and_caption.ResolveUIDAndCaptionFilter.resolve_link',  # noqa: E501
+    side_effect=lambda href: ('looked-up', '', '')
+)
+class TestUIDResolver(unittest.TestCase):
+
+    def test_find_uids(self, resolver):
+        tree = etree.fromstring(
+            '<div><a href="resolveuid/uid1">a</a>'
+            '<a href="../resolveUid/uid2/@@images/image?x=1#top">b</a>'
+            '<img src="resolveuid/uid3/@@images/image/large" />'
+            '<a href="http://example.com/resolveuid/uid4">c</a>'
+            '<a>d</a><p src="resolveuid/uid5">e</p></div>'
+        )
+        self.assertEquals(find_uids(tree), set(['uid1', 'uid2', 'uid3']))
+
+    def test_resolve_known_uids(self, resolver):
+        target = object()
+        uid_resolver = UIDResolver(None, {'uid1': target})
+        self.assertEquals(
+            uid_resolver.resolve_link('resolveuid/uid1/@@images/image#top'),
+            (target, '@@images/image', '#top')
+        )
+        self.assertEquals(resolver.call_count, 0)
+
+    def test_resolve_unknown_links(self, resolver):
+        uid_resolver = UIDResolver(None, {'uid1': object()})
+        self.assertEquals(uid_resolver.resolve_link('resolveuid/uid2'),
+                          ('looked-up', '', ''))
+        self.assertEquals(uid_resolver.resolve_link('some/path'),
+                          ('looked-up', '', ''))
+        self.assertEquals(resolver.call_count, 2)
+
+
+@mock.patch('kcrw.plone_apple_news.html.IUUID',
+            side_effect=lambda obj, default=None: getattr(obj, 'uid', None))
+class TestObjectURL(unittest.TestCase):
+
+    def setUp(self):
+        from kcrw.plone_apple_news.cache import url_cache
+        url_cache.invalidate('uid1')
+        self.obj = mock.Mock(uid='uid1')
+        self.obj.absolute_url.side_effect = (
+            lambda relative=0: 'path/obj' if relative else
+            'http://site/path/obj'
+        )
+        self.settings = mock.Mock(canonical_url=None)
+
+    def test_cached(self, uuid):
+        self.assertEqual(obj_url(self.obj, self.settings, 'http://site'),
+                         'http://site/path/obj')
+        self.assertEqual(obj_url(self.obj, self.settings, 'http://site'),
+                         'http://site/path/obj')
+        self.assertEqual(self.obj.absolute_url.call_count, 1)
+
+    def test_canonical_url_change(self, uuid):
+        obj_url(self.obj, self.settings, 'http://site')
+        self.settings.canonical_url = 'https://www.example.com/'
+        self.assertEqual(obj_url(self.obj, self.settings, 'http://site'),
+                         'https://www.example.com/path/obj')
+        self.assertEqual(self.obj.absolute_url.call_count, 2)
+
+    def test_invalidate(self, uuid):
+        obj_url(self.obj, self.settings, 'http://site')
+        invalidate_url(self.obj, None)
+        obj_url(self.obj, self.settings, 'http://site')
+        self.assertEqual(self.obj.absolute_url.call_count, 2)
+
+    def test_no_uid(self, uuid):
+        obj = mock.Mock(uid=None)
+        obj.absolute_url.return_value = 'http://site/other'
+        self.assertEqual(obj_url(obj, self.settings), 'http://site/other')
+        self.assertEqual(obj_url(obj, self.settings), 'http://site/other')
+        self.assertEqual(obj.absolute_url.call_count, 2)
+
+
 @mock.patch(
     'plone.outputfilters.filters.resolveuid_and_caption.ResolveUIDAndCaptionFilter.resolve_image',  # noqa: E501
     side_effect=lambda src: (None, None, 'replaced-src-' + src, 'Description')
@@ -506,3 +741,144 @@ class TestProcessHTML(unittest.TestCase):
              'after-el1']
         )
         processor_registry.unregister_splitter('special_split')
+
+
+class FakeContent(object):
+
+    def __init__(self, uid, path):
+        self.uid = uid
+        self.path = path
+
+    def getPhysicalPath(self):
+        return tuple(self.path.split('/'))
+
+    def absolute_url(self, relative=False):
+        return ('' if relative else 'http://site') + self.path
+
+
+@mock.patch('kcrw.plone_apple_news.html.IUUID',
+            new=lambda obj, default=None: getattr(obj, 'uid', default))
+@mock.patch('kcrw.plone_apple_news.html.api.portal.get',
+            return_value=FakeContent(None, ''))
+class TestRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.context = FakeContent('context', '/news/item')
+        self.target = FakeContent('target', '/target')
+        self.image = FakeContent('image', '/image')
+        self.existing = [self.target, self.image]
+        render_cache.clear()
+        self.addCleanup(render_cache.clear)
+        self.addCleanup(url_cache.clear)
+        patcher = mock.patch(
+            'kcrw.plone_apple_news.html.resolve_uids',
+            side_effect=lambda uids, context: dict(
+                (o.uid, o) for o in self.existing if o.uid in uids
+            )
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch(
+            'kcrw.plone_apple_news.html.UIDResolver.resolve_image',
+            side_effect=lambda src: ('scale', self.image,
+                                     'http://site/image/large', 'Image')
+        )
+        self.resolve_image = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.html = (
+            '<p><a href="resolveuid/target">link</a></p>'
+            '<p><img src="resolveuid/image/@@images/image/large" />text</p>'
+        )
+
+    def process(self):
+        from kcrw.plone_apple_news import html
+        with mock.patch.object(html, 'process_tree',
+                               wraps=html.process_tree) as process_tree:
+            parts = process_html(self.html, self.context)
+        return parts, process_tree.call_count
+
+    def test_cached(self, get_portal):
+        parts, processed = self.process()
+        self.assertEqual(processed, 1)
+        self.assertIn('href="http://site/target"', parts[0])
+        self.assertEqual(parts[1]['contents'][0]['fullimage'], self.image)
+        self.assertNotIn('source', parts[1]['contents'][0])
+        cached, processed = self.process()
+        self.assertEqual(processed, 0)
+        self.assertEqual(cached, parts)
+        self.assertIsNot(cached[1], parts[1])
+        # Images are resolved again from their source
+        self.assertEqual(self.resolve_image.call_args_list[-1],
+                         mock.call('resolveuid/image/@@images/image/large'))
+
+    def test_key(self, get_portal):
+        self.process()
+        self.context.path = '/news/moved'
+        self.assertEqual(self.process()[1], 1)
+        self.assertEqual(
+            process_html(self.html, self.context, 'footer')[0][:16],
+            '<div id="footer-'
+        )
+        self.assertEqual(self.process()[1], 0)
+
+    def test_invalidated_by_dependencies(self, get_portal):
+        self.process()
+        invalidate_url(FakeContent('other', '/other'), None)
+        self.assertEqual(self.process()[1], 0)
+        self.target.path = '/moved'
+        invalidate_url(self.target, None)
+        parts, processed = self.process()
+        self.assertEqual(processed, 1)
+        self.assertIn('href="http://site/moved"', parts[0])
+        invalidate_url(self.image, None)
+        self.assertEqual(self.process()[1], 1)
+
+    @mock.patch('plone.outputfilters.filters.resolveuid_and_caption.'
+                'uuidToObject', return_value=None)
+    def test_invalidated_by_added_links(self, uuid_to_object, get_portal):
+        self.html += '<p><a href="resolveuid/missing">missing</a></p>'
+        self.assertEqual(self.process()[1], 1)
+        self.assertEqual(self.process()[1], 0)
+        missing = FakeContent('missing', '/missing')
+        invalidate_url(missing, None)
+        self.assertEqual(self.process()[1], 1)
+        # Content added in another process is found when the cached HTML is
+        # reused
+        self.existing.append(missing)
+        parts, processed = self.process()
+        self.assertEqual(processed, 1)
+        self.assertIn('href="http://site/missing"', parts[-1])
+        self.assertEqual(self.process()[1], 0)
+
+    def test_uncached_without_content(self, get_portal):
+        self.context = None
+        self.assertEqual(self.process()[1], 1)
+        self.assertEqual(self.process()[1], 1)
+        self.assertEqual(len(render_cache), 0)
+
+    def test_stored(self, get_portal):
+        annotations = {}
+        settings = mock.Mock(canonical_url=None, persist_rendered_html=True)
+        with mock.patch('kcrw.plone_apple_news.html.get_settings',
+                        return_value=settings), \
+                mock.patch('kcrw.plone_apple_news.html.IAnnotations',
+                           return_value=annotations):
+            parts = self.process()[0]
+            stored = annotations['kcrw.apple_news.rendered']['body']
+            self.assertEqual(stored['urls'], {
+                'target': 'http://site/target', 'image': 'http://site/image'
+            })
+            render_cache.clear()
+            self.assertEqual(self.process(), (parts, 0))
+            # Found in memory without checking the stored URLs
+            self.target.path = '/moved'
+            self.assertEqual(self.process(), (parts, 0))
+            render_cache.clear()
+            url_cache.clear()
+            parts, processed = self.process()
+            self.assertEqual(processed, 1)
+            self.assertIn('href="http://site/moved"', parts[0])
+            self.assertEqual(
+                annotations['kcrw.apple_news.rendered']['body']['urls'],
+                {'target': 'http://site/moved', 'image': 'http://site/image'}
+            )
@@ -0,0 +1,82 @@
+import PIL.Image
+import six
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.plone_apple_news.images import scale_image
+from kcrw.plone_apple_news.images import scale_images
+from kcrw.plone_apple_news.images import thumbnail_size
+
+
+def make_image(size, format_='JPEG', mode='RGB'):
+    data = six.BytesIO()
+    PIL.Image.new(mode, size).save(data, format_)
+    return data.getvalue()
+
+
+def image_info(data):
+    image = PIL.Image.open(six.BytesIO(data))
+    return image.format, image.size
+
+
+class TestScaleImage(unittest.TestCase):
+
+    def test_thumbnail_size(self):
+        self.assertEqual(thumbnail_size((2000, 1000), (800, 800)), (800, 400))
+        self.assertEqual(thumbnail_size((2000, 1000), (400, 100)), (200, 100))
+        # No upscaling
+        self.assertEqual(thumbnail_size((200, 100), (800, 800)), (200, 100))
+
+    def test_multiple_sizes(self):
+        data = make_image((2000, 1500))
+        result = scale_image(data, {
+            'large': (768, 768), 'preview': (400, 400), 'huge': (4000, 4000)
+        })
+        self.assertEqual(image_info(result['large']), ('JPEG', (768, 576)))
+        self.assertEqual(image_info(result['preview']), ('JPEG', (400, 300)))
+        self.assertEqual(image_info(result['huge']), ('JPEG', (2000, 1500)))
+
+    def test_decodes_once(self):
+        data = make_image((1000, 1000))
+        with mock.patch('PIL.Image.open', side_effect=PIL.Image.open) as op:
+            scale_image(data, {'a': (500, 500), 'b': (200, 200)})
+        self.assertEqual(op.call_count, 1)
+
+    def test_png_and_palette(self):
+        data = make_image((600, 300), 'PNG', 'P')
+        result = scale_image(data, {'thumb': (128, 128)})
+        self.assertEqual(image_info(result['thumb']), ('PNG', (128, 64)))
+        data = make_image((600, 300), 'GIF', 'P')
+        result = scale_image(data, {'thumb': (128, 128)})
+        self.assertEqual(image_info(result['thumb']), ('GIF', (128, 64)))
+
+
+class TestScaleImages(unittest.TestCase):
+
+    def test_parallel_results_in_order(self):
+        jobs = [(make_image((100 * i, 100 * i)), {'scale': (50, 50)})
+                for i in range(1, 6)]
+        for mode in (u'serial', u'threads'):
+            results = scale_images(jobs, mode, 3)
+            self.assertEqual(
+                [image_info(r['scale'])[1] for r in results],
+                [(50, 50)] * 5
+            )
+
+    def test_pool_replaced(self):
+        from kcrw.plone_apple_news import images
+        self.addCleanup(images.close_pool)
+        pool = images.get_pool(2)
+        self.assertIs(images.get_pool(2), pool)
+        replaced = images.get_pool(3)
+        self.assertIsNot(replaced, pool)
+        # The previous pool is closed
+        with self.assertRaises((AssertionError, ValueError)):
+            pool.map_async(len, [])
+        pool.join()
+        jobs = [(make_image((100, 100)), {'scale': (50, 50)})] * 2
+        with mock.patch.object(images, 'get_pool', return_value=pool):
+            results = scale_images(jobs, u'threads', 2)
+        self.assertEqual(len(results), 2)
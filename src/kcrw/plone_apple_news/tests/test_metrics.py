@@ -0,0 +1,123 @@
+import requests
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.apple_news import AppleNewsError
+from kcrw.plone_apple_news import metrics
+from kcrw.plone_apple_news.client import PooledAPI
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        counter = metrics.Counter('test_total', 'Test counter',
+                                  register=False)
+        counter.inc(action='created')
+        counter.inc(2, action='created')
+        counter.inc(action='deleted')
+        self.assertEqual(counter.value(action='created'), 3)
+        self.assertEqual(counter.render(), [
+            u'# HELP test_total Test counter',
+            u'# TYPE test_total counter',
+            u'test_total{action="created"} 3',
+            u'test_total{action="deleted"} 1',
+        ])
+
+    def test_gauge(self):
+        gauge = metrics.Gauge('test_gauge', 'Test gauge', register=False)
+        gauge.set(0.5)
+        self.assertEqual(gauge.render()[-1], u'test_gauge 0.5')
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'Test histogram',
+                                      (0.1, 1), register=False)
+        histogram.observe(0.05, method='read')
+        histogram.observe(0.5, method='read')
+        histogram.observe(5, method='read')
+        self.assertEqual(histogram.render()[2:], [
+            u'test_seconds_bucket{method="read",le="0.1"} 1',
+            u'test_seconds_bucket{method="read",le="1"} 2',
+            u'test_seconds_bucket{method="read",le="+Inf"} 3',
+            u'test_seconds_sum{method="read"} 5.55',
+            u'test_seconds_count{method="read"} 3',
+        ])
+
+    def test_histogram_time(self):
+        histogram = metrics.Histogram('test_seconds', 'Test histogram',
+                                      (0.1, 1), register=False)
+
+        @histogram.time(stage='test')
+        def func():
+            return 1
+        self.assertEqual(func(), 1)
+        self.assertEqual(histogram.samples()[-1],
+                         ('test_seconds_count', (('stage', 'test'),), 1))
+
+    def test_label_escaping(self):
+        self.assertEqual(metrics.format_labels([('a', 'x"y\\z\n')]),
+                         u'{a="x\\"y\\\\z\\n"}')
+
+    def test_operation(self):
+        self.assertEqual(metrics.operation('POST', 'channels/c/articles'),
+                         'create_article')
+        self.assertEqual(metrics.operation('GET', 'channels/c'),
+                         'read_channel')
+        self.assertEqual(metrics.operation('POST', 'articles/a'),
+                         'update_article')
+        self.assertEqual(metrics.operation('GET', 'articles/a'),
+                         'read_article')
+        self.assertEqual(metrics.operation('DELETE', 'articles/a'),
+                         'delete_article')
+
+    def test_error_label(self):
+        self.assertEqual(
+            [metrics.error_label(c) for c in (None, 404, 409, 429, 502, 400)],
+            ['connection', '404', '409', '429', '5xx', 'other']
+        )
+
+
+class TestAPIMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.api = PooledAPI(u'key', u'c2VjcmV0', u'channel')
+        self.api.session = mock.Mock()
+        self.response = self.api.session.request.return_value
+        self.response.json.return_value = {'data': {'id': 'article'}}
+
+    def test_success(self):
+        self.api.create_article({'title': u'Title'})
+        self.api.delete_article('article')
+        self.assertEqual(metrics.articles.value(action='created'), 1)
+        self.assertEqual(metrics.articles.value(action='deleted'), 1)
+        text = metrics.render()
+        self.assertIn(
+            u'kcrw_apple_news_api_request_duration_seconds_count'
+            u'{method="create_article"} 1', text
+        )
+
+    @mock.patch('kcrw.plone_apple_news.client.log_exc')
+    def test_errors(self, log_exc):
+        self.response.raise_for_status.side_effect = (
+            requests.exceptions.HTTPError()
+        )
+        self.response.status_code = 409
+        self.response.headers = {}
+        with self.assertRaises(AppleNewsError):
+            self.api.update_article('article', {'data': {'revision': 'r'}})
+        self.assertEqual(metrics.api_errors.value(code='409'), 1)
+        self.assertEqual(metrics.articles.value(action='updated'), 0)
+        self.assertIn(
+            u'kcrw_apple_news_api_request_duration_seconds_count'
+            u'{method="update_article"} 1', metrics.render()
+        )
+
+    def test_rejected(self):
+        self.api.breaker = mock.Mock()
+        self.api.breaker.allow.return_value = False
+        with self.assertRaises(AppleNewsError):
+            self.api.read_article('article')
+        self.assertEqual(metrics.api_rejected.value(), 1)
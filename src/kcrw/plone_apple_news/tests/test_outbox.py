@@ -0,0 +1,79 @@
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.plone_apple_news.outbox import merge_actions
+
+
+class TestMergeActions(unittest.TestCase):
+
+    def test_add_to_empty(self):
+        self.assertEqual(merge_actions([], 'create', {}), [('create', {})])
+
+    def test_create_absorbs_update(self):
+        pending = [('create', {})]
+        self.assertEqual(merge_actions(pending, 'update', {}), pending)
+
+    def test_duplicate_update_dropped(self):
+        pending = [('update', {})]
+        self.assertEqual(merge_actions(pending, 'update', {}), pending)
+
+    def test_metadata_follows_update(self):
+        pending = [('update', {})]
+        meta = {'additional_data': {'data': {'isPreview': False}}}
+        self.assertEqual(
+            merge_actions(pending, 'metadata', meta),
+            [('update', {}), ('metadata', meta)]
+        )
+
+    def test_metadata_merged(self):
+        pending = [('metadata', {'additional_data': {
+            'data': {'isPreview': False, 'isHidden': True}
+        }})]
+        merged = merge_actions(pending, 'metadata', {'additional_data': {
+            'data': {'isHidden': False}
+        }})
+        self.assertEqual(merged, [('metadata', {'additional_data': {
+            'data': {'isPreview': False, 'isHidden': False}
+        }})])
+
+    def test_forced_metadata_merged(self):
+        pending = [('metadata', {'additional_data': {}, 'force': False})]
+        merged = merge_actions(pending, 'metadata', {
+            'additional_data': {'data': {'isHidden': False}}, 'force': True
+        })
+        self.assertEqual(merged, [('metadata', {
+            'additional_data': {'data': {'isHidden': False}}, 'force': True
+        })])
+        self.assertEqual(merge_actions(merged, 'metadata', {
+            'additional_data': {}, 'force': False
+        }), merged)
+
+    def test_delete_replaces_pending(self):
+        pending = [('update', {}), ('metadata', {})]
+        self.assertEqual(
+            merge_actions(pending, 'delete', {'article_id': 'abc'}),
+            [('delete', {'article_id': 'abc'})]
+        )
+
+    def test_delete_cancels_unsent_create(self):
+        pending = [('create', {}), ('metadata', {})]
+        self.assertEqual(
+            merge_actions(pending, 'delete', {'article_id': None}), []
+        )
+
+
+class TestProcessQueueView(unittest.TestCase):
+
+    def limit(self, value):
+        from kcrw.plone_apple_news.browser.utils import ProcessAppleNewsQueue
+        request = mock.Mock(form={} if value is None else {'limit': value})
+        return ProcessAppleNewsQueue(None, request).limit()
+
+    def test_limit(self):
+        self.assertEqual(self.limit('5'), 5)
+        self.assertEqual(self.limit('-3'), 1)
+        self.assertIsNone(self.limit('abc'))
+        self.assertIsNone(self.limit(''))
+        self.assertIsNone(self.limit(None))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""End to end publishing tests against the fake Apple News API."""
+from kcrw.apple_news import AppleNewsError
+from kcrw.plone_apple_news import metrics
+from kcrw.plone_apple_news.browser.utils import AppleNewsMetrics
+from kcrw.plone_apple_news.interfaces import IAppleNewsActions
+from kcrw.plone_apple_news.testing import KCRW_PLONE_APPLE_NEWS_API_FUNCTIONAL_TESTING  # noqa: E501
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+
+import transaction
+import unittest
+
+
+class TestPublishing(unittest.TestCase):
+
+    layer = KCRW_PLONE_APPLE_NEWS_API_FUNCTIONAL_TESTING
+
+    def setUp(self):
+        self.portal = self.layer['portal']
+        self.server = self.layer['apple_news_api']
+        setRoles(self.portal, TEST_USER_ID, ['Manager'])
+        self.doc = api.content.create(
+            container=self.portal, type='Document', id='doc',
+            title=u'A Document', description=u'Summary'
+        )
+        transaction.commit()
+        self.adapter = IAppleNewsActions(self.doc)
+
+    def test_create_update_delete(self):
+        self.adapter.create_article()
+        article_id = self.adapter.data['id']
+        stored = self.server.articles[article_id]
+        self.assertEqual(stored['document']['title'], u'A Document')
+        self.assertEqual(stored['revision'], self.adapter.data['revision'])
+
+        self.doc.setTitle(u'New Title')
+        self.adapter.update_article()
+        self.assertEqual(stored['document']['title'], u'New Title')
+        self.assertEqual(stored['revision'], self.adapter.data['revision'])
+        # Unchanged articles aren't sent again
+        self.assertIs(self.adapter.update_article(), False)
+
+        self.adapter.delete_article()
+        self.assertNotIn(article_id, self.server.articles)
+        self.assertEqual(self.adapter.data, {})
+
+    def test_update_conflict(self):
+        self.adapter.create_article()
+        article_id = self.adapter.data['id']
+        self.server.touch(article_id)
+        self.adapter.update_metadata({'data': {'isPreview': False}})
+        self.assertFalse(self.server.articles[article_id]['metadata'][
+            'isPreview'
+        ])
+        methods = [r[0] for r in self.server.requests]
+        self.assertEqual(methods, ['POST', 'POST', 'GET', 'POST'])
+
+    def test_throttled(self):
+        self.server.throttle(count=2, retry_after=0)
+        self.adapter.create_article()
+        self.assertIn(self.adapter.data['id'], self.server.articles)
+
+    def test_unavailable(self):
+        self.server.inject(500, count=10)
+        with self.assertRaises(AppleNewsError):
+            self.adapter.create_article()
+        self.assertEqual(self.adapter.data, {})
+
+    def test_metrics(self):
+        metrics.reset()
+        self.server.inject(409)
+        with self.assertRaises(AppleNewsError):
+            self.adapter.create_article()
+        self.adapter.create_article()
+        text = AppleNewsMetrics(self.portal, self.layer['request'])()
+        self.assertIn(u'kcrw_apple_news_articles_total{action="created"} 1',
+                      text)
+        self.assertIn(u'kcrw_apple_news_api_errors_total{code="409"} 1',
+                      text)
+        self.assertIn(u'kcrw_apple_news_queue_length 0', text)
+        self.assertTrue(self.layer['request'].response.getHeader(
+            'Content-Type'
+        ).startswith('text/plain'))
@@ -0,0 +1,120 @@
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.plone_apple_news import timing
+
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        timing.reset()
+        timing.enable()
+
+    def tearDown(self):
+        timing.disable()
+        timing.reset()
+
+    def test_disabled(self):
+        timing.disable()
+        self.assertIs(timing.timer('stage'), timing.NULL_TIMER)
+        with timing.timer('stage'):
+            pass
+
+        @timing.timed('decorated')
+        def func(value):
+            return value
+        self.assertEqual(func(1), 1)
+        self.assertEqual(timing.stats(), {})
+
+    def test_timer(self):
+        with mock.patch.object(timing, 'clock', side_effect=[1.0, 1.5]):
+            with timing.timer('api', 'create_article'):
+                pass
+        stats = timing.stats()
+        self.assertEqual(list(stats), ['api:create_article'])
+        self.assertEqual(stats['api:create_article']['count'], 1)
+        self.assertEqual(stats['api:create_article']['max'], 0.5)
+
+    def test_timer_records_errors(self):
+        with self.assertRaises(ValueError):
+            with timing.timer('stage'):
+                raise ValueError()
+        self.assertEqual(timing.stats()['stage']['count'], 1)
+
+    def test_timed(self):
+        @timing.timed('decorated')
+        def func(value):
+            return value
+        self.assertEqual(func(1), 1)
+        self.assertEqual(func(2), 2)
+        self.assertEqual(timing.stats()['decorated']['count'], 2)
+
+    def test_aggregates(self):
+        for i in range(1, 101):
+            timing.record('stage', i / 1000.0)
+        stats = timing.stats()['stage']
+        self.assertEqual(stats['count'], 100)
+        self.assertAlmostEqual(stats['total'], 5.05)
+        self.assertEqual(stats['max'], 0.1)
+        self.assertEqual(stats['p50'], 0.051)
+        self.assertEqual(stats['p95'], 0.096)
+
+    def test_log_record(self):
+        with mock.patch.object(timing, 'logger') as logger:
+            logger.isEnabledFor.return_value = True
+            timing.record('filter', 0.25, 'class_styles', calls=2)
+        args, kw = logger.info.call_args
+        self.assertEqual(args[1:], (u'filter:class_styles', 250.0))
+        self.assertEqual(kw['extra'], {
+            'stage': u'filter:class_styles', 'duration_ms': 250.0,
+            'calls': 2,
+        })
+
+    def test_accumulator(self):
+        accumulator = timing.Accumulator('splitter', 'images')
+        func = accumulator.wrap(lambda value: value)
+        self.assertEqual(func(1), 1)
+        self.assertEqual(func(2), 2)
+        self.assertEqual(accumulator.calls, 2)
+        self.assertEqual(timing.stats(), {})
+        accumulator.record()
+        self.assertEqual(timing.stats()['splitter:images']['count'], 1)
+
+    def test_process_html_stages(self):
+        from kcrw.plone_apple_news.html import process_html
+        from kcrw.plone_apple_news.html import processor_registry
+        process_html(u'<p>text</p>', None)
+        stages = set(timing.stats())
+        self.assertIn('process_html', stages)
+        self.assertIn('resolve_uids', stages)
+        for name, func in processor_registry.filter_registry:
+            self.assertIn('filter:' + name, stages)
+        for name, matcher, splitter in processor_registry.splitter_registry:
+            self.assertIn('splitter:' + name, stages)
+
+    def test_serialize_stage(self):
+        # The JSON encoding of the article is part of the serialize stage
+        from kcrw.plone_apple_news import client
+        api = client.PooledAPI(u'key', u'c2VjcmV0', u'channel')
+        api.send_request = mock.Mock(return_value={})
+        now = [0.0]
+
+        def dumps(value):
+            now[0] += 1.0
+            return '{}'
+
+        with mock.patch.object(timing, 'clock', side_effect=lambda: now[0]), \
+                mock.patch.object(client.json, 'dumps', side_effect=dumps):
+            api.create_article({'title': u'Title'}, {'data': {}},
+                               {'image.jpg': b'data'})
+            api.update_article('id', {'data': {'revision': 'r'}})
+        stats = timing.stats()['serialize']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['total'], 3.0)
+        body = api.send_request.call_args_list[0][0][2]
+        self.assertIn(b'filename=article.json', body)
+        self.assertIn(b'filename=image.jpg', body)
+        self.assertEqual(api.send_request.call_args_list[1][0][:2],
+                         ('POST', 'articles/id'))
@@ -0,0 +1,93 @@
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from kcrw.plone_apple_news.utils import SETTINGS_KEY
+from kcrw.plone_apple_news.utils import SettingsSnapshot
+from kcrw.plone_apple_news.utils import article_digest
+from kcrw.plone_apple_news.utils import get_settings
+from kcrw.plone_apple_news.utils import settings_modified
+
+
+class TestArticleDigest(unittest.TestCase):
+
+    def setUp(self):
+        self.article = {
+            'title': u'Title',
+            'components': [{'role': 'body', 'text': u'Caf\xe9'}],
+            'metadata': {'dateModified': '2020-01-01', 'excerpt': u'Ex'},
+        }
+        self.metadata = {'data': {'isPreview': True}}
+        self.assets = {u'image.jpg': b'\xff\xd8data'}
+
+    def test_stable(self):
+        digest = article_digest(self.article, self.metadata, self.assets)
+        reordered = dict(reversed(list(self.article.items())))
+        self.assertEqual(
+            article_digest(reordered, self.metadata, dict(self.assets)),
+            digest
+        )
+
+    def test_ignores_modification_date(self):
+        digest = article_digest(self.article, self.metadata, self.assets)
+        self.article['metadata']['dateModified'] = '2020-02-02'
+        self.assertEqual(
+            article_digest(self.article, self.metadata, self.assets), digest
+        )
+
+    def test_changes(self):
+        digest = article_digest(self.article, self.metadata, self.assets)
+        self.assertNotEqual(
+            article_digest(self.article, {'data': {}}, self.assets), digest
+        )
+        self.assertNotEqual(
+            article_digest(self.article, self.metadata,
+                           {u'image.jpg': b'other'}), digest
+        )
+        self.article['metadata']['excerpt'] = u'Changed'
+        self.assertNotEqual(
+            article_digest(self.article, self.metadata, self.assets), digest
+        )
+
+
+class DummyProxy(object):
+    canonical_url = u'https://www.example.com'
+    footer_html = None
+
+
+@mock.patch('kcrw.plone_apple_news.utils.getRequest')
+@mock.patch('kcrw.plone_apple_news.utils.IAnnotations')
+@mock.patch('kcrw.plone_apple_news.utils.queryUtility')
+class TestSettings(unittest.TestCase):
+
+    def test_snapshot_read_only(self, registry, annotations, request):
+        settings = SettingsSnapshot(DummyProxy())
+        self.assertEqual(settings.canonical_url, u'https://www.example.com')
+        self.assertIsNone(settings.api_key_id)
+        with self.assertRaises(AttributeError):
+            settings.canonical_url = u'http://other'
+
+    def test_cached_on_request(self, registry, annotations, request):
+        cache = annotations.return_value = {}
+        registry.return_value.forInterface.return_value = DummyProxy()
+        settings = get_settings()
+        self.assertIs(get_settings(), settings)
+        self.assertIs(cache[SETTINGS_KEY], settings)
+        self.assertEqual(registry.return_value.forInterface.call_count, 1)
+
+        event = mock.Mock()
+        event.record.__name__ = 'plone.other_setting'
+        settings_modified(event)
+        self.assertIs(get_settings(), settings)
+        event.record.__name__ = 'kcrw.apple_news.canonical_url'
+        settings_modified(event)
+        self.assertIsNot(get_settings(), settings)
+        self.assertEqual(registry.return_value.forInterface.call_count, 2)
+
+    def test_without_request(self, registry, annotations, request):
+        request.return_value = None
+        registry.return_value.forInterface.return_value = DummyProxy()
+        self.assertIsNot(get_settings(), get_settings())
+        registry.return_value = None
+        self.assertEqual(get_settings(), {})
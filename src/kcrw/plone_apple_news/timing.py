@@ -0,0 +1,191 @@
+"""Timing of the stages of article generation and publishing.
+
+Disabled by default, set the ``KCRW_APPLE_NEWS_TIMING`` environment
+variable (e.g. in the instance's ``environment-vars``) or call ``enable()``
+to turn it on. While enabled, each timed stage is logged as a structured
+record to the ``kcrw.plone_apple_news.timing`` logger, with ``stage`` and
+``duration_ms`` attributes, and aggregated in memory: see ``stats()``.
+
+Stages are timed with::
+
+    with timer('api', 'create_article'):
+        ...
+
+When disabled ``timer`` returns a shared no-op context manager, and
+``timed`` functions are called directly.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+# Number of recent durations of each stage kept to compute percentiles
+SAMPLE_SIZE = 1000
+
+logger = logging.getLogger('kcrw.plone_apple_news.timing')
+clock = getattr(time, 'perf_counter', time.time)
+
+enabled = bool(os.environ.get('KCRW_APPLE_NEWS_TIMING'))
+
+_stages = {}
+_stages_lock = threading.Lock()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def percentile(values, fraction):
+    """Returns the value at ``fraction`` of the sorted ``values``"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class StageStats(object):
+    """Count, total and maximum duration of a stage, and its most recent
+    durations for percentiles"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.samples.append(seconds)
+
+    def summary(self):
+        with self._lock:
+            samples = list(self.samples)
+            return {
+                'count': self.count,
+                'total': self.total,
+                'max': self.max,
+                'p50': percentile(samples, 0.5),
+                'p95': percentile(samples, 0.95),
+            }
+
+
+def stage_key(stage, name=None):
+    if name is None:
+        return stage
+    return u'{}:{}'.format(stage, name)
+
+
+def record(stage, seconds, name=None, **info):
+    """Logs and aggregates a duration of ``stage``, ``name`` distinguishes
+    e.g. individual filters or API methods. ``info`` is added to the log
+    record."""
+    key = stage_key(stage, name)
+    stats = _stages.get(key)
+    if stats is None:
+        with _stages_lock:
+            stats = _stages.setdefault(key, StageStats())
+    stats.add(seconds)
+    if logger.isEnabledFor(logging.INFO):
+        info.update(stage=key, duration_ms=seconds * 1e3)
+        logger.info(u'%s took %.1f ms', key, seconds * 1e3, extra=info)
+
+
+class Timer(object):
+    """Records the time spent in a ``with`` block"""
+
+    def __init__(self, stage, name=None, info=None):
+        self.stage = stage
+        self.name = name
+        self.info = info or {}
+        self.start = None
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.stage, clock() - self.start, self.name, **self.info)
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def timer(stage, name=None, **info):
+    """Returns a context manager timing a stage, if enabled"""
+    if not enabled:
+        return NULL_TIMER
+    return Timer(stage, name, info)
+
+
+def timed(stage, name=None):
+    """Decorates a function to time its calls as ``stage``"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kw):
+            if not enabled:
+                return func(*args, **kw)
+            with Timer(stage, name):
+                return func(*args, **kw)
+        return wrapper
+    return decorator
+
+
+class Accumulator(object):
+    """Accumulates the time of many calls to one or more functions, e.g. a
+    splitter applied to each element, recorded as a single duration"""
+
+    def __init__(self, stage, name=None, **info):
+        self.stage = stage
+        self.name = name
+        self.info = info
+        self.elapsed = 0.0
+        self.calls = 0
+
+    def wrap(self, func):
+        def wrapper(*args, **kw):
+            start = clock()
+            try:
+                return func(*args, **kw)
+            finally:
+                self.elapsed += clock() - start
+                self.calls += 1
+        return wrapper
+
+    def record(self):
+        record(self.stage, self.elapsed, self.name, calls=self.calls,
+               **self.info)
+
+
+def stats():
+    """Returns a mapping of stage keys to their ``count``, ``total``,
+    ``max``, ``p50`` and ``p95`` durations in seconds"""
+    with _stages_lock:
+        stages = list(_stages.items())
+    return dict((key, stats.summary()) for key, stats in stages)
+
+
+def reset():
+    with _stages_lock:
+        _stages.clear()
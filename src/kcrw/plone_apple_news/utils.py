@@ -1,23 +1,75 @@
+import hashlib
 import json
+import six
 from copy import deepcopy
+from zope.annotation.interfaces import IAnnotations
 from zope.component import queryUtility
+from zope.globalrequest import getRequest
+from zope.schema import getFieldNames
 from plone.registry.interfaces import IRegistry
+from .cache import render_cache
+from .cache import url_cache
 from .interfaces import IAppleNewsSettings
 from .templates import ARTICLE_BASE
+from .timing import timed
+from .timing import timer
 from kcrw.plone_apple_news import _
 
 SEP = _(u'list_separator', default=u',')
 FINAL_SEP = _(u'final_list_seperator', default=u' and')
+# Article metadata which changes without any change to the article content
+DIGEST_IGNORED_METADATA = frozenset(('dateModified',))
+
+
+SETTINGS_PREFIX = 'kcrw.apple_news'
+SETTINGS_KEY = 'kcrw.apple_news.settings'
+
+
+class SettingsSnapshot(object):
+    """A read-only copy of the Apple News settings, so that reading a
+    setting doesn't require a registry lookup"""
+
+    def __init__(self, proxy):
+        for name in getFieldNames(IAppleNewsSettings):
+            self.__dict__[name] = getattr(proxy, name, None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Apple News settings snapshot is read-only')
 
 
 def get_settings():
-    registry = queryUtility(IRegistry)
-    if registry is not None:
-        return registry.forInterface(
-            IAppleNewsSettings, prefix='kcrw.apple_news',
-            check=False
-        )
-    return {}
+    """Returns a snapshot of the Apple News settings, which is cached on
+    the current request"""
+    request = getRequest()
+    cache = None
+    if request is not None:
+        cache = IAnnotations(request, None)
+        if cache is not None and SETTINGS_KEY in cache:
+            return cache[SETTINGS_KEY]
+    with timer('settings'):
+        registry = queryUtility(IRegistry)
+        if registry is None:
+            return {}
+        settings = SettingsSnapshot(registry.forInterface(
+            IAppleNewsSettings, prefix=SETTINGS_PREFIX, check=False
+        ))
+    if cache is not None:
+        cache[SETTINGS_KEY] = settings
+    return settings
+
+
+def settings_modified(event):
+    """Discard the cached settings when a setting is changed"""
+    name = getattr(event.record, '__name__', None) or ''
+    if not name.startswith(SETTINGS_PREFIX + '.'):
+        return
+    if name == SETTINGS_PREFIX + '.canonical_url':
+        url_cache.clear()
+        render_cache.clear()
+    request = getRequest()
+    cache = request is not None and IAnnotations(request, None)
+    if cache and SETTINGS_KEY in cache:
+        del cache[SETTINGS_KEY]
 
 
 def pretty_text_list(entries, context):
@@ -51,11 +103,37 @@ def mergedicts(dict1, dict2):
             yield (k, dict2[k])
 
 
-def article_base():
-    settings = get_settings()
-    custom = getattr(settings, 'article_customizations', None)
-    base = deepcopy(ARTICLE_BASE)
-    if custom and custom.strip():
-        custom = json.loads(custom)
-        return dict(mergedicts(base, custom))
-    return base
+def article_base(settings=None):
+    if settings is None:
+        settings = get_settings()
+    with timer('article_base'):
+        custom = getattr(settings, 'article_customizations', None)
+        base = deepcopy(ARTICLE_BASE)
+        if custom and custom.strip():
+            custom = json.loads(custom)
+            return dict(mergedicts(base, custom))
+        return base
+
+
+@timed('digest')
+def article_digest(article, metadata=None, assets=None):
+    """Returns a stable digest of the article JSON, request metadata and
+    asset data for an article upload"""
+    article = dict(article)
+    article['metadata'] = {
+        k: v for k, v in article.get('metadata', {}).items()
+        if k not in DIGEST_IGNORED_METADATA
+    }
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        [article, metadata], sort_keys=True, separators=(',', ':')
+    ).encode('utf8'))
+    for name in sorted(assets or ()):
+        data = assets[name]
+        if isinstance(name, six.text_type):
+            name = name.encode('utf8')
+        if isinstance(data, six.text_type):
+            data = data.encode('utf8')
+        digest.update(name)
+        digest.update(data)
+    return digest.hexdigest()